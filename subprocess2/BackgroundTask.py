@@ -6,18 +6,424 @@
     
   BackgroundTaskInfo - This is the data structure returned immediately from Popen.runInBackground.
 
+  StreamBuffer - Accumulates the data read from one stream of a background task
+
+  CompressedStreamBuffer - A StreamBuffer which keeps its data compressed (zlib or lzma) until accessed
+
   _py_read1 - Pure-python implementation of read1 method for non-blocking stream I/O 
 
   BackgroundTaskThread - The work implementation of the thread spawned by Popen.runInBackground
 
+  startBackgroundTask - Starts a BackgroundTaskThread managing a pipe, populating a given BackgroundTaskInfo
+
+  checkBackgroundKwargs - Checks arguments for startBackgroundTask before a process is started
+
 '''
 
 # vim: ts=4 sw=4 expandtab :
 
+import bisect
+import codecs
+import re
 import select
 import sys
 import threading
 import time
+import zlib
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from . import SUBPROCESS2_PROCESS_COMPLETED
+from .chunklog import ChunkLog
+from .pipeio import AdaptiveReadSize, DEFAULT_MAX_READ_SIZE, getStreamNum, setPipeSize, closePipeStreams
+from .ptyio import ControlSequenceStripper, isPtyEndOfFile
+from .reaper import getReaper
+from .registry import getRegistry
+from .records import RecordParser
+from .sampler import getSampler, ResourceTimeline, DEFAULT_MAX_SAMPLES
+from .tee import getTeeTargets
+
+
+class StreamBuffer(object):
+    '''
+        StreamBuffer - Accumulates the data read from one stream of a background task.
+
+            Appending a chunk is O(1). The chunks are only joined when the full value is requested, and the result is kept,
+              so repeatedly growing a large buffer does not re-copy everything read so far on every read.
+
+            The start offset of every chunk is tracked, so #getSince only copies the data past the given offset.
+
+        @param empty <bytes/str> - The empty value of the type held by this buffer ( b'' or '' )
+    '''
+
+    def __init__(self, empty=b''):
+        self.empty = empty
+        self.chunks = []
+        # chunkOffsets - The offset within the full value at which each entry in #chunks begins
+        self.chunkOffsets = []
+        self.length = 0
+        self.lock = threading.Lock()
+
+    def append(self, data):
+        '''
+            append - Add data to the end of this buffer
+
+            @param data <bytes/str> - Data to add
+        '''
+        with self.lock:
+            self.chunks.append(data)
+            self.chunkOffsets.append(self.length)
+            self.length += len(data)
+
+    def getValue(self):
+        '''
+            getValue - Get all data in this buffer
+
+            @return <bytes/str> - Everything appended so far
+        '''
+        with self.lock:
+            chunks = self.chunks
+            if not chunks:
+                return self.empty
+            if len(chunks) > 1:
+                self.chunks = chunks = [self.empty.join(chunks)]
+                self.chunkOffsets = [0]
+            return chunks[0]
+
+    def getSince(self, offset):
+        '''
+            getSince - Get the data in this buffer past a given offset
+
+            @param offset <int> - Offset to start at
+
+            @return <bytes/str> - Everything appended after #offset
+        '''
+        with self.lock:
+            if offset >= self.length:
+                return self.empty
+            offset = max(0, offset)
+
+            chunks = self.chunks
+            # Find the chunk containing #offset, and slice from there.
+            idx = bisect.bisect_right(self.chunkOffsets, offset) - 1
+            firstChunk = chunks[idx][offset - self.chunkOffsets[idx]:]
+            if idx == len(chunks) - 1:
+                return firstChunk
+            return self.empty.join([firstChunk] + chunks[idx + 1:])
+
+    def getRange(self, offset, length):
+        '''
+            getRange - Get a range of the data in this buffer
+
+            @param offset <int> - Offset to start at
+
+            @param length <int> - Max length to return
+
+            @return <bytes/str> - The data from #offset to #offset + #length
+        '''
+        with self.lock:
+            if offset >= self.length or length <= 0:
+                return self.empty
+            offset = max(0, offset)
+            endOffset = min(offset + length, self.length)
+
+            chunks = self.chunks
+            chunkOffsets = self.chunkOffsets
+            idx = bisect.bisect_right(chunkOffsets, offset) - 1
+            endIdx = bisect.bisect_left(chunkOffsets, endOffset) - 1
+            if idx == endIdx:
+                # Entirely within one chunk (the usual case, when replaying a ChunkLog)
+                return chunks[idx][offset - chunkOffsets[idx]:endOffset - chunkOffsets[idx]]
+
+            return self.empty.join(chunks[idx:endIdx + 1])[offset - chunkOffsets[idx]:endOffset - chunkOffsets[idx]]
+
+    def iterData(self, offset=0):
+        '''
+            iterData - Iterate over the data in this buffer, in the chunks it was appended in
+
+            @param offset <int> - Offset to start at
+
+            @return generator<bytes/str> - The data, in order
+        '''
+        data = self.getSince(offset)
+        if data:
+            yield data
+
+    def flush(self):
+        '''
+            flush - Nothing to do, this buffer is not compressed. @see CompressedStreamBuffer.flush
+        '''
+        pass
+
+    def setValue(self, value):
+        '''
+            setValue - Replace the contents of this buffer
+
+            @param value <bytes/str> - New contents
+        '''
+        with self.lock:
+            self.chunks = [value]
+            self.chunkOffsets = [0]
+            self.length = len(value)
+
+    def __len__(self):
+        return self.length
+
+
+# Supported values for "compress"
+COMPRESS_ZLIB = 'zlib'
+COMPRESS_LZMA = 'lzma'
+
+# lzma preset used for captured output. Higher presets need ~100MiB of memory per compressor, and text compresses well at low presets anyway.
+_LZMA_PRESET = 1
+
+
+class CompressedStreamBuffer(object):
+    '''
+        CompressedStreamBuffer - A StreamBuffer which holds its data compressed (zlib or lzma), for keeping large, compressible output in memory.
+
+            Data is compressed as it is appended. It is only decompressed when accessed, and #iterData can be used to stream it back out
+              without holding all of it decompressed at once.
+
+            The data is stored as a series of compressed frames. Reading ends the current frame (so everything appended so far can be read),
+              and later data starts a new one, so frequent reads of a running task make the compression somewhat less effective.
+
+            Offsets and lengths are of the (decoded) data, same as StreamBuffer.
+
+        @param empty <bytes/str> - The empty value of the type held by this buffer ( b'' or '' )
+
+        @param compress <str> - "zlib" or "lzma"
+
+        @param encoding <False/str> - If the data is str, the codec used to convert it to bytes for compression
+    '''
+
+    def __init__(self, empty=b'', compress=COMPRESS_ZLIB, encoding=False):
+        if compress == COMPRESS_ZLIB:
+            self._newCompressor = zlib.compressobj
+            self._decompress = zlib.decompress
+        elif compress == COMPRESS_LZMA:
+            try:
+                import lzma
+            except ImportError:
+                raise ValueError('lzma compression is not available in this python.')
+            self._newCompressor = lambda : lzma.LZMACompressor(preset=_LZMA_PRESET)
+            self._decompress = lzma.decompress
+        else:
+            raise ValueError('Unknown compress: %s. Should be "zlib" or "lzma".' %(repr(compress), ))
+
+        self.empty = empty
+        self.compress = compress
+        self.encoding = encoding
+
+        # frames - Compressed frames, each holding the data from the matching entry in #frameOffsets up to the next
+        self.frames = []
+        self.frameOffsets = []
+
+        # The frame currently being written. The compressor is only created once there is data, as it may be large.
+        self.compressor = None
+        self.currentChunks = []
+        self.currentOffset = 0
+
+        self.length = 0
+        # rawLength / compressedLength - Bytes given to / produced by the compressors, for #compressionRatio
+        self.rawLength = 0
+        self.compressedLength = 0
+        self.lock = threading.Lock()
+
+        # rangeCursor - None, or tuple( <int> frame offset, <bytes/str> decompressed frame ) of the last frame #getRange read from,
+        #   so reading ranges in order (e.x. BackgroundTaskInfo.iterTimeline) decompresses each frame once. Frames never change once ended.
+        self.rangeCursor = None
+
+    def append(self, data):
+        '''
+            append - Compress and add data to the end of this buffer
+
+            @param data <bytes/str> - Data to add
+        '''
+        raw = data
+        if self.encoding:
+            raw = data.encode(self.encoding)
+
+        with self.lock:
+            if self.compressor is None:
+                self.compressor = self._newCompressor()
+            compressed = self.compressor.compress(raw)
+            if compressed:
+                self.currentChunks.append(compressed)
+                self.compressedLength += len(compressed)
+            self.rawLength += len(raw)
+            self.length += len(data)
+
+    def flush(self):
+        '''
+            flush - Finish compressing everything appended so far. Call once no more data will be appended, so nothing is left inside the compressor.
+        '''
+        with self.lock:
+            self._endFrame()
+
+    def _endFrame(self):
+        '''
+            _endFrame - INTERNAL. Finish the current frame, so all data appended so far can be decompressed. Called with #lock held.
+        '''
+        if self.compressor is None:
+            return
+        compressed = self.compressor.flush()
+        self.compressedLength += len(compressed)
+        self.currentChunks.append(compressed)
+
+        self.frames.append(b''.join(self.currentChunks))
+        self.frameOffsets.append(self.currentOffset)
+
+        self.compressor = None
+        self.currentChunks = []
+        self.currentOffset = self.length
+
+    def _getFrames(self, offset):
+        '''
+            _getFrames - INTERNAL. Get the frames holding the data at and after #offset
+
+            @return tuple( list<bytes> frames, <int> offset of the first frame )
+        '''
+        with self.lock:
+            self._endFrame()
+            if offset >= self.length or not self.frames:
+                return ([], self.length)
+            idx = bisect.bisect_right(self.frameOffsets, max(0, offset)) - 1
+            return (self.frames[idx:], self.frameOffsets[idx])
+
+    def _decompressFrame(self, frame):
+        data = self._decompress(frame)
+        if self.encoding:
+            data = data.decode(self.encoding)
+        return data
+
+    def iterData(self, offset=0):
+        '''
+            iterData - Decompress the data in this buffer one frame at a time
+
+            @param offset <int> - Offset to start at
+
+            @return generator<bytes/str> - The data, in order
+        '''
+        (frames, frameOffset) = self._getFrames(offset)
+        for frame in frames:
+            data = self._decompressFrame(frame)
+            nextFrameOffset = frameOffset + len(data)
+            if offset > frameOffset:
+                # Only the first frame can start before #offset
+                data = data[offset - frameOffset:]
+            frameOffset = nextFrameOffset
+            yield data
+
+    def getValue(self):
+        '''
+            getValue - Get all data in this buffer, decompressed
+
+            @return <bytes/str> - Everything appended so far
+        '''
+        return self.empty.join(self.iterData())
+
+    def getSince(self, offset):
+        '''
+            getSince - Get the data in this buffer past a given offset. Only the frames holding that data are decompressed.
+
+            @param offset <int> - Offset to start at
+
+            @return <bytes/str> - Everything appended after #offset
+        '''
+        if offset >= self.length:
+            return self.empty
+        return self.empty.join(self.iterData(max(0, offset)))
+
+    def getRange(self, offset, length):
+        '''
+            getRange - Get a range of the data in this buffer
+
+            @param offset <int> - Offset to start at
+
+            @param length <int> - Max length to return
+
+            @return <bytes/str> - The data from #offset to #offset + #length
+        '''
+        if offset >= self.length or length <= 0:
+            return self.empty
+        offset = max(0, offset)
+        parts = []
+        remaining = length
+        while remaining > 0:
+            (frameOffset, data) = self._getFrameAt(offset)
+            part = data[offset - frameOffset : offset - frameOffset + remaining]
+            if not part:
+                break
+            parts.append(part)
+            offset += len(part)
+            remaining -= len(part)
+        return self.empty.join(parts)
+
+    def _getFrameAt(self, offset):
+        '''
+            _getFrameAt - INTERNAL. Get the decompressed frame holding #offset, reusing #rangeCursor if it is that frame.
+
+            @return tuple( <int> frame offset, <bytes/str> decompressed frame ) - The frame is empty if #offset is past the end.
+        '''
+        rangeCursor = self.rangeCursor
+        if rangeCursor is not None and rangeCursor[0] <= offset < rangeCursor[0] + len(rangeCursor[1]):
+            return rangeCursor
+
+        with self.lock:
+            self._endFrame()
+            if offset >= self.length or not self.frames:
+                return (offset, self.empty)
+            idx = bisect.bisect_right(self.frameOffsets, offset) - 1
+            (frame, frameOffset) = (self.frames[idx], self.frameOffsets[idx])
+
+        rangeCursor = (frameOffset, self._decompressFrame(frame))
+        self.rangeCursor = rangeCursor
+        return rangeCursor
+
+    def releaseRangeCursor(self):
+        '''
+            releaseRangeCursor - Drop the decompressed frame kept by #getRange, once done reading ranges
+        '''
+        self.rangeCursor = None
+
+    def setValue(self, value):
+        '''
+            setValue - Replace the contents of this buffer
+
+            @param value <bytes/str> - New contents
+        '''
+        with self.lock:
+            self.frames = []
+            self.frameOffsets = []
+            self.compressor = None
+            self.currentChunks = []
+            self.currentOffset = 0
+            self.length = self.rawLength = self.compressedLength = 0
+            self.rangeCursor = None
+        if value:
+            self.append(value)
+
+    @property
+    def compressionRatio(self):
+        '''
+            compressionRatio - Size of the data divided by its compressed size so far (e.x. 10.0 means one tenth the memory). None if there is no data yet.
+
+                Data still inside the compressor (not yet emitted) is not counted, so this is approximate while data is being added.
+        '''
+        if not self.rawLength or not self.compressedLength:
+            return None
+        return float(self.rawLength) / self.compressedLength
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return 'CompressedStreamBuffer(compress=%s, length=%d, compressedLength=%d)' %(repr(self.compress), self.length, self.compressedLength)
+
 
 class BackgroundTaskInfo(object):
     '''
@@ -36,38 +442,312 @@ class BackgroundTaskInfo(object):
             isFinished - False while the background application is running, True when it completes.
             returnCode - None if the program has not completed, otherwise the numeric return code.
             timeElapsed - Float of how many seconds have elapsed since the last update (updates happen very close to the "pollInterval" provided when calling runInBackground)
+            records - If runInBackground was called with "records", the records parsed from stdout so far (stdoutData is then not stored).
+            recordErrors - If runInBackground was called with "records", a list of tuple( line, error message ) for lines which failed to parse.
+            limitExceeded - If started with resource limits (@see Simple.runInBackground), set on completion to None or the limit which appears to have stopped the process ("cpu", "memory", "openFiles").
+            resourceTimeline - If runInBackground was called with "sampleInterval", a subprocess2.sampler.ResourceTimeline of the CPU time and RSS of the process over time. Otherwise None.
+            chunkLog - If runInBackground was called with "chunkLog=True", a subprocess2.chunklog.ChunkLog recording when each chunk of stdoutData/stderrData was read. Otherwise None.
+            compressionRatio - If runInBackground was called with "compress", the size of the output divided by the memory it is using compressed. Otherwise None.
+            error - None, or a string of the error if the background thread failed (e.x. output could not be decoded). The task is still marked finished,
+              but returnCode may be None if the process was still running. It is collected when it exits.
+
+        To incrementally consume output while the program runs, use #readNew / #waitForNew with a cursor, rather than re-reading stdoutData.
+
+        To block until the program prints something (like a server printing that it is ready), use #waitForOutput
+
+        With "compress", stdoutData/stderrData decompress all of the output on every access. Use #readNew with a cursor, or #iterData, to avoid that.
+
+        To replay stdout and stderr interleaved in the order they were read (requires "chunkLog=True"), use #iterTimeline
+
+        To consume output through a bounded queue, so a slow consumer makes the child wait rather than output piling up in memory
+          (requires "chunkQueueSize"), use #iterChunks
 
     '''
 
     # All fields for export
-    FIELDS = ('stdoutData', 'stderrData', 'isFinished', 'returnCode', 'timeElapsed', 'encoding')
+    FIELDS = ('stdoutData', 'stderrData', 'isFinished', 'returnCode', 'timeElapsed', 'encoding', 'records', 'recordErrors', 'resourceTimeline', 'limitExceeded', 'chunkLog', 'compressionRatio', 'error')
 
     def __init__(self, encoding=False):
-        self.stdoutData = b''
-        self.stderrData = b''
+        empty = b''
         self.encoding = encoding
         if encoding:
             try:
-                self.stdoutData = self.stdoutData.decode(encoding)
-                self.stderrData = self.stderrData.decode(encoding)
+                empty = empty.decode(encoding)
             except Exception as e:
                 raise ValueError('Cannot decode using codec %s: %s' %(repr(encoding), str(e)))
+        # _streamBuffers - Map of stream number (1 = stdout, 2 = stderr) to the StreamBuffer holding its data
+        self._streamBuffers = {
+            1 : StreamBuffer(empty),
+            2 : StreamBuffer(empty),
+        }
+        # _dataCondition - Notified whenever data is added or the task finishes
+        self._dataCondition = threading.Condition()
+        # _finishCallbacks - Functions called with this object as the only argument, after the task has finished
+        self._finishCallbacks = []
         self.isFinished = False
         self.returnCode = None
         self.timeElapsed = 0
+        self.records = []
+        self.recordErrors = []
+        self.resourceTimeline = None
+        self.limitExceeded = None
+        self.chunkLog = None
+        self.error = None
+        # _chunkQueue - If consuming through #iterChunks, a bounded queue of tuple( stream number, data ), ending with ( None, None )
+        self._chunkQueue = None
+        # _chunkQueueDone - Set once the end of #_chunkQueue has been consumed
+        self._chunkQueueDone = False
+        # _chunkConsumerClosed - Set if the consumer stopped iterating early. Further output is discarded.
+        self._chunkConsumerClosed = False
+
+    @property
+    def stdoutData(self):
+        return self._streamBuffers[1].getValue()
+
+    @stdoutData.setter
+    def stdoutData(self, value):
+        self._streamBuffers[1].setValue(value)
+
+    @property
+    def stderrData(self):
+        return self._streamBuffers[2].getValue()
+
+    @stderrData.setter
+    def stderrData(self, value):
+        self._streamBuffers[2].setValue(value)
+
+    @property
+    def bufferedSize(self):
+        '''
+            bufferedSize - Size of the output currently held in memory for stdout and stderr (compressed size, if compressing)
+        '''
+        return sum([ getattr(streamBuffer, 'compressedLength', len(streamBuffer)) for streamBuffer in self._streamBuffers.values() ])
+
+    def _setCompression(self, compress):
+        '''
+            _setCompression - INTERNAL. Store output compressed. Must be called before any output is added.
+
+            @param compress <str> - "zlib" or "lzma"
+        '''
+        empty = self._streamBuffers[1].empty
+        self._streamBuffers = {
+            1 : CompressedStreamBuffer(empty, compress, self.encoding),
+            2 : CompressedStreamBuffer(empty, compress, self.encoding),
+        }
+
+    @property
+    def compressionRatio(self):
+        '''
+            compressionRatio - If output is being compressed, the size of stdout and stderr divided by their compressed size (None if no output yet). Otherwise None.
+        '''
+        rawLength = 0
+        compressedLength = 0
+        for streamBuffer in self._streamBuffers.values():
+            rawLength += getattr(streamBuffer, 'rawLength', 0)
+            compressedLength += getattr(streamBuffer, 'compressedLength', 0)
+        if not rawLength or not compressedLength:
+            return None
+        return float(rawLength) / compressedLength
+
+    def iterData(self, stream='stdout', cursor=0):
+        '''
+            iterData - Iterate over the data read from a stream in pieces. With "compress", this decompresses one frame at a time,
+              so large compressed output can be processed without holding all of it decompressed.
+
+            @param stream <str> - "stdout" or "stderr"
+
+            @param cursor <int> - Offset to start at (@see #readNew)
+
+            @return generator<bytes/str> - The data, in order
+        '''
+        return self._streamBuffers[getStreamNum(stream)].iterData(cursor)
+
+    def _addData(self, streamNum, data):
+        '''
+            _addData - INTERNAL. Called by the background thread to add data read from a stream.
+
+            @param streamNum <int> - 1 for stdout, 2 for stderr
+
+            @param data <bytes/str> - The data read (already decoded, if an encoding is set)
+        '''
+        with self._dataCondition:
+            streamBuffer = self._streamBuffers[streamNum]
+            if self.chunkLog is not None:
+                self.chunkLog.add(streamNum, len(streamBuffer), len(data))
+            streamBuffer.append(data)
+            self._dataCondition.notify_all()
+
+    def _addRecords(self, records):
+        '''
+            _addRecords - INTERNAL. Called by the background thread to add records parsed from stdout.
+
+            @param records list<object> - The parsed records
+        '''
+        if not records:
+            return
+        with self._dataCondition:
+            self.records += records
+            self._dataCondition.notify_all()
+
+    def _markFinished(self, returnCode):
+        '''
+            _markFinished - INTERNAL. Called by the background thread when the process has completed and all output has been read.
+
+            @param returnCode <int> - The return code of the process
+        '''
+        for streamBuffer in self._streamBuffers.values():
+            # No more data will be added, so nothing needs to be held back in a compressor
+            streamBuffer.flush()
+
+        with self._dataCondition:
+            self.returnCode = returnCode
+            self.isFinished = True
+            self._dataCondition.notify_all()
+
+        for finishCallback in self._finishCallbacks:
+            finishCallback(self)
+
+    def _putChunk(self, streamNum, data, pollInterval=.1):
+        '''
+            _putChunk - INTERNAL. Called by the background thread to queue a chunk for #iterChunks. Blocks while the queue is full,
+              so the thread stops reading and the child blocks on its pipe.
+
+            @param streamNum <int/None> - 1 for stdout, 2 for stderr, or None to mark the end of output
+
+            @param data <bytes/str/None> - The data read
+        '''
+        while self._chunkConsumerClosed is False:
+            try:
+                self._chunkQueue.put( (streamNum, data), True, pollInterval )
+                return
+            except queue.Full:
+                continue
+
+    def iterChunks(self):
+        '''
+            iterChunks - Iterate over output as it is read, in the order it was read. Requires runInBackground to have been called with "chunkQueueSize".
+
+                Output is handed over through a queue of at most "chunkQueueSize" chunks, and is NOT stored in stdoutData/stderrData.
+                  While the queue is full, the background thread stops reading, so the child blocks writing to its pipe
+                  and memory use stays bounded no matter how slow the consumer is.
+
+                If iteration is stopped early (break, or the iterator is closed/garbage collected), the rest of the output is discarded
+                  so the child can run to completion.
+
+                Only one iterator should be used at a time.
+
+            @return generator< tuple( <str> streamName, <bytes/str> data ) > - Ends once the task has finished and all output has been consumed
+
+            @raises ValueError - If the task was not started with a chunk queue
+        '''
+        if self._chunkQueue is None:
+            raise ValueError('No chunk queue was created. Call runInBackground with chunkQueueSize.')
+
+        streamNames = {
+            1 : 'stdout',
+            2 : 'stderr',
+        }
+
+        isComplete = False
+        try:
+            while self._chunkQueueDone is False:
+                (streamNum, data) = self._chunkQueue.get()
+                if streamNum is None:
+                    self._chunkQueueDone = True
+                    break
+                yield (streamNames[streamNum], data)
+            isComplete = True
+        finally:
+            if isComplete is False:
+                self._chunkConsumerClosed = True
+
+    def iterTimeline(self, start=0):
+        '''
+            iterTimeline - Replay the output of stdout and stderr interleaved, in the order it was read. Requires runInBackground to have been called with "chunkLog=True".
+
+                Chunks read at about the same time on different streams are ordered by when the background thread read them,
+                  which is as close as the parent can get to the order the child wrote them.
+
+            @param start <int> - Index of the first chunk to return. Pass the number of chunks already seen to continue from a previous call.
+
+            @return generator< tuple( <float> time, <str> streamName, <bytes/str> data ) > - time is seconds since the task started being read
+
+            @raises ValueError - If the task was not started with a chunk log
+        '''
+        if self.chunkLog is None:
+            raise ValueError('No chunk log was recorded. Call runInBackground with chunkLog=True.')
+
+        streamBuffers = {
+            'stdout' : self._streamBuffers[1],
+            'stderr' : self._streamBuffers[2],
+        }
+        try:
+            for (chunkTime, streamName, offset, length) in self.chunkLog.entries(start):
+                yield (chunkTime, streamName, streamBuffers[streamName].getRange(offset, length))
+        finally:
+            # Compressed buffers keep the last frame read decompressed, so in-order ranges do not each decompress it again
+            for streamBuffer in streamBuffers.values():
+                if issubclass(streamBuffer.__class__, CompressedStreamBuffer):
+                    streamBuffer.releaseRangeCursor()
+
+    def readNew(self, stream='stdout', cursor=0):
+        '''
+            readNew - Read only the data which has been added to a stream since #cursor. Does not block.
+
+                Start with cursor=0, and pass the returned cursor into the next call. Only the new data is copied.
+
+            @param stream <str/int> - "stdout" (or 1) or "stderr" (or 2)
+
+            @param cursor <int> - Offset returned by the previous call, or 0 to read from the beginning
+
+            @return tuple( <bytes/str> data, <int> newCursor ) - Data added since #cursor (empty if none), and the cursor to use next time.
+        '''
+        streamBuffer = self._streamBuffers[getStreamNum(stream)]
+        with self._dataCondition:
+            newCursor = len(streamBuffer)
+            return (streamBuffer.getSince(cursor), max(cursor, newCursor))
+
+    def waitForNew(self, stream='stdout', cursor=0, timeout=None):
+        '''
+            waitForNew - Like #readNew, but if there is no new data, block until some arrives, the task finishes, or #timeout expires.
+
+            @param stream <str/int> - "stdout" (or 1) or "stderr" (or 2)
+
+            @param cursor <int> - Offset returned by the previous call, or 0 to read from the beginning
+
+            @param timeout <None/float> - None to wait forever, otherwise max number of seconds to wait
+
+            @return tuple( <bytes/str> data, <int> newCursor ) - Data added since #cursor, and the cursor to use next time.
+                Data will be empty if the timeout expired, or the task finished with no new data.
+        '''
+        streamBuffer = self._streamBuffers[getStreamNum(stream)]
+        if timeout is not None:
+            endTime = time.time() + timeout
+
+        with self._dataCondition:
+            while len(streamBuffer) <= cursor and self.isFinished is False:
+                if timeout is None:
+                    self._dataCondition.wait()
+                else:
+                    remaining = endTime - time.time()
+                    if remaining <= 0:
+                        break
+                    self._dataCondition.wait(remaining)
+
+            return self.readNew(stream, cursor)
 
 
     def __contains__(self, name):
-        return bool(name in BackgroundTaskInfo.FIELDS)
+        return bool(name in self.FIELDS)
 
     def __getitem__(self, name):
         if not name in self:
-            raise KeyError("%s is not a field of BackgroundTaskInfo. Possible fields are: %s" %(name, ', '.join(BackgroundTaskInfo.FIELDS)))
+            raise KeyError("%s is not a field of %s. Possible fields are: %s" %(name, self.__class__.__name__, ', '.join(self.FIELDS)))
         return getattr(self, name)
 
     def __setitem__(self, name, value):
         if not name in self:
-            raise KeyError("%s is not a field of BackgroundTaskInfo. Possible fields are: %s" %(name, ', '.join(BackgroundTaskInfo.FIELDS)))
+            raise KeyError("%s is not a field of %s. Possible fields are: %s" %(name, self.__class__.__name__, ', '.join(self.FIELDS)))
         setattr(self, name, value)
 
 
@@ -75,20 +755,83 @@ class BackgroundTaskInfo(object):
         return str(self.asDict())
 
     def keys(self):
-        return BackgroundTaskInfo.FIELDS
+        return self.FIELDS
 
     def items(self):
         return self.asDict().items()
 
 
+    def waitForOutput(self, pattern, timeout=None, stream='stdout', overlap=None):
+        '''
+            waitForOutput - Wait (Block current thread) until #pattern appears in the output of a stream, the task finishes, or #timeout expires.
+
+                This wakes up as data is read, and only scans the new data (plus #overlap of the data before it, so a match spanning two reads is still found).
+
+            @param pattern <bytes/str/compiled regex> - A literal to search for, or a compiled regular expression (from re.compile)
+
+                If a literal and not the same type as the stored data, it will be converted using the task's encoding (or utf-8).
+                A compiled regex must match the type of the stored data (bytes pattern if no encoding, str pattern if encoding was given).
+
+            @param timeout <None/float> - None to wait forever, otherwise max number of seconds to wait
+
+            @param stream <str/int> - "stdout" (or 1) or "stderr" (or 2)
+
+            @param overlap <None/int> - Number of already-scanned characters to include before the new data on each scan.
+                Default (None) is len(pattern) - 1 for a literal, and 4096 for a regex. A regex match longer than this that
+                arrives split across reads may be missed.
+
+            @return <re.Match/None> - The match object, or None if the timeout expired or the task finished without a match.
+                Note that the match positions are relative to the scanned window, not the start of the stream.
+        '''
+        streamBuffer = self._streamBuffers[getStreamNum(stream)]
+
+        if hasattr(pattern, 'search'):
+            regex = pattern
+            if overlap is None:
+                overlap = 4096
+        else:
+            empty = streamBuffer.empty
+            if type(pattern) != type(empty):
+                if issubclass(empty.__class__, bytes):
+                    pattern = pattern.encode(self.encoding or 'utf-8')
+                else:
+                    pattern = pattern.decode(self.encoding or 'utf-8')
+            regex = re.compile(re.escape(pattern))
+            if overlap is None:
+                overlap = max(0, len(pattern) - 1)
+
+        if timeout is not None:
+            endTime = time.time() + timeout
+
+        scannedUpTo = 0
+        with self._dataCondition:
+            while True:
+                dataLen = len(streamBuffer)
+                if dataLen > scannedUpTo or scannedUpTo == 0:
+                    match = regex.search(streamBuffer.getSince(max(0, scannedUpTo - overlap)))
+                    if match is not None:
+                        return match
+                    scannedUpTo = dataLen
+
+                if self.isFinished is True:
+                    return None
+
+                if timeout is None:
+                    self._dataCondition.wait()
+                else:
+                    remaining = endTime - time.time()
+                    if remaining <= 0:
+                        return None
+                    self._dataCondition.wait(remaining)
+
     def asDict(self):
         '''
             asDict - Returns a copy of the current state as a dictionary. This copy will not be updated automatically.
 
-            @return <dict> - Dictionary with all fields in BackgroundTaskInfo.FIELDS
+            @return <dict> - Dictionary with all fields in FIELDS
         '''
         ret = {}
-        for field in BackgroundTaskInfo.FIELDS:
+        for field in self.FIELDS:
             ret[field] = getattr(self, field)
         return ret
 
@@ -97,18 +840,22 @@ class BackgroundTaskInfo(object):
             waitToFinish - Wait (Block current thread), optionally with a timeout, until background task completes.
 
             @param timeout <None/float> - None to wait forever, otherwise max number of seconds to wait
-            @param pollInterval <float> - Seconds between each poll. Keep high if interactivity is not important, low if it is.
+            @param pollInterval <float> - Unused. The wait ends as soon as the task finishes. Kept for compatibility.
 
             @return - None if process did not complete (and timeout occured), otherwise the return code of the process is returned.
         '''
-        if timeout is None:
+        if timeout is not None:
+            endTime = time.time() + timeout
+
+        with self._dataCondition:
             while self.isFinished is False:
-                time.sleep(pollInterval)
-        else:
-            sleptFor = 0
-            while self.isFinished is False and sleptFor < timeout:
-                time.sleep(pollInterval)
-                sleptFor += pollInterval
+                if timeout is None:
+                    self._dataCondition.wait()
+                else:
+                    remaining = endTime - time.time()
+                    if remaining <= 0:
+                        break
+                    self._dataCondition.wait(remaining)
 
         return self.returnCode
 
@@ -124,7 +871,13 @@ def _py_read1(fileObj, maxBuffer):
     i = 0
     ret = []
     while i < maxBuffer:
-        c = fileObj.read(1)
+        try:
+            c = fileObj.read(1)
+        except (IOError, OSError) as e:
+            if not ret or not isPtyEndOfFile(e):
+                raise
+            # The child side of a pty has closed. Return what was read, the next read will fail the same way.
+            break
         if c == '':
             # Stream has been closed
             break
@@ -144,43 +897,93 @@ class BackgroundTaskThread(threading.Thread):
     '''
 
 
-    def __init__(self, pipe, taskInfo, pollInterval=.1, encoding=False):
+    def __init__(self, pipe, taskInfo, pollInterval=.1, encoding=False, teeTargets=None, teeCapture=True, maxReadSize=DEFAULT_MAX_READ_SIZE, recordParser=None, limits=None, stripper=None):
         threading.Thread.__init__(self)
         self.pipe = pipe
         self.taskInfo = taskInfo
         self.pollInterval = pollInterval
         self.encoding = encoding
+        self.maxReadSize = maxReadSize
+        # teeTargets - Map of stream number to a subprocess2.tee.TeeTarget which will receive a copy of that stream
+        self.teeTargets = teeTargets or {}
+        self.teeCapture = teeCapture
+        # recordParser - If set, a subprocess2.records.RecordParser which stdout is fed through instead of being stored
+        self.recordParser = recordParser
+        # limits - If set, the subprocess2.limits.ResourceLimits the process was started with, used to fill in taskInfo.limitExceeded
+        self.limits = limits
+        # cpuWatcher - If #limits has a CPU limit, tracks the CPU time of the process, so a SIGKILL can be attributed to that limit (or not)
+        self.cpuWatcher = limits and limits.getCpuTimeWatcher(pipe.pid)
+        # stripper - If set, a subprocess2.ptyio.ControlSequenceStripper which stdout is passed through before being stored or parsed
+        self.stripper = stripper
+        # bytesRead - Total bytes read from stdout and stderr (including any tee'd without being stored)
+        self.bytesRead = 0
+        # decoders - If #encoding is set, map of stream number to an incremental decoder, so a character split across two reads is decoded whole
+        self.decoders = {}
+        if encoding:
+            self.decoders = dict([ (streamNum, codecs.getincrementaldecoder(encoding)()) for streamNum in (1, 2) ])
         self.daemon = True # This is a background task, so if everything else is finished the program should exit
 
     def run(self):
+        taskInfo = self.taskInfo
+
+        returnCode = None
+        try:
+            returnCode = self._readUntilExit()
+
+            if self.limits is not None:
+                # Set by Popen.waitOrTerminate, if it stopped the process
+                actionTaken = getattr(self.pipe, '_subprocess2ActionTaken', SUBPROCESS2_PROCESS_COMPLETED)
+                taskInfo.limitExceeded = self.limits.getLimitExceeded(returnCode, taskInfo.stderrData or taskInfo.stdoutData, actionTaken,
+                    self.cpuWatcher and self.cpuWatcher.cpuSeconds)
+        except Exception as e:
+            # Still mark the task finished below, otherwise anything waiting on it (and its finish callbacks, like freeing a TaskQueue slot) would wait forever
+            taskInfo.error = '%s: %s' %(e.__class__.__name__, str(e))
+            returnCode = self.pipe.poll()
+
+        if taskInfo._chunkQueue is not None:
+            taskInfo._putChunk(None, None, self.pollInterval)
+
+        # sub process has completed, close out.
+        taskInfo._markFinished(returnCode)
+
+    def _readUntilExit(self):
+        '''
+            _readUntilExit - Read the streams until the process has exited and they are drained, then close them.
+
+            @return <int> - The return code of the process
+        '''
         startTime = time.time()
         timeElapsed = 0
         pipe = self.pipe
         taskInfo = self.taskInfo
         pollInterval = self.pollInterval
-        encoding = self.encoding
 
         # All streams we are going to manage
         streams = []
 
         # fileNoToStreamNo - This is a map of the streams to a number. That number is 1 for stdout, and 2 for stderr.
-        fileNoToStreamNo = {}
+        self.fileNoToStreamNo = fileNoToStreamNo = {}
+
+        # fileNoToReadSize - Map of fileno to an AdaptiveReadSize, which grows the read size while a stream is producing a lot of data.
+        self.fileNoToReadSize = fileNoToReadSize = {}
 
         # This is a flag we will set if read1 is missing on the file object (like python 2.7) and we need to do our own.
-        simulateRead1 = False
+        self.simulateRead1 = False
 
         if pipe.stdout:
             streams.append(pipe.stdout)
             fileNoToStreamNo[pipe.stdout.fileno()] = 1
+            fileNoToReadSize[pipe.stdout.fileno()] = AdaptiveReadSize(maxSize=self.maxReadSize)
             if not hasattr(pipe.stdout, 'read1'):
-                simulateRead1 = True
+                self.simulateRead1 = True
 
         if pipe.stderr:
             if not pipe.stdout or pipe.stderr.fileno() != pipe.stdout.fileno(): # Ensure that stdout and stderr aren't same stream
                 streams.append(pipe.stderr)
                 fileNoToStreamNo[pipe.stderr.fileno()] = 2
+                fileNoToReadSize[pipe.stderr.fileno()] = AdaptiveReadSize(maxSize=self.maxReadSize)
                 if not hasattr(pipe.stderr, 'read1'):
-                    simulateRead1 = True
+                    self.simulateRead1 = True
 
 
         if len(streams) > 0:
@@ -193,41 +996,242 @@ class BackgroundTaskThread(threading.Thread):
         else:
             hasPipedIO = False
 
-        # Poll here and see if we are already done before starting. We don't have to worry about missing a read of data 
-        #   on the stream, because the output would still be blocking and thus child could not exit.
-        returnCode = pipe.poll()
-        while returnCode is None:
-            time.sleep(pollInterval)
-
-            # timeElapsed needs to be calculated here to be accurate, since so much beyond counting-and-sleeping is happening.
-            timeElapsed = taskInfo.timeElapsed = (time.time() - startTime)
-
-            if hasPipedIO:
-                # Automaticly read stdout/stderr streams if they were set
-                (readyToRead, junk1, junk2) = select.select(streams, [], [], selectInterval)
-                if readyToRead:
-                    for stream in readyToRead:
-                        # Determine which stream we were returned by mapping fd to stream number
-                        ionum = fileNoToStreamNo[stream.fileno()]
-
-                        # Use read method that won't block on unfinished/un-newlined data on stream
-                        if simulateRead1 is False:
-                            data = stream.read1(4096)
-                        else:
-                            data = _py_read1(stream, 4096)
-
-                        if encoding:
-                            data = data.decode(encoding)
-
-                        # Append into correct location
-                        if ionum == 1:
-                            taskInfo.stdoutData += data
-                        elif ionum == 2:
-                            taskInfo.stderrData += data
-
+        try:
+            # Poll here and see if we are already done before starting. We don't have to worry about missing a read of data 
+            #   on the stream, because the output would still be blocking and thus child could not exit.
             returnCode = pipe.poll()
-        
-        # sub process has completed, close out.
-        taskInfo.returnCode = returnCode
-        taskInfo.isFinished = True
+            isHot = False
+
+            # The reaper collects the exit status as soon as the child exits, and wakes us from the pollInterval wait
+            exitedEvent = threading.Event()
+            if returnCode is None:
+                getReaper().register(pipe, lambda exitedPipe, exitCode : exitedEvent.set())
+
+            while returnCode is None:
+                if self.cpuWatcher is not None:
+                    self.cpuWatcher.update()
+
+                # If the last read filled its buffer, more data is probably already waiting, so go straight back to reading.
+                if not isHot:
+                    exitedEvent.wait(pollInterval)
+
+                # timeElapsed needs to be calculated here to be accurate, since so much beyond counting-and-sleeping is happening.
+                timeElapsed = taskInfo.timeElapsed = (time.time() - startTime)
+
+                if hasPipedIO and streams:
+                    # Automaticly read stdout/stderr streams if they were set
+                    self._readStreams(streams, selectInterval)
+                    isHot = self.isHot
+                else:
+                    isHot = False
+
+                returnCode = pipe.poll()
+
+            # Collect anything the child wrote between our last read and its exit
+            while streams:
+                if not self._readStreams(streams, 0):
+                    break
+
+            if self.stripper is not None:
+                self._storeData(1, self.stripper.finish())
+
+            for streamNum in self.decoders:
+                # Anything held back waiting for the rest of a character
+                self._storeData(streamNum, b'', isFinal=True)
+
+            if self.recordParser is not None:
+                taskInfo._addRecords(self.recordParser.finish())
+        finally:
+            for teeTarget in self.teeTargets.values():
+                teeTarget.close()
+
+            # Everything has been read, so release the descriptors now. The Popen may be held (by the caller, or a QueuedTaskInfo)
+            #   long after the task finishes.
+            closePipeStreams(pipe)
+
+        return returnCode
+
+    def _readStreams(self, streams, selectInterval):
+        '''
+            _readStreams - Read whatever is available on any of #streams, waiting up to #selectInterval for data.
+
+                Streams which have hit end-of-file are removed from #streams
+
+            @return <int> - Number of streams which were ready to read
+        '''
+        # isHot - Set to True if any read in this pass was busy enough that more data is probably already waiting
+        self.isHot = False
+
+        (readyToRead, junk1, junk2) = select.select(streams, [], [], selectInterval)
+        for stream in readyToRead:
+            if not self._readStream(stream):
+                streams.remove(stream)
+
+        return len(readyToRead)
+
+    def _readStream(self, stream):
+        '''
+            _readStream - Read available data from a single ready stream, and store and/or tee it.
+
+            @return <bool> - False if the stream has hit end-of-file, otherwise True
+        '''
+        # Determine which stream we were returned by mapping fd to stream number
+        fileNo = stream.fileno()
+        ionum = self.fileNoToStreamNo[fileNo]
+        readSize = self.fileNoToReadSize[fileNo]
+        teeTarget = self.teeTargets.get(ionum, None)
+
+        if teeTarget is not None and self.teeCapture is False:
+            # Data is not being stored, so move it straight from the pipe to the target.
+            numMoved = teeTarget.copyFrom(fileNo, readSize.size)
+            self.bytesRead += numMoved
+            readSize.update(numMoved)
+            self.isHot = self.isHot or readSize.isHot
+            return bool(numMoved)
+
+        # Use read method that won't block on unfinished/un-newlined data on stream
+        try:
+            if self.simulateRead1 is False:
+                data = stream.read1(readSize.size)
+            else:
+                data = _py_read1(stream, readSize.size)
+        except (IOError, OSError) as e:
+            if not isPtyEndOfFile(e):
+                raise
+            data = b''
+
+        readSize.update(len(data))
+        self.bytesRead += len(data)
+        self.isHot = self.isHot or readSize.isHot
+        if not data:
+            return False
+
+        if teeTarget is not None:
+            teeTarget.write(data)
+
+        if ionum == 1 and self.stripper is not None:
+            data = self.stripper.feed(data)
+
+        self._storeData(ionum, data)
+
+        return True
+
+    def _storeData(self, ionum, data, isFinal=False):
+        '''
+            _storeData - Parse or decode, and store, data read from a stream
+
+            @param ionum <int> - 1 for stdout, 2 for stderr
+
+            @param data <bytes> - Raw data
+
+            @param isFinal <bool> - True at the end of the stream, so any partial character held by the decoder is flushed (or raises)
+        '''
+        taskInfo = self.taskInfo
+
+        if ionum == 1 and self.recordParser is not None:
+            # Parsing into records (which handles its own decoding), rather than storing the raw data
+            taskInfo._addRecords(self.recordParser.feed(data))
+            return
+
+        if self.decoders:
+            data = self.decoders[ionum].decode(data, isFinal)
+
+        if not data:
+            return
+
+        if taskInfo._chunkQueue is not None:
+            # Handed to the consumer, blocking while its queue is full
+            taskInfo._putChunk(ionum, data, self.pollInterval)
+            return
+
+        # Append into correct location
+        taskInfo._addData(ionum, data)
+
+
+def checkBackgroundKwargs(backgroundKwargs):
+    '''
+        checkBackgroundKwargs - Check arguments for startBackgroundTask before the process is started, so that bad ones
+          are reported to the caller rather than from a thread (e.x. TaskQueue.submit)
+
+            Only values which can be checked without a process are checked. Others (like a #pipeSize above the system max) still fail in startBackgroundTask.
+
+        @param backgroundKwargs <dict> - Keyword arguments which will be passed to startBackgroundTask
+
+        @raises TypeError - If an argument is unknown
+
+        @raises ValueError - If a value is invalid
+    '''
+    funcCode = startBackgroundTask.__code__
+    # Skip "pipe" and "taskInfo"
+    knownNames = funcCode.co_varnames[2:funcCode.co_argcount]
+    for name in backgroundKwargs:
+        if name not in knownNames:
+            raise TypeError('Unknown background argument: %s' %(repr(name), ))
+
+    compress = backgroundKwargs.get('compress', None)
+    if compress:
+        CompressedStreamBuffer(compress=compress)
+
+    records = backgroundKwargs.get('records', None)
+    if records is not None:
+        RecordParser(records)
+
+    for name in ('pipeSize', 'maxReadSize', 'chunkQueueSize', 'maxSamples'):
+        value = backgroundKwargs.get(name, None)
+        if value is not None and (not issubclass(value.__class__, int) or value < 0):
+            raise ValueError('%s must be an int >= 0. Got: %s' %(name, repr(value)))
+
+
+def startBackgroundTask(pipe, taskInfo, pollInterval=.1, encoding=False, teeTo=None, teeCapture=True, maxReadSize=DEFAULT_MAX_READ_SIZE, pipeSize=None, records=None, recordCallback=None, sampleInterval=None, maxSamples=DEFAULT_MAX_SAMPLES, limits=None, stripControlSequences=False, chunkLog=False, chunkQueueSize=None, compress=None):
+    '''
+        startBackgroundTask - Start a background thread which manages #pipe and populates #taskInfo.
+
+            This is the implementation of Popen.runInBackground, for callers (like TaskQueue) which create the BackgroundTaskInfo
+              (or a subclass) themselves, before the process is started.
+
+            @see Popen.runInBackground for the meaning of the other arguments.
+
+        @param pipe <subprocess.Popen> - The process to manage
+
+        @param taskInfo <BackgroundTaskInfo> - The object to populate
+
+        @param limits <None/subprocess2.limits.ResourceLimits> - The limits #pipe was started with, if any. Used to report "limitExceeded" on completion.
+
+        @param stripControlSequences <bool> - If True, terminal control sequences are removed from stdout (for when stdout is a pseudo-terminal)
+
+        @return <BackgroundTaskThread> - The started thread
+    '''
+    if pipeSize:
+        for stream in (pipe.stdout, pipe.stderr):
+            if stream:
+                setPipeSize(stream, pipeSize)
+
+    recordParser = None
+    if records is not None:
+        recordParser = RecordParser(records, recordCallback, encoding)
+        recordParser.errors = taskInfo.recordErrors
+
+    if chunkLog:
+        taskInfo.chunkLog = ChunkLog()
+
+    if chunkQueueSize:
+        taskInfo._chunkQueue = queue.Queue(chunkQueueSize)
+
+    if compress:
+        taskInfo._setCompression(compress)
+
+    if sampleInterval:
+        sampler = getSampler()
+        taskInfo.resourceTimeline = ResourceTimeline(maxSamples)
+        sampler.register(pipe.pid, taskInfo.resourceTimeline, sampleInterval)
+        taskInfo._finishCallbacks.append(lambda finishedTaskInfo : sampler.unregister(pipe.pid))
+
+    thread = BackgroundTaskThread(pipe, taskInfo, pollInterval, encoding, teeTargets=getTeeTargets(teeTo), teeCapture=teeCapture, maxReadSize=maxReadSize, recordParser=recordParser, limits=limits, stripper=(ControlSequenceStripper() if stripControlSequences else None))
+
+    registry = getRegistry()
+    registryEntry = registry.taskStarted('background', pipe.pid, taskInfo)
+    taskInfo._finishCallbacks.append(lambda finishedTaskInfo : registry.taskFinished(registryEntry, finishedTaskInfo.returnCode, thread.bytesRead))
 
+    thread.start()
+    #thread.run()  # Uncomment to use pdb debug (will not run in background)
+    return thread
@@ -0,0 +1,324 @@
+'''
+  TaskQueue.py - A queue of commands to run in the background, with a limit on how many run at once.
+
+  Copyright (c) 2016 Timothy Savannah LGPLv2 All rights reserved. See LICENSE file for more details.
+
+
+  TaskQueue - Accepts commands with priorities, and runs them in the background keeping at most N running at once.
+
+  QueuedTaskInfo - The BackgroundTaskInfo returned for each submitted command
+
+'''
+
+# vim: ts=4 sw=4 expandtab :
+
+import heapq
+import itertools
+import os
+import subprocess
+import threading
+import time
+
+from .BackgroundTask import BackgroundTaskInfo, startBackgroundTask, checkBackgroundKwargs
+from .pipeio import closePipeStreams
+from .registry import getRegistry
+
+__all__ = ('TaskQueue', 'QueuedTaskInfo', 'getNumCores')
+
+
+def getNumCores():
+    '''
+        getNumCores - Get the number of cores this process may run on
+
+        @return <int> - Number of usable cores (at least 1)
+    '''
+    if hasattr(os, 'sched_getaffinity'):
+        try:
+            return max(1, len(os.sched_getaffinity(0)))
+        except:
+            pass
+    try:
+        import multiprocessing
+        return max(1, multiprocessing.cpu_count())
+    except:
+        return 1
+
+
+class QueuedTaskInfo(BackgroundTaskInfo):
+    '''
+        QueuedTaskInfo - A BackgroundTaskInfo for a command submitted to a TaskQueue. It is returned immediately on submit,
+          and is populated like any other BackgroundTaskInfo once the command starts.
+
+        FIELDS (in addition to those of BackgroundTaskInfo):
+
+            isStarted - False while waiting in the queue, True once the process has been started.
+            isCancelled - True if #cancel was called before the process started. The task will be marked finished, with a returnCode of None.
+            pid - The pid of the process once started, otherwise None
+            priority - The priority given on submit. Higher values are started first.
+            launchError - If the command could not be started (e.x. executable not found), or its background thread could not be started (the process is then killed), a string of the error. returnCode will be 255.
+    '''
+
+    FIELDS = BackgroundTaskInfo.FIELDS + ('isStarted', 'isCancelled', 'pid', 'priority', 'launchError')
+
+    def __init__(self, cmd, priority=0, encoding=False, queue=None):
+        BackgroundTaskInfo.__init__(self, encoding)
+        self.cmd = cmd
+        self.priority = priority
+        self.isStarted = False
+        self.isCancelled = False
+        self.pid = None
+        self.pipe = None
+        self.launchError = None
+        self._queue = queue
+
+    def cancel(self):
+        '''
+            cancel - Remove this task from the queue, if it has not yet started.
+
+            @return <bool> - True if the task was cancelled, False if it had already started.
+        '''
+        return self._queue._cancel(self)
+
+
+class TaskQueue(object):
+    '''
+        TaskQueue - Run commands in the background, keeping at most #maxRunning running at once.
+
+            Commands are started in order of priority (highest first, then in order submitted) as soon as a running one exits.
+
+        @param maxRunning <None/int/"cores"> - Default None. Max number of commands to run at once. None or "cores" uses the number of cores available.
+
+        @param maxLoadAverage <None/float> - Default None. If provided, no new command will be started while the 1-minute load average is at or above this value.
+
+        @param pollInterval <float> - Default .1. The pollInterval given to each background task (@see Popen.runInBackground), and how often to re-check the load average.
+
+        @param encoding <False/str> - Default False. If provided, output of tasks will be decoded with this codec (@see Popen.runInBackground)
+
+
+        Example:
+
+            queue = TaskQueue(maxRunning=64)
+            tasks = [ queue.submit(['gzip', '-9', fileName]) for fileName in fileNames ]
+            queue.waitAll()
+            failed = [ task for task in tasks if task.returnCode != 0 ]
+    '''
+
+    def __init__(self, maxRunning=None, maxLoadAverage=None, pollInterval=.1, encoding=False):
+        if maxRunning is None or maxRunning == 'cores':
+            maxRunning = getNumCores()
+        if not issubclass(maxRunning.__class__, int) or maxRunning < 1:
+            raise ValueError('maxRunning must be an int >= 1, "cores", or None. Got: %s' %(repr(maxRunning), ))
+
+        self.maxRunning = maxRunning
+        self.maxLoadAverage = maxLoadAverage
+        self.pollInterval = pollInterval
+        self.encoding = encoding
+
+        # _condition - Guards all state below, and is notified whenever a task is submitted or finishes.
+        self._condition = threading.Condition()
+        # _pending - Heap of ( -priority, submit order, task, popenKwargs, backgroundKwargs )
+        self._pending = []
+        self._numPending = 0
+        self._running = set()
+        self._submitCounter = itertools.count()
+        self._dispatcher = None
+        self._isShutdown = False
+
+    def submit(self, cmd, priority=0, backgroundKwargs=None, **popenKwargs):
+        '''
+            submit - Add a command to the queue. It will be started once fewer than #maxRunning tasks are running, and no higher priority tasks are waiting.
+
+            @param cmd <str/list> - Command to run. If a str, it is run through the shell (like Simple.runGetResults), unless "shell" is given in #popenKwargs.
+
+            @param priority <int> - Default 0. Tasks with a higher priority are started first.
+
+            @param backgroundKwargs <None/dict> - Extra arguments to runInBackground for this task (e.x. teeTo, maxReadSize)
+
+            @param popenKwargs - Any other arguments are passed to subprocess.Popen. stdout and stderr default to subprocess.PIPE.
+
+            @return <QueuedTaskInfo> - Represents the task. Can be used just like the BackgroundTaskInfo returned by runInBackground.
+
+            @raises ValueError/TypeError - If #backgroundKwargs contains an unknown argument, or a value which is known to be invalid
+        '''
+        if backgroundKwargs:
+            checkBackgroundKwargs(backgroundKwargs)
+
+        popenKwargs.setdefault('stdout', subprocess.PIPE)
+        popenKwargs.setdefault('stderr', subprocess.PIPE)
+        popenKwargs.setdefault('shell', not issubclass(cmd.__class__, (list, tuple)))
+
+        task = QueuedTaskInfo(cmd, priority, self.encoding, self)
+
+        with self._condition:
+            if self._isShutdown is True:
+                raise ValueError('Cannot submit to a TaskQueue which has been shutdown.')
+
+            heapq.heappush(self._pending, (-priority, next(self._submitCounter), task, popenKwargs, backgroundKwargs or {}))
+            self._numPending += 1
+
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch)
+                self._dispatcher.daemon = True
+                self._dispatcher.start()
+
+            self._condition.notify_all()
+
+        return task
+
+    @property
+    def numPending(self):
+        '''
+            numPending - Number of tasks waiting to start
+        '''
+        return self._numPending
+
+    @property
+    def numRunning(self):
+        '''
+            numRunning - Number of tasks currently running
+        '''
+        return len(self._running)
+
+    def waitAll(self, timeout=None):
+        '''
+            waitAll - Wait (Block current thread) until every submitted task has finished.
+
+            @param timeout <None/float> - None to wait forever, otherwise max number of seconds to wait
+
+            @return <bool> - True if all tasks finished, False if the timeout expired first.
+        '''
+        if timeout is not None:
+            endTime = time.time() + timeout
+
+        with self._condition:
+            while self._numPending or self._running:
+                if timeout is None:
+                    self._condition.wait()
+                else:
+                    remaining = endTime - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+        return True
+
+    def shutdown(self, cancelPending=False):
+        '''
+            shutdown - Stop accepting new tasks. Running tasks are not affected.
+
+            @param cancelPending <bool> - Default False. If True, tasks which have not yet started are cancelled. Otherwise, they will still be run.
+        '''
+        toCancel = []
+        with self._condition:
+            self._isShutdown = True
+            if cancelPending is True:
+                toCancel = [pendingEntry[2] for pendingEntry in self._pending]
+            self._condition.notify_all()
+
+        for task in toCancel:
+            task.cancel()
+
+    def _isLoadTooHigh(self):
+        if self.maxLoadAverage is None or not hasattr(os, 'getloadavg'):
+            return False
+        try:
+            return os.getloadavg()[0] >= self.maxLoadAverage
+        except OSError:
+            return False
+
+    def _dispatch(self):
+        '''
+            _dispatch - INTERNAL. Body of the dispatcher thread, which starts pending tasks whenever there is room.
+        '''
+        with self._condition:
+            while True:
+                if not self._pending:
+                    if self._isShutdown is True:
+                        self._dispatcher = None
+                        return
+                    self._condition.wait()
+                    continue
+
+                if len(self._running) >= self.maxRunning:
+                    self._condition.wait()
+                    continue
+
+                if self._isLoadTooHigh():
+                    self._condition.wait(self.pollInterval)
+                    continue
+
+                (junk, junk2, task, popenKwargs, backgroundKwargs) = heapq.heappop(self._pending)
+                if task.isCancelled is True:
+                    continue
+                self._numPending -= 1
+                self._startTask(task, popenKwargs, backgroundKwargs)
+
+    def _startTask(self, task, popenKwargs, backgroundKwargs):
+        '''
+            _startTask - INTERNAL. Start a task. Called with #_condition held.
+        '''
+        spawnStart = time.time()
+        try:
+            pipe = subprocess.Popen(task.cmd, **popenKwargs)
+        except Exception as e:
+            getRegistry().recordLaunchFailure()
+            task.launchError = str(e)
+            task._markFinished(255)
+            self._condition.notify_all()
+            return
+
+        getRegistry().recordSpawn(time.time() - spawnStart)
+
+        task.pipe = pipe
+        task.pid = pipe.pid
+        task.isStarted = True
+
+        self._running.add(task)
+        task._finishCallbacks.append(self._onTaskFinished)
+
+        backgroundKwargs = dict(backgroundKwargs)
+        backgroundKwargs.setdefault('pollInterval', self.pollInterval)
+        backgroundKwargs.setdefault('encoding', self.encoding)
+        try:
+            startBackgroundTask(pipe, task, **backgroundKwargs)
+        except Exception as e:
+            # Nothing will read from or wait on the process, so stop it here. Otherwise it would leak, and the task would never finish.
+            try:
+                pipe.kill()
+            except OSError:
+                pass
+            pipe.wait()
+            closePipeStreams(pipe)
+            if pipe.stdin is not None:
+                try:
+                    pipe.stdin.close()
+                except:
+                    pass
+
+            task.launchError = task.error = '%s: %s' %(e.__class__.__name__, str(e))
+            if task._chunkQueue is not None:
+                task._putChunk(None, None, self.pollInterval)
+            # Calls _onTaskFinished, which removes the task from _running and notifies ( _condition is re-entrant )
+            task._markFinished(255)
+
+    def _onTaskFinished(self, task):
+        '''
+            _onTaskFinished - INTERNAL. Called from a task's background thread once it completes.
+        '''
+        with self._condition:
+            self._running.discard(task)
+            self._condition.notify_all()
+
+    def _cancel(self, task):
+        '''
+            _cancel - INTERNAL. Implementation of QueuedTaskInfo.cancel
+        '''
+        with self._condition:
+            if task.isStarted is True or task.isFinished is True:
+                return False
+            # The entry is left in the heap, and skipped when it is popped.
+            task.isCancelled = True
+            self._numPending -= 1
+            self._condition.notify_all()
+
+        task._markFinished(None)
+        return True
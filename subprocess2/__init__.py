@@ -17,6 +17,7 @@
     
 '''
 
+import threading
 import time
 
 # Make sure import * imports the same set as subprocess. If we define extra modules or whatever later they will be added here too
@@ -40,7 +41,7 @@ from subprocess import * # I know, bad form to import *, but ensures that you ca
 __subprocessDefined = set(locals().keys()).difference(__origDefined)
 __subprocessDefined -= set(['__origDefined'])
 
-__all__ = list(__subprocessDefined) + ['Simple', 'SimpleCommandFailure']
+__all__ = list(__subprocessDefined) + ['Simple', 'SimpleCommandFailure', 'TaskQueue', 'QueuedTaskInfo', 'resolveExecutable', 'resolveCommand', 'clearExecutableCache', 'getReaper', 'ResourceLimits', 'getRegistry', 'WorkerPool', 'WorkerJob', 'WorkerJobError']
 
 # Apply our global updates
 import subprocess
@@ -56,9 +57,26 @@ __version__ = subprocess2_version # Only __version__ in subprocess2 module, don'
 
 from .BackgroundTask import BackgroundTaskInfo
 
+from .pipeio import setPipeSize, DEFAULT_MAX_READ_SIZE
+
+from .sampler import DEFAULT_MAX_SAMPLES
+
+from .TaskQueue import TaskQueue, QueuedTaskInfo
+
+from .pathcache import resolveExecutable, resolveCommand, clearExecutableCache
+
+from .reaper import getReaper
+
+from .registry import getRegistry
+
+from .limits import ResourceLimits
+
 from .simple import Simple, SimpleCommandFailure
 
+from .workerpool import WorkerPool, WorkerJob, WorkerJobError
+
 subprocess.Simple = Simple
+subprocess.TaskQueue = TaskQueue
 
 def waitUpTo(self, timeoutSeconds, pollInterval=DEFAULT_POLL_INTERVAL):
     '''
@@ -103,6 +121,8 @@ def waitOrTerminate(self, timeoutSeconds, pollInterval=DEFAULT_POLL_INTERVAL, te
                 * If this is set to 0, no terminate signal will be sent, but directly to kill. Because the application cannot trap this, returnCode will be None.
                 * If this is set to > 0, that number of seconds maximum will be given between .terminate and .kill. If the application does not terminate before KILL, returnCode will be None.
 
+                After a KILL, the process is handed to the reaper (@see subprocess2.reaper), so it is collected as soon as it dies and the Popen's returncode is set then, even if that is after this method returns.
+
             Windows Note -- On windows SIGTERM and SIGKILL are the same thing.
 
             @return dict { 'returnCode' : <int or None> , 'actionTaken' : <int mask of SUBPROCESS2_PROCESS_*> }
@@ -116,30 +136,30 @@ def waitOrTerminate(self, timeoutSeconds, pollInterval=DEFAULT_POLL_INTERVAL, te
 
     if returnCode is None:
         if terminateToKillSeconds is None:
+            actionTaken |= _recordAction(self, SUBPROCESS2_PROCESS_TERMINATED)
             self.terminate()
-            actionTaken |= SUBPROCESS2_PROCESS_TERMINATED
 
-            time.sleep(pollInterval) # Give a chance to cleanup
+            _waitForReap(self, pollInterval) # Give a chance to cleanup
             returnCode = self.poll()
 
         elif terminateToKillSeconds == 0:
+            actionTaken |= _recordAction(self, SUBPROCESS2_PROCESS_KILLED)
             self.kill()
-            actionTaken |= SUBPROCESS2_PROCESS_KILLED
 
-            time.sleep(.01)  # Give a chance to happen
-            self.poll() # Don't defunct
+            _waitForReap(self, .01)  # Give a chance to happen. Reaper will collect it (Don't defunct) even if it takes longer.
 
             returnCode = None
         else:
+            actionTaken |= _recordAction(self, SUBPROCESS2_PROCESS_TERMINATED)
             self.terminate()
-            actionTaken |= SUBPROCESS2_PROCESS_TERMINATED
 
             returnCode = self.waitUpTo(terminateToKillSeconds, pollInterval)
             if returnCode is None:
-                actionTaken |= SUBPROCESS2_PROCESS_KILLED
+                actionTaken |= _recordAction(self, SUBPROCESS2_PROCESS_KILLED)
                 self.kill()
-                time.sleep(.01)
-                self.poll() # Don't defunct
+                _waitForReap(self, .01) # Reaper will collect it (Don't defunct) even if it takes longer.
+
+    getRegistry().recordActionTaken(actionTaken)
 
     return {
         'returnCode' : returnCode,
@@ -149,7 +169,35 @@ def waitOrTerminate(self, timeoutSeconds, pollInterval=DEFAULT_POLL_INTERVAL, te
 Popen.waitOrTerminate = waitOrTerminate
 
 
-def runInBackground(self, pollInterval=.1, encoding=False):
+def _recordAction(pipe, action):
+    '''
+        _recordAction - INTERNAL. Record on #pipe that subprocess2 is about to terminate or kill it, so that a background task
+          reading it does not report a resource limit for our own signal. Called before the signal is sent.
+
+        @param pipe <Popen> - The process
+
+        @param action <int> - SUBPROCESS2_PROCESS_TERMINATED or SUBPROCESS2_PROCESS_KILLED
+
+        @return <int> - #action
+    '''
+    pipe._subprocess2ActionTaken = getattr(pipe, '_subprocess2ActionTaken', SUBPROCESS2_PROCESS_COMPLETED) | action
+    return action
+
+
+def _waitForReap(pipe, timeoutSeconds):
+    '''
+        _waitForReap - Hand #pipe to the reaper, so it is collected as soon as it exits, and wait up to #timeoutSeconds for that to happen.
+
+        @return - Returncode of application, or None if it did not exit in time
+    '''
+    exitedEvent = threading.Event()
+    getReaper().register(pipe, lambda exitedPipe, exitCode : exitedEvent.set())
+    exitedEvent.wait(timeoutSeconds)
+
+    return pipe.returncode
+
+
+def runInBackground(self, pollInterval=.1, encoding=False, teeTo=None, teeCapture=True, maxReadSize=DEFAULT_MAX_READ_SIZE, pipeSize=None, records=None, recordCallback=None, sampleInterval=None, maxSamples=DEFAULT_MAX_SAMPLES, chunkLog=False, chunkQueueSize=None, compress=None):
     '''
         runInBackground - Create a background thread which will manage this process, automatically read from streams, and perform any cleanups
 
@@ -160,15 +208,56 @@ def runInBackground(self, pollInterval=.1, encoding=False):
 
         @param pollInterval - Amount of idle time between polling
         @param encoding - Default False. If provided, data will be decoded using the value of this field as the codec name (e.x. "utf-8"). Otherwise, data will be stored as bytes.
+        @param teeTo - Default None. If provided, data read from stdout will also be written to this target as it arrives.
+
+            May be an int (file descriptor), an open file object, or a str (path to a file which will be created/truncated, and closed when the process completes).
+            May also be a dict mapping "stdout" and/or "stderr" to a target, to tee either or both streams.
+
+        @param teeCapture - Default True. If False, streams which are tee'd will NOT be stored on the BackgroundTaskInfo,
+            and the data is moved straight from the pipe to the target (using os.splice where available, so it never enters python memory).
+            Use this to persist very large outputs.
+
+        @param maxReadSize - Default 1MiB. Reads start at 4KiB, and double (up to this size) each time a read fills the whole buffer.
+            While a stream is that busy, the pollInterval sleep is skipped so a fast-writing child is not throttled.
+
+        @param pipeSize - Default None. If provided, the kernel buffers of the stdout/stderr pipes are resized to this many bytes (linux only, @see subprocess2.pipeio.setPipeSize).
+            A larger pipe lets a fast-writing child block on write less often.
+
+        @param records - Default None. If provided, stdout is split into lines as it is read (while the program runs), and each line is converted into a record
+            which is appended to the "records" field of the BackgroundTaskInfo. The raw stdout is then NOT stored in "stdoutData".
+
+            "lines" - Each line (without the newline) is a record. Lines are decoded if #encoding is set.
+            "json"  - Each non-blank line is decoded as JSON. Lines which fail to decode are added to the "recordErrors" field.
+            callable - Called with each line, and returns the record.
+
+        @param recordCallback - Default None. If provided with #records, each record is passed to this function (from the background thread) as it is parsed,
+            instead of being collected.
+
+        @param sampleInterval - Default None. If provided, the CPU time and RSS of the process are read from /proc (linux only) every #sampleInterval seconds,
+            and recorded on the "resourceTimeline" field of the BackgroundTaskInfo ( @see subprocess2.sampler.ResourceTimeline ).
+            A single thread does the sampling for all tasks.
+
+        @param maxSamples - Default 1024. Max number of samples kept in the resourceTimeline. When full, every other sample is dropped
+            and the effective sampling interval doubles, so the timeline always covers the whole run.
+
+        @param chunkLog - Default False. If True, the time, stream, and position of every chunk read is recorded on the "chunkLog" field of the BackgroundTaskInfo
+            ( @see subprocess2.chunklog.ChunkLog ), so stdout and stderr can be replayed in the order they were read with BackgroundTaskInfo.iterTimeline,
+            while still being kept separate in stdoutData and stderrData.
+
+        @param chunkQueueSize - Default None. If provided, output is NOT stored in stdoutData/stderrData, but handed to the consumer through a queue
+            of at most this many chunks (each at most #maxReadSize), read with BackgroundTaskInfo.iterChunks. While the queue is full, the pipes are not read,
+            so a slow consumer makes the child block on its writes rather than output piling up in memory.
+
+        @param compress - Default None. If "zlib" or "lzma", output is compressed as it is read and kept compressed in memory,
+            and only decompressed when accessed ( @see subprocess2.BackgroundTask.CompressedStreamBuffer ). The "compressionRatio" field
+            shows the savings. Use BackgroundTaskInfo.iterData to stream the output back out without decompressing all of it at once.
     '''
         
-    from .BackgroundTask import BackgroundTaskThread
+    from .BackgroundTask import startBackgroundTask
 
     taskInfo = BackgroundTaskInfo(encoding)
-    thread = BackgroundTaskThread(self, taskInfo, pollInterval, encoding)
+    startBackgroundTask(self, taskInfo, pollInterval, encoding, teeTo=teeTo, teeCapture=teeCapture, maxReadSize=maxReadSize, pipeSize=pipeSize, records=records, recordCallback=recordCallback, sampleInterval=sampleInterval, maxSamples=maxSamples, chunkLog=chunkLog, chunkQueueSize=chunkQueueSize, compress=compress)
 
-    thread.start()
-    #thread.run()  # Uncomment to use pdb debug (will not run in background)
     return taskInfo
 
 Popen.runInBackground = runInBackground
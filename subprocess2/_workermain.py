@@ -0,0 +1,164 @@
+'''
+  _workermain.py - INTERNAL. The program run by each worker of a subprocess2.workerpool.WorkerPool.
+
+  Copyright (c) 2016 Timothy Savannah LGPLv2 All rights reserved. See LICENSE file for more details.
+
+
+  This is run as a script (not imported as part of subprocess2), so starting a worker costs only the interpreter startup.
+
+  Protocol (each message is a 4-byte big-endian length followed by a pickle):
+
+    stdin (from the pool)  - First a config dict ( 'sysPath', 'protocol' ), then one tuple( jobId, "module:function", args, kwargs ) per job.
+                               End-of-file means the worker should exit.
+
+    stdout (to the pool)   - For each job, first an empty message (length 0) as soon as the job has been read, so the pool knows it was received.
+                               Then tuple( jobId, tuple( isSuccess, result or tuple( exception type name, message, traceback ) ), stdout, stderr )
+
+  While a job runs, file descriptors 1 and 2 point at temporary files, so everything the job writes (including from C code,
+    or children it starts) is captured and returned with the result.
+'''
+
+# vim: ts=4 sw=4 expandtab :
+
+import sys
+
+# Run as a script, sys.path[0] is the subprocess2 directory. Remove it before importing anything else, so that the modules
+#   here cannot shadow any others. The pool's sys.path is applied once the config is received.
+del sys.path[0]
+
+import os
+import pickle
+import signal
+import struct
+import tempfile
+import traceback
+
+from importlib import import_module
+
+_HEADER = struct.Struct('!I')
+
+
+def _readExactly(fd, size):
+    '''
+        _readExactly - Read #size bytes from #fd
+
+        @return <bytes/None> - The data, or None if end-of-file was hit before any of it
+    '''
+    chunks = []
+    remaining = size
+    while remaining:
+        data = os.read(fd, remaining)
+        if not data:
+            if remaining == size:
+                return None
+            raise EOFError('Pool closed the job pipe part way through a message')
+        chunks.append(data)
+        remaining -= len(data)
+    return b''.join(chunks)
+
+
+def _readMessage(fd):
+    header = _readExactly(fd, _HEADER.size)
+    if header is None:
+        return None
+    payload = _readExactly(fd, _HEADER.unpack(header)[0])
+    if payload is None:
+        raise EOFError('Pool closed the job pipe part way through a message')
+    return pickle.loads(payload)
+
+
+def _writeAll(fd, data):
+    while data:
+        numWritten = os.write(fd, data)
+        data = data[numWritten:]
+
+
+def _resetCapture(fd):
+    os.lseek(fd, 0, os.SEEK_SET)
+    os.ftruncate(fd, 0)
+
+
+def _readCapture(fd):
+    os.lseek(fd, 0, os.SEEK_SET)
+    chunks = []
+    while True:
+        data = os.read(fd, 65536)
+        if not data:
+            break
+        chunks.append(data)
+    return b''.join(chunks)
+
+
+def _getTarget(target, targetCache):
+    '''
+        _getTarget - Import and return the function named by #target ("module:function", where function may be a dotted path)
+    '''
+    func = targetCache.get(target, None)
+    if func is None:
+        (moduleName, funcName) = target.split(':', 1)
+        func = import_module(moduleName)
+        for attrName in funcName.split('.'):
+            func = getattr(func, attrName)
+        targetCache[target] = func
+    return func
+
+
+def main():
+    # Ctrl+C goes to the whole process group. The pool decides what happens to running jobs, and the worker exits when its stdin closes.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Take over stdin and stdout for messages, so the job cannot read from or write into them.
+    jobFd = os.dup(0)
+    resultFd = os.dup(1)
+
+    devNull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devNull, 0)
+    os.close(devNull)
+
+    captureFiles = (tempfile.TemporaryFile(), tempfile.TemporaryFile())
+    captureFds = [ captureFile.fileno() for captureFile in captureFiles ]
+    os.dup2(captureFds[0], 1)
+    os.dup2(captureFds[1], 2)
+
+    config = _readMessage(jobFd)
+    if config is None:
+        return
+    sys.path[:] = config['sysPath']
+    protocol = config['protocol']
+
+    targetCache = {}
+
+    while True:
+        message = _readMessage(jobFd)
+        if message is None:
+            break
+        (jobId, target, args, kwargs) = message
+        _writeAll(resultFd, _HEADER.pack(0))
+
+        for fd in captureFds:
+            _resetCapture(fd)
+
+        try:
+            result = (True, _getTarget(target, targetCache)(*args, **kwargs))
+        except BaseException as e:
+            result = (False, (e.__class__.__name__, str(e), traceback.format_exc()))
+
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except:
+                pass
+
+        (jobStdout, jobStderr) = [ _readCapture(fd) for fd in captureFds ]
+
+        try:
+            payload = pickle.dumps( (jobId, result, jobStdout, jobStderr), protocol )
+        except BaseException as e:
+            result = (False, (e.__class__.__name__, 'Result could not be pickled: %s' %(str(e), ), traceback.format_exc()))
+            payload = pickle.dumps( (jobId, result, jobStdout, jobStderr), protocol )
+
+        _writeAll(resultFd, _HEADER.pack(len(payload)) + payload)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+'''
+  argbatch.py - Splitting a long list of arguments into batches which each fit within the system's command line limit (like xargs)
+
+  Copyright (c) 2016 Timothy Savannah LGPLv2 All rights reserved. See LICENSE file for more details.
+
+
+  getMaxCommandBytes - Get the number of bytes of arguments a command may be started with
+
+  getArgumentBatches - Split arguments into batches which, appended to a base command, can each be executed
+
+'''
+
+# vim: ts=4 sw=4 expandtab :
+
+import os
+import struct
+import sys
+
+__all__ = ('getMaxCommandBytes', 'getArgumentBatches', 'MAX_SINGLE_ARG_BYTES')
+
+# Linux limits each single argument to 32 pages (MAX_ARG_STRLEN)
+MAX_SINGLE_ARG_BYTES = 32 * 4096
+
+# Used if the system does not report ARG_MAX. This is the POSIX minimum.
+_DEFAULT_ARG_MAX = 4096
+
+# Left unused, for anything execve counts which we do not (e.x. the executable path, auxiliary vector)
+_HEADROOM_BYTES = 4096
+
+# Size of each pointer in the argv/envp arrays, which also counts against ARG_MAX on linux
+_POINTER_SIZE = struct.calcsize('P')
+
+
+def _argBytes(arg):
+    '''
+        _argBytes - Number of bytes an argument takes against ARG_MAX (the encoded argument, its terminating null, and its argv pointer)
+    '''
+    if not issubclass(arg.__class__, bytes):
+        try:
+            arg = arg.encode(sys.getfilesystemencoding() or 'utf-8', 'surrogateescape')
+        except (UnicodeError, LookupError):
+            arg = arg.encode('utf-8', 'replace')
+    return len(arg) + 1 + _POINTER_SIZE
+
+
+def getMaxCommandBytes(env=None):
+    '''
+        getMaxCommandBytes - Get the number of bytes available for the arguments of a command, after the environment.
+
+        @param env <None/dict> - The environment the command will be run with. Default None uses os.environ.
+
+        @return <int> - Bytes available for arguments (each counted as its encoded length, plus a null and a pointer)
+    '''
+    try:
+        argMax = os.sysconf('SC_ARG_MAX')
+    except (AttributeError, ValueError, OSError):
+        argMax = -1
+    if argMax is None or argMax <= 0:
+        argMax = _DEFAULT_ARG_MAX
+
+    if env is None:
+        env = os.environ
+
+    envBytes = 0
+    for (key, value) in env.items():
+        envBytes += _argBytes(key) + _argBytes(value) - _POINTER_SIZE
+
+    return max(0, argMax - envBytes - _HEADROOM_BYTES)
+
+
+def getArgumentBatches(baseCmd, args, maxArgs=None, maxBytes=None):
+    '''
+        getArgumentBatches - Split #args into batches which can each be appended to #baseCmd and executed without exceeding the system's limits.
+
+        @param baseCmd <list> - The command and any leading arguments, repeated for every batch
+
+        @param args <list> - Arguments to split
+
+        @param maxArgs <None/int> - Default None. If provided, max number of #args in each batch (like xargs -n)
+
+        @param maxBytes <None/int> - Default None. Max bytes of arguments (including #baseCmd) for each command. Default is #getMaxCommandBytes.
+
+        @return list<list> - Batches of #args, in order
+
+        @raises ValueError - If a single argument (with #baseCmd) is too large to ever be executed
+    '''
+    if maxBytes is None:
+        maxBytes = getMaxCommandBytes()
+    if maxArgs is not None and maxArgs < 1:
+        raise ValueError('maxArgs must be >= 1. Got: %s' %(repr(maxArgs), ))
+
+    baseBytes = sum([_argBytes(arg) for arg in baseCmd])
+    available = maxBytes - baseBytes
+
+    batches = []
+    batch = []
+    batchBytes = 0
+    for arg in args:
+        argBytes = _argBytes(arg)
+        if argBytes > available or argBytes - _POINTER_SIZE > MAX_SINGLE_ARG_BYTES:
+            raise ValueError('Argument is too long to be executed (%d bytes): %s...' %(argBytes, repr(arg[:64])))
+
+        if batch and (batchBytes + argBytes > available or (maxArgs is not None and len(batch) >= maxArgs)):
+            batches.append(batch)
+            batch = []
+            batchBytes = 0
+
+        batch.append(arg)
+        batchBytes += argBytes
+
+    if batch:
+        batches.append(batch)
+
+    return batches
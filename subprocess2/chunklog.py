@@ -0,0 +1,93 @@
+'''
+  chunklog.py - Compact, order-preserving log of the chunks read from each stream of a background task
+
+  Copyright (c) 2016 Timothy Savannah LGPLv2 All rights reserved. See LICENSE file for more details.
+
+
+  ChunkLog - Records (timestamp, stream, offset, length) for every chunk stored, so the interleaving of stdout and stderr can be replayed
+
+'''
+
+# vim: ts=4 sw=4 expandtab :
+
+import array
+import threading
+import time
+
+__all__ = ('ChunkLog', )
+
+# time.monotonic is python 3.3+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+try:
+    array.array('q')
+    _INT_TYPECODE = 'q'
+except ValueError:
+    _INT_TYPECODE = 'l'
+
+_STREAM_NUM_TO_NAME = {
+    1 : 'stdout',
+    2 : 'stderr',
+}
+
+
+class ChunkLog(object):
+    '''
+        ChunkLog - A log of every chunk of output stored by a background task, in the order it was read.
+
+            Each entry is ( timestamp, stream number, offset, length ), where offset and length are within that stream's stored data.
+              The data itself is not copied; entries are kept in arrays, so each chunk costs a few dozen bytes.
+
+        FIELDS:
+
+            times - array of float seconds (monotonic clock) since the log was created
+            streamNums - array of stream numbers ( 1 = stdout, 2 = stderr )
+            offsets - array of offsets into the stream's data
+            lengths - array of lengths of each chunk
+    '''
+
+    def __init__(self):
+        self.startTime = _monotonic()
+        self.times = array.array('d')
+        self.streamNums = array.array('b')
+        self.offsets = array.array(_INT_TYPECODE)
+        self.lengths = array.array(_INT_TYPECODE)
+        self._lock = threading.Lock()
+
+    def add(self, streamNum, offset, length):
+        '''
+            add - Record a chunk
+
+            @param streamNum <int> - 1 for stdout, 2 for stderr
+
+            @param offset <int> - Offset of the chunk within the stream's data
+
+            @param length <int> - Length of the chunk
+        '''
+        now = _monotonic() - self.startTime
+        with self._lock:
+            self.times.append(now)
+            self.streamNums.append(streamNum)
+            self.offsets.append(offset)
+            self.lengths.append(length)
+
+    def __len__(self):
+        return len(self.times)
+
+    def entries(self, start=0):
+        '''
+            entries - Iterate over the logged chunks, in the order they were read
+
+            @param start <int> - Index of the first entry to return (e.x. the length of the log when last iterated)
+
+            @return generator< tuple( <float> time, <str> streamName, <int> offset, <int> length ) >
+        '''
+        with self._lock:
+            numEntries = len(self.times)
+
+        # Arrays only ever grow, so the first #numEntries entries can be read without holding the lock
+        for idx in range(start, numEntries):
+            yield (self.times[idx], _STREAM_NUM_TO_NAME[self.streamNums[idx]], self.offsets[idx], self.lengths[idx])
+
+    def __repr__(self):
+        return 'ChunkLog(numEntries=%d)' %(len(self.times), )
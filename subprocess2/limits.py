@@ -0,0 +1,286 @@
+'''
+  limits.py - Resource limits, priorities, and CPU affinity applied to a child before it executes
+
+  Copyright (c) 2016 Timothy Savannah LGPLv2 All rights reserved. See LICENSE file for more details.
+
+
+  ResourceLimits - A set of limits (RLIMIT_AS, RLIMIT_CPU, RLIMIT_NOFILE), nice/ionice levels, and CPU affinity for a child process
+
+  getResourceLimits - Convert a "limits" argument (ResourceLimits, dict, or None) into a ResourceLimits object or None
+
+  CpuTimeWatcher - Tracks the CPU time of a running child, so a SIGKILL from its CPU limit can be told apart from any other
+
+'''
+
+# vim: ts=4 sw=4 expandtab :
+
+import os
+import platform
+import signal
+import time
+
+from . import SUBPROCESS2_PROCESS_KILLED
+from .sampler import readProcUsage
+
+__all__ = ('ResourceLimits', 'getResourceLimits', 'CpuTimeWatcher', 'LIMIT_EXCEEDED_CPU', 'LIMIT_EXCEEDED_MEMORY', 'LIMIT_EXCEEDED_OPEN_FILES',
+    'IONICE_CLASS_REALTIME', 'IONICE_CLASS_BEST_EFFORT', 'IONICE_CLASS_IDLE',
+)
+
+# Values reported as "limitExceeded" when a process appears to have been stopped by one of its limits
+LIMIT_EXCEEDED_CPU = 'cpu'
+LIMIT_EXCEEDED_MEMORY = 'memory'
+LIMIT_EXCEEDED_OPEN_FILES = 'openFiles'
+
+# I/O scheduling classes, as used by the "ionice" command
+IONICE_CLASS_REALTIME = 1
+IONICE_CLASS_BEST_EFFORT = 2
+IONICE_CLASS_IDLE = 3
+
+# ioprio_set is not wrapped by python or libc, so it is called by syscall number.
+_IOPRIO_SET_SYSCALL = {
+    'x86_64'  : 251,
+    'amd64'   : 251,
+    'i386'    : 289,
+    'i686'    : 289,
+    'aarch64' : 30,
+    'arm64'   : 30,
+    'armv7l'  : 314,
+    'ppc64le' : 273,
+    'ppc64'   : 273,
+    's390x'   : 282,
+}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_SHIFT = 13
+
+# Messages printed by programs (and the python interpreter) when an allocation or open fails because of a limit
+_MEMORY_MESSAGES = (b'MemoryError', b'Cannot allocate memory', b'out of memory', b'Out of memory', b'std::bad_alloc')
+_OPEN_FILES_MESSAGES = (b'Too many open files', )
+
+# Min seconds between reads of a child's CPU time by a CpuTimeWatcher. The hard CPU limit (SIGKILL) is a full CPU second past the
+#   soft limit, so a reading this recent has already reached the soft limit when the hard limit kills the child.
+DEFAULT_CPU_WATCH_INTERVAL = .1
+
+
+class ResourceLimits(object):
+    '''
+        ResourceLimits - Limits, priorities, and CPU affinity applied in the child process (between fork and exec), so a runaway
+          child cannot take down the host before any timeout fires. POSIX only.
+
+        @param maxMemory <None/int> - Max bytes of address space (RLIMIT_AS). Allocations past this fail.
+
+        @param maxCpuSeconds <None/int> - Max seconds of CPU time (RLIMIT_CPU). The child gets SIGXCPU at this limit, and SIGKILL one second later.
+
+        @param maxOpenFiles <None/int> - Max number of open file descriptors (RLIMIT_NOFILE)
+
+        @param nice <None/int> - Amount to add to the nice value of the child (higher is lower priority)
+
+        @param ioniceClass <None/int> - I/O scheduling class (linux only). One of IONICE_CLASS_REALTIME, IONICE_CLASS_BEST_EFFORT, IONICE_CLASS_IDLE
+
+        @param ioniceLevel <int> - Default 4. I/O priority within #ioniceClass, 0 (highest) to 7 (lowest)
+
+        @param cpuAffinity <None/list<int>> - CPUs the child may run on (linux only)
+    '''
+
+    def __init__(self, maxMemory=None, maxCpuSeconds=None, maxOpenFiles=None, nice=None, ioniceClass=None, ioniceLevel=4, cpuAffinity=None):
+        self.maxMemory = maxMemory
+        self.maxCpuSeconds = maxCpuSeconds
+        self.maxOpenFiles = maxOpenFiles
+        self.nice = nice
+        self.ioniceClass = ioniceClass
+        self.ioniceLevel = ioniceLevel
+        self.cpuAffinity = cpuAffinity
+
+        if ioniceClass is not None:
+            if ioniceClass not in (IONICE_CLASS_REALTIME, IONICE_CLASS_BEST_EFFORT, IONICE_CLASS_IDLE):
+                raise ValueError('Unknown ioniceClass: %s' %(repr(ioniceClass), ))
+            if not (0 <= ioniceLevel <= 7):
+                raise ValueError('ioniceLevel must be between 0 and 7. Got: %s' %(repr(ioniceLevel), ))
+
+    def getPreexecFn(self, otherPreexecFn=None):
+        '''
+            getPreexecFn - Get a function to pass as "preexec_fn" to subprocess.Popen, which applies these limits in the child.
+
+                Everything which may fail for reasons of the current environment (missing modules, unsupported platform) is checked here,
+                  in the parent, so that the function run in the child does as little as possible.
+
+            @param otherPreexecFn <None/callable> - Another preexec_fn to run after the limits are applied
+
+            @return <callable>
+        '''
+        if os.name != 'posix':
+            raise ValueError('Resource limits are only supported on POSIX platforms.')
+
+        import resource
+
+        rlimits = []
+        if self.maxMemory is not None:
+            rlimits.append( (resource.RLIMIT_AS, (int(self.maxMemory), int(self.maxMemory))) )
+        if self.maxCpuSeconds is not None:
+            # Soft limit sends SIGXCPU (so it can be reported distinctly), hard limit a second later sends SIGKILL
+            rlimits.append( (resource.RLIMIT_CPU, (int(self.maxCpuSeconds), int(self.maxCpuSeconds) + 1)) )
+        if self.maxOpenFiles is not None:
+            rlimits.append( (resource.RLIMIT_NOFILE, (int(self.maxOpenFiles), int(self.maxOpenFiles))) )
+
+        ioprioSet = None
+        if self.ioniceClass is not None:
+            ioprioSet = _getIoprioSet()
+
+        if self.cpuAffinity is not None and not hasattr(os, 'sched_setaffinity'):
+            raise ValueError('cpuAffinity is not supported on this platform.')
+
+        nice = self.nice
+        ioprio = None
+        if self.ioniceClass is not None:
+            ioprio = (self.ioniceClass << _IOPRIO_CLASS_SHIFT) | self.ioniceLevel
+        cpuAffinity = self.cpuAffinity
+
+        def _applyLimits():
+            for (limitType, limitValues) in rlimits:
+                resource.setrlimit(limitType, limitValues)
+            if nice:
+                os.nice(nice)
+            if ioprio is not None:
+                if ioprioSet(_IOPRIO_WHO_PROCESS, 0, ioprio) != 0:
+                    raise OSError('ioprio_set failed')
+            if cpuAffinity is not None:
+                os.sched_setaffinity(0, cpuAffinity)
+            if otherPreexecFn is not None:
+                otherPreexecFn()
+
+        return _applyLimits
+
+    def getLimitExceeded(self, returnCode, output=None, actionTaken=0, cpuSeconds=None):
+        '''
+            getLimitExceeded - Determine (best effort) whether a process which has completed was stopped by one of these limits.
+
+                CPU limit: the process was killed by SIGXCPU, or by SIGKILL which was not sent by subprocess2 (see #actionTaken)
+                  after its CPU time reached #maxCpuSeconds (see #cpuSeconds). Any other SIGKILL (e.x. the OOM killer, or "kill -9") is not reported.
+                Memory and open files limits: the process failed (non-zero, or killed by SIGSEGV/SIGABRT/SIGBUS for memory),
+                  and its output contains the usual error message for that failure (e.x. "MemoryError", "Cannot allocate memory", "Too many open files").
+
+            @param returnCode <int/None> - Return code of the process
+
+            @param output <None/bytes/str> - Captured output (stderr, or combined) to check for failure messages
+
+            @param actionTaken <int> - Mask of SUBPROCESS2_PROCESS_* actions subprocess2 itself took (so our own SIGKILL is not reported as a limit)
+
+            @param cpuSeconds <None/float> - The last CPU time seen for the process while it ran (@see #getCpuTimeWatcher), or None if unknown.
+              Without it, a SIGKILL is never reported as the CPU limit.
+
+            @return <None/str> - None if no limit appears to have been hit, otherwise LIMIT_EXCEEDED_CPU, LIMIT_EXCEEDED_MEMORY, or LIMIT_EXCEEDED_OPEN_FILES
+        '''
+        if returnCode is None or returnCode == 0:
+            return None
+
+        if self.maxCpuSeconds is not None:
+            if hasattr(signal, 'SIGXCPU') and returnCode == -signal.SIGXCPU:
+                return LIMIT_EXCEEDED_CPU
+            if hasattr(signal, 'SIGKILL') and returnCode == -signal.SIGKILL and not (actionTaken & SUBPROCESS2_PROCESS_KILLED) and \
+                    cpuSeconds is not None and cpuSeconds >= self.maxCpuSeconds:
+                return LIMIT_EXCEEDED_CPU
+
+        if output:
+            if not issubclass(output.__class__, bytes):
+                output = output.encode('utf-8', 'replace')
+
+            if self.maxMemory is not None:
+                for message in _MEMORY_MESSAGES:
+                    if message in output:
+                        return LIMIT_EXCEEDED_MEMORY
+            if self.maxOpenFiles is not None:
+                for message in _OPEN_FILES_MESSAGES:
+                    if message in output:
+                        return LIMIT_EXCEEDED_OPEN_FILES
+
+        if self.maxMemory is not None:
+            crashSignals = [ -getattr(signal, signalName) for signalName in ('SIGSEGV', 'SIGABRT', 'SIGBUS') if hasattr(signal, signalName) ]
+            if returnCode in crashSignals:
+                return LIMIT_EXCEEDED_MEMORY
+
+        return None
+
+    def getCpuTimeWatcher(self, pid):
+        '''
+            getCpuTimeWatcher - Get a CpuTimeWatcher for a child started with these limits, if they include #maxCpuSeconds.
+
+            @param pid <int> - The child process id
+
+            @return <None/CpuTimeWatcher> - None if there is no CPU limit
+        '''
+        if self.maxCpuSeconds is None:
+            return None
+        return CpuTimeWatcher(pid)
+
+    def __repr__(self):
+        fields = ('maxMemory', 'maxCpuSeconds', 'maxOpenFiles', 'nice', 'ioniceClass', 'ioniceLevel', 'cpuAffinity')
+        return 'ResourceLimits(%s)' %(', '.join(['%s=%s' %(field, repr(getattr(self, field))) for field in fields if getattr(self, field) is not None]), )
+
+
+class CpuTimeWatcher(object):
+    '''
+        CpuTimeWatcher - Tracks the CPU time used by a running child (linux only, from /proc), so that if it is killed,
+          ResourceLimits.getLimitExceeded can tell whether it had reached its CPU limit.
+
+            Call #update as the child runs (e.x. every time it is polled). /proc is only read every #interval seconds.
+
+        @param pid <int> - The child process id
+
+        @param interval <float> - Min seconds between reads
+    '''
+
+    def __init__(self, pid, interval=DEFAULT_CPU_WATCH_INTERVAL):
+        self.pid = pid
+        self.interval = interval
+        # cpuSeconds - The last CPU time read, or None if it could not be read (yet)
+        self.cpuSeconds = None
+        self._nextReadTime = 0
+
+    def update(self):
+        '''
+            update - Read the CPU time of the child, if #interval has passed since the last read
+        '''
+        now = time.time()
+        if now < self._nextReadTime:
+            return
+        self._nextReadTime = now + self.interval
+
+        usage = readProcUsage(self.pid)
+        if usage is not None:
+            self.cpuSeconds = usage[0]
+
+
+def getResourceLimits(limits):
+    '''
+        getResourceLimits - Convert a "limits" argument into a ResourceLimits
+
+        @param limits <None/ResourceLimits/dict> - None for no limits, a ResourceLimits, or a dict of arguments to ResourceLimits
+
+        @return <None/ResourceLimits>
+    '''
+    if limits is None or issubclass(limits.__class__, ResourceLimits):
+        return limits
+    if issubclass(limits.__class__, dict):
+        return ResourceLimits(**limits)
+    raise ValueError('limits must be a ResourceLimits, a dict of ResourceLimits arguments, or None. Got: %s' %(repr(limits), ))
+
+
+def _getIoprioSet():
+    '''
+        _getIoprioSet - Get a callable for the ioprio_set syscall on this platform
+
+        @return <callable> - ioprio_set(which, who, ioprio) returning 0 on success
+    '''
+    if not platform.system() == 'Linux':
+        raise ValueError('ionice is only supported on linux.')
+
+    syscallNum = _IOPRIO_SET_SYSCALL.get(platform.machine(), None)
+    if syscallNum is None:
+        raise ValueError('ionice is not supported on this architecture (%s).' %(platform.machine(), ))
+
+    import ctypes
+    import ctypes.util
+
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    syscall = libc.syscall
+
+    return lambda which, who, ioprio : syscall(syscallNum, which, who, ioprio)
@@ -0,0 +1,127 @@
+'''
+  pathcache.py - Cache of executable names resolved against PATH
+
+  Copyright (c) 2016 Timothy Savannah LGPLv2 All rights reserved. See LICENSE file for more details.
+
+
+  resolveExecutable - Resolve an executable name to an absolute path, using a cache
+
+  resolveCommand - Resolve the executable of a list-form command
+
+  clearExecutableCache - Forget all cached resolutions (e.x. after changing PATH or installing new executables)
+
+'''
+
+# vim: ts=4 sw=4 expandtab :
+
+import os
+import stat
+import threading
+
+__all__ = ('resolveExecutable', 'resolveCommand', 'clearExecutableCache')
+
+# _executableCache - Map of tuple( name, PATH ) to tuple( resolved path, st_dev, st_ino )
+_executableCache = {}
+_executableCacheLock = threading.Lock()
+
+
+def _isExecutableStat(statResult):
+    return stat.S_ISREG(statResult.st_mode) and bool(statResult.st_mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH))
+
+
+def _searchPath(name, path):
+    '''
+        _searchPath - Search each directory in #path for an executable #name
+
+        @return tuple( <str> resolved path, <os.stat_result> ) or None if not found
+    '''
+    for directory in path.split(os.pathsep):
+        if not directory:
+            directory = os.curdir
+        candidate = os.path.join(directory, name)
+        try:
+            statResult = os.stat(candidate)
+        except OSError:
+            continue
+        if _isExecutableStat(statResult) and os.access(candidate, os.X_OK):
+            return (os.path.abspath(candidate), statResult)
+    return None
+
+
+def resolveExecutable(name, path=None):
+    '''
+        resolveExecutable - Resolve an executable name to an absolute path by searching PATH, caching the result.
+
+            Each (name, PATH) is searched once. Afterwards the cached path is only stat'd, to make sure it is still the same executable file.
+              If it has been removed or replaced, PATH is searched again.
+
+            Note that an executable added to an earlier PATH directory after caching will not be noticed. Call #clearExecutableCache if that matters.
+
+        @param name <str> - The executable name (e.x. "git"). If it contains a path separator, it is returned unchanged.
+
+        @param path <None/str> - The search path. Default None uses the PATH environment variable (or os.defpath).
+
+        @return <str/None> - Absolute path to the executable, or None if it was not found.
+    '''
+    if os.sep in name or (os.altsep and os.altsep in name):
+        return name
+
+    if path is None:
+        path = os.environ.get('PATH', os.defpath)
+
+    cacheKey = (name, path)
+    with _executableCacheLock:
+        cached = _executableCache.get(cacheKey, None)
+
+    if cached is not None:
+        (resolvedPath, stDev, stIno) = cached
+        try:
+            statResult = os.stat(resolvedPath)
+            if statResult.st_dev == stDev and statResult.st_ino == stIno and _isExecutableStat(statResult):
+                return resolvedPath
+        except OSError:
+            pass
+
+    found = _searchPath(name, path)
+
+    with _executableCacheLock:
+        if found is None:
+            _executableCache.pop(cacheKey, None)
+            return None
+
+        (resolvedPath, statResult) = found
+        _executableCache[cacheKey] = (resolvedPath, statResult.st_dev, statResult.st_ino)
+
+    return resolvedPath
+
+
+def resolveCommand(cmd, path=None):
+    '''
+        resolveCommand - Resolve the executable (first element) of a list-form command using #resolveExecutable.
+
+            This can be used to build commands for Popen / runInBackground, so the PATH search only happens once per executable.
+              Note the child then sees the absolute path as argv[0]. To keep argv[0], pass #resolveExecutable's result to Popen as "executable" instead.
+
+        @param cmd <str/list/tuple> - The command. A str (shell command) is returned unchanged.
+
+        @param path <None/str> - The search path. Default None uses the PATH environment variable.
+
+        @return <str/list> - The command, with the first element replaced by its absolute path if found (otherwise the command is unchanged).
+    '''
+    if not issubclass(cmd.__class__, (list, tuple)) or not cmd:
+        return cmd
+
+    resolvedPath = resolveExecutable(cmd[0], path)
+    if resolvedPath is None or resolvedPath == cmd[0]:
+        return cmd
+
+    return [resolvedPath] + list(cmd[1:])
+
+
+def clearExecutableCache():
+    '''
+        clearExecutableCache - Forget all cached executable paths. Call this after changing PATH in a way
+          which should change results (like adding a directory in front), or after installing new executables.
+    '''
+    with _executableCacheLock:
+        _executableCache.clear()
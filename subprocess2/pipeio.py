@@ -0,0 +1,137 @@
+'''
+  pipeio.py - Helpers for reading from and tuning the pipes connected to a child process
+
+  Copyright (c) 2016 Timothy Savannah LGPLv2 All rights reserved. See LICENSE file for more details.
+
+
+  setPipeSize - Grow (or shrink) the kernel buffer of a pipe
+
+  AdaptiveReadSize - Tracks how much to request per read on a stream, growing while the stream stays busy
+
+  getStreamNum - Converts a stream name ("stdout"/"stderr") into the stream number used internally
+
+  closePipeStreams - Close the stdout/stderr of a child once they have been drained
+
+'''
+
+# vim: ts=4 sw=4 expandtab :
+
+import sys
+
+__all__ = ('setPipeSize', 'AdaptiveReadSize', 'getStreamNum', 'closePipeStreams', 'DEFAULT_READ_SIZE', 'DEFAULT_MAX_READ_SIZE')
+
+# Size of the first read on a stream, and the smallest read we will shrink back down to.
+DEFAULT_READ_SIZE = 4096
+
+# Largest single read we will grow to while a stream is producing data faster than we read it.
+DEFAULT_MAX_READ_SIZE = 1024 * 1024
+
+# fcntl.F_SETPIPE_SZ is only defined in python 3.10+, but the value is fixed on linux.
+_F_SETPIPE_SZ = 1031
+_F_GETPIPE_SZ = 1032
+
+# Stream numbers used throughout subprocess2 ( 1 = stdout, 2 = stderr )
+STREAM_NAME_TO_NUM = {
+    'stdout' : 1,
+    'stderr' : 2,
+    1 : 1,
+    2 : 2,
+}
+
+
+def getStreamNum(stream):
+    '''
+        getStreamNum - Get the stream number for a stream name
+
+        @param stream <str/int> - "stdout" (or 1) or "stderr" (or 2)
+
+        @return <int> - 1 for stdout, 2 for stderr
+
+        @raises ValueError - If #stream is not a known stream
+    '''
+    try:
+        return STREAM_NAME_TO_NUM[stream]
+    except (KeyError, TypeError):
+        raise ValueError('Unknown stream: %s. Should be "stdout" or "stderr".' %(repr(stream), ))
+
+
+def closePipeStreams(pipe):
+    '''
+        closePipeStreams - Close the stdout and stderr of #pipe (those which are pipes opened by Popen), ignoring errors.
+
+            Called once the streams have been drained, so the descriptors are released right away rather than
+              whenever the Popen object is garbage collected (which may be never, if a finished task is kept around).
+
+        @param pipe <subprocess.Popen> - The process
+    '''
+    for stream in (pipe.stdout, pipe.stderr):
+        if stream is not None:
+            try:
+                stream.close()
+            except:
+                pass
+
+
+def setPipeSize(stream, size):
+    '''
+        setPipeSize - Set the kernel buffer size of a pipe. A larger buffer lets a fast-writing child go longer without blocking on a full pipe.
+
+            This is only supported on linux. The buffer is shared by both ends of the pipe, so this can be called on the parent's end at any time.
+
+            Unprivileged processes are limited to /proc/sys/fs/pipe-max-size (default 1MiB).
+
+        @param stream <file/int> - The pipe (file object or file descriptor), e.x. pipe.stdout
+
+        @param size <int> - Requested size in bytes. The kernel rounds this up to a power-of-two number of pages.
+
+        @return <int/None> - The resulting size of the pipe buffer, or None if the platform does not support resizing pipes.
+    '''
+    if not sys.platform.startswith('linux'):
+        return None
+
+    import fcntl
+
+    if hasattr(stream, 'fileno'):
+        stream = stream.fileno()
+
+    return fcntl.fcntl(stream, getattr(fcntl, 'F_SETPIPE_SZ', _F_SETPIPE_SZ), int(size))
+
+
+class AdaptiveReadSize(object):
+    '''
+        AdaptiveReadSize - Tracks the number of bytes to request on the next read of a stream.
+
+            Every time a read fills the full requested size, there is likely more data waiting, so the size doubles (up to #maxSize).
+              When a read returns less than half the requested size, the stream has calmed down and the size halves (down to #minSize).
+
+            A read that returns at least half the requested size marks the stream as "hot". The kernel pipe buffer caps how much
+              a single read can return, so a stream which is being read as fast as the child writes will settle at reads about half full.
+
+        @param minSize <int> - Starting and smallest read size
+
+        @param maxSize <int> - Largest read size
+    '''
+
+    __slots__ = ('size', 'minSize', 'maxSize', 'isHot')
+
+    def __init__(self, minSize=DEFAULT_READ_SIZE, maxSize=DEFAULT_MAX_READ_SIZE):
+        self.minSize = minSize
+        self.maxSize = max(minSize, maxSize)
+        self.size = minSize
+        # isHot - True if the last read was at least half full, i.e. more data is probably already waiting.
+        self.isHot = False
+
+    def update(self, numRead):
+        '''
+            update - Adjust the read size based on the result of the last read.
+
+            @param numRead <int> - Number of bytes returned by the last read of self.size
+        '''
+        if numRead >= self.size:
+            self.isHot = True
+            self.size = min(self.size * 2, self.maxSize)
+        elif numRead >= self.size // 2:
+            self.isHot = True
+        else:
+            self.isHot = False
+            self.size = max(self.size // 2, self.minSize)
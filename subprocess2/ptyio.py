@@ -0,0 +1,115 @@
+'''
+  ptyio.py - Pseudo-terminal output capture, so children which block-buffer a pipe will line-buffer instead
+
+  Copyright (c) 2016 Timothy Savannah LGPLv2 All rights reserved. See LICENSE file for more details.
+
+
+  openPty - Open a pseudo-terminal pair configured for capturing output
+
+  ControlSequenceStripper - Removes terminal control (ANSI escape) sequences from data as it is read
+
+  isPtyEndOfFile - Check if an error from reading the master side of a pty just means the child side has closed
+
+'''
+
+# vim: ts=4 sw=4 expandtab :
+
+import errno
+import os
+import re
+
+__all__ = ('openPty', 'ControlSequenceStripper', 'isPtyEndOfFile')
+
+# CSI sequences (colours, cursor movement, etc), OSC sequences (window titles, hyperlinks), character set selection, and other two-byte escapes.
+#   "[" and "]" are left out of the two-byte escapes, as they start CSI and OSC sequences.
+_CONTROL_SEQUENCE_RE = re.compile(b'\x1b(?:\\[[0-?]*[ -/]*[@-~]|\\][^\x07\x1b]*(?:\x07|\x1b\\\\)|[()][0-9A-Za-z]|[@-Z\\\\^_])')
+
+# The start of a sequence which has not been completed by the end of the data (a lone escape, or an unterminated CSI, OSC, or character set selection)
+_INCOMPLETE_SEQUENCE_RE = re.compile(b'\x1b(?:\\[[0-?]*[ -/]*|\\][^\x07\x1b]*\x1b?|[()])?\\Z')
+
+# An escape this far from the end of the data without a complete sequence after it is not held back waiting for the rest.
+_MAX_PENDING_SEQUENCE = 4096
+
+
+def openPty():
+    '''
+        openPty - Open a pseudo-terminal pair for capturing a child's output.
+
+            The terminal is set to not translate "\\n" into "\\r\\n" (ONLCR), and to not echo, so the captured data matches what the child wrote.
+
+        @return tuple( <int> masterFd, <int> slaveFd ) - The child writes to #slaveFd, which the parent must close after starting the child. The parent reads #masterFd.
+
+        @raises ValueError - If pseudo-terminals are not supported on this platform
+    '''
+    try:
+        import pty
+        import termios
+    except ImportError:
+        raise ValueError('Pseudo-terminals are not supported on this platform.')
+
+    (masterFd, slaveFd) = pty.openpty()
+    try:
+        attrs = termios.tcgetattr(slaveFd)
+        # attrs is [ iflag, oflag, cflag, lflag, ispeed, ospeed, cc ]
+        attrs[1] &= ~termios.ONLCR
+        attrs[3] &= ~(termios.ECHO | termios.ECHONL)
+        termios.tcsetattr(slaveFd, termios.TCSANOW, attrs)
+    except:
+        os.close(masterFd)
+        os.close(slaveFd)
+        raise
+
+    return (masterFd, slaveFd)
+
+
+def isPtyEndOfFile(e):
+    '''
+        isPtyEndOfFile - Check if an error raised reading the master side of a pty is the end of the stream.
+
+            On linux, once every descriptor of the child side is closed, reading the master fails with EIO rather than returning b''.
+
+        @param e <IOError/OSError> - The error
+
+        @return <bool> - True if this should be treated as end-of-file
+    '''
+    return getattr(e, 'errno', None) == errno.EIO
+
+
+class ControlSequenceStripper(object):
+    '''
+        ControlSequenceStripper - Removes terminal control (ANSI escape) sequences from data as it is read.
+
+            A sequence split across reads is held back until the rest arrives (or #finish is called).
+    '''
+
+    def __init__(self):
+        self.pending = b''
+
+    def feed(self, data):
+        '''
+            feed - Strip control sequences from the next data read
+
+            @param data <bytes> - Raw data
+
+            @return <bytes> - #data (plus any held back from the previous call) without control sequences, less any incomplete trailing sequence
+        '''
+        if self.pending:
+            data = self.pending + data
+            self.pending = b''
+
+        incompleteMatch = _INCOMPLETE_SEQUENCE_RE.search(data, max(0, len(data) - _MAX_PENDING_SEQUENCE))
+        if incompleteMatch is not None:
+            self.pending = data[incompleteMatch.start():]
+            data = data[:incompleteMatch.start()]
+
+        return _CONTROL_SEQUENCE_RE.sub(b'', data)
+
+    def finish(self):
+        '''
+            finish - Get any data held back at the end of the stream
+
+            @return <bytes>
+        '''
+        data = self.pending
+        self.pending = b''
+        return data
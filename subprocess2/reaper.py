@@ -0,0 +1,220 @@
+'''
+  reaper.py - Central collection of exit status for every child process managed by subprocess2
+
+  Copyright (c) 2016 Timothy Savannah LGPLv2 All rights reserved. See LICENSE file for more details.
+
+
+  ChildReaper - A single thread which reaps registered children as soon as they exit, and notifies callbacks
+
+  getReaper - Get the ChildReaper for this process
+
+'''
+
+# vim: ts=4 sw=4 expandtab :
+
+import errno
+import os
+import select
+import threading
+
+__all__ = ('ChildReaper', 'getReaper', 'DEFAULT_REAPER_POLL_INTERVAL')
+
+# How often children are polled when a pidfd cannot be used for them (older kernels/pythons, non-linux)
+DEFAULT_REAPER_POLL_INTERVAL = .01
+
+
+class _ReaperEntry(object):
+    '''
+        _ReaperEntry - INTERNAL. A registered child.
+    '''
+
+    __slots__ = ('pipe', 'callbacks', 'pidfd')
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.callbacks = []
+        # pidfd - A descriptor which becomes readable when the child exits, or None if the child must be polled.
+        self.pidfd = None
+
+
+class ChildReaper(object):
+    '''
+        ChildReaper - A single thread which collects the exit status of registered children as soon as they exit,
+          so they do not sit as zombies until someone next polls them, and notifies any callbacks.
+
+            On linux with python 3.9+, each child gets a pidfd (os.pidfd_open) which becomes readable when it exits, so the reaper
+              sleeps until a child actually exits. Otherwise, registered children are polled every #pollInterval seconds.
+
+            The exit status is collected with Popen.poll, so it is stored on the Popen object (returncode) as usual,
+              and is safe alongside other code calling poll/wait on the same Popen.
+
+            Only registered children are reaped (never waitpid(-1, ...)), so children started by other code are not disturbed.
+
+        @param pollInterval <float> - Seconds between polls for children which cannot use a pidfd
+    '''
+
+    def __init__(self, pollInterval=DEFAULT_REAPER_POLL_INTERVAL):
+        self.pollInterval = pollInterval
+        self.usePidfd = bool(hasattr(os, 'pidfd_open') and hasattr(select, 'poll'))
+
+        self._lock = threading.Lock()
+        # _entries - Map of pid to _ReaperEntry
+        self._entries = {}
+        self._thread = None
+
+        # _wakeEvent - Set to wake the reaper thread when a child is registered
+        self._wakeEvent = threading.Event()
+
+        if self.usePidfd:
+            # The pidfd poll also watches this pipe, which is written to when a child is registered.
+            (self._wakeRead, self._wakeWrite) = os.pipe()
+            for fd in (self._wakeRead, self._wakeWrite):
+                _setNonBlocking(fd)
+            self._poller = select.poll()
+            self._poller.register(self._wakeRead, select.POLLIN)
+
+    def register(self, pipe, callback=None):
+        '''
+            register - Reap #pipe as soon as it exits.
+
+            @param pipe <subprocess.Popen> - The child process
+
+            @param callback <None/callable> - If provided, called as callback(pipe, returnCode) from the reaper thread once the child has been reaped.
+                If the child has already been reaped, it is called immediately.
+        '''
+        if pipe.returncode is not None:
+            if callback is not None:
+                callback(pipe, pipe.returncode)
+            return
+
+        with self._lock:
+            entry = self._entries.get(pipe.pid, None)
+            if entry is None:
+                entry = _ReaperEntry(pipe)
+                if self.usePidfd:
+                    try:
+                        entry.pidfd = os.pidfd_open(pipe.pid)
+                    except OSError:
+                        # Already reaped elsewhere, or not supported by this kernel. Fall back to polling.
+                        entry.pidfd = None
+                self._entries[pipe.pid] = entry
+
+            if callback is not None:
+                entry.callbacks.append(callback)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+        self._wake()
+
+    @property
+    def numRegistered(self):
+        '''
+            numRegistered - Number of children which have been registered and not yet reaped
+        '''
+        return len(self._entries)
+
+    def _wake(self):
+        if self.usePidfd:
+            try:
+                os.write(self._wakeWrite, b'\0')
+            except OSError as e:
+                # Pipe is full, so the reaper is already going to wake up.
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+        else:
+            self._wakeEvent.set()
+
+    def _run(self):
+        '''
+            _run - INTERNAL. Body of the reaper thread.
+        '''
+        # pidfds currently registered with the poller. Only ever touched by this thread.
+        polledFds = {}
+
+        while True:
+            with self._lock:
+                entries = list(self._entries.values())
+
+            toPoll = [entry for entry in entries if entry.pidfd is None]
+
+            if self.usePidfd:
+                for entry in entries:
+                    if entry.pidfd is not None and entry.pidfd not in polledFds:
+                        self._poller.register(entry.pidfd, select.POLLIN)
+                        polledFds[entry.pidfd] = entry
+
+                timeout = None
+                if toPoll:
+                    timeout = int(self.pollInterval * 1000)
+
+                for (fd, event) in self._poller.poll(timeout):
+                    if fd == self._wakeRead:
+                        _drain(self._wakeRead)
+                    elif fd in polledFds:
+                        toPoll.append(polledFds[fd])
+            else:
+                if toPoll:
+                    self._wakeEvent.wait(self.pollInterval)
+                else:
+                    self._wakeEvent.wait()
+                self._wakeEvent.clear()
+
+            for entry in toPoll:
+                returnCode = entry.pipe.poll()
+
+                if entry.pidfd is not None:
+                    self._poller.unregister(entry.pidfd)
+                    polledFds.pop(entry.pidfd, None)
+                    os.close(entry.pidfd)
+                    # If the child exited but could not be reaped just now (another thread is inside Popen.wait),
+                    #   it is polled from now on rather than leaving a readable pidfd that would spin the poll.
+                    entry.pidfd = None
+
+                if returnCode is None:
+                    continue
+
+                with self._lock:
+                    self._entries.pop(entry.pipe.pid, None)
+
+                for callback in entry.callbacks:
+                    try:
+                        callback(entry.pipe, returnCode)
+                    except Exception:
+                        pass
+
+
+def _setNonBlocking(fd):
+    import fcntl
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+def _drain(fd):
+    try:
+        while os.read(fd, 4096):
+            pass
+    except OSError:
+        pass
+
+
+_reaper = None
+_reaperPid = None
+_reaperLock = threading.Lock()
+
+
+def getReaper():
+    '''
+        getReaper - Get the ChildReaper for this process, creating it on first use (and again in a forked child).
+
+        @return <ChildReaper>
+    '''
+    global _reaper, _reaperPid
+
+    with _reaperLock:
+        if _reaper is None or _reaperPid != os.getpid():
+            _reaper = ChildReaper()
+            _reaperPid = os.getpid()
+        return _reaper
@@ -0,0 +1,128 @@
+'''
+  records.py - Incremental parsing of a child's output into records (lines, JSON-lines, or user-parsed lines)
+
+  Copyright (c) 2016 Timothy Savannah LGPLv2 All rights reserved. See LICENSE file for more details.
+
+
+  RecordParser - Splits data into lines as it is read (handling lines split across reads), and converts each line into a record
+
+'''
+
+# vim: ts=4 sw=4 expandtab :
+
+import json
+
+__all__ = ('RecordParser', 'RECORDS_LINES', 'RECORDS_JSON')
+
+# Each line (without the trailing newline) is a record
+RECORDS_LINES = 'lines'
+
+# Each non-blank line is decoded as JSON
+RECORDS_JSON = 'json'
+
+
+class RecordParser(object):
+    '''
+        RecordParser - Splits data into lines as it is read, and converts each line into a record.
+
+            Data which does not end in a newline is held until the rest of the line arrives (or #finish is called).
+
+        @param parse <str/callable> - How to convert each line
+
+            "lines" - Each line (without the trailing newline) is a record
+            "json"  - Each non-blank line is decoded as JSON
+            callable - Called with each line (without the trailing newline), and returns the record
+
+        @param callback <None/callable> - If provided, called with each record as it is parsed, instead of the record being collected.
+
+        @param encoding <False/str> - If provided, lines are decoded with this codec before being parsed. JSON lines are always decoded (default utf-8).
+    '''
+
+    def __init__(self, parse=RECORDS_LINES, callback=None, encoding=False):
+        if parse == RECORDS_JSON:
+            jsonEncoding = encoding or 'utf-8'
+            self.parseLine = lambda line : json.loads(line.decode(jsonEncoding)) if line.strip() else None
+            self.skipNone = True
+        elif parse == RECORDS_LINES:
+            self.parseLine = None
+            self.skipNone = False
+        elif callable(parse):
+            self.parseLine = parse
+            self.skipNone = False
+        else:
+            raise ValueError('Unknown records parse mode: %s. Should be "lines", "json", or a callable.' %(repr(parse), ))
+
+        self.callback = callback
+        self.encoding = encoding if parse != RECORDS_JSON else False
+
+        # pending - Chunks of data received since the last newline
+        self.pending = []
+
+        # errors - List of tuple( <bytes/str> line, <str> error ) for lines which failed to parse, or whose callback raised
+        self.errors = []
+
+    def feed(self, data):
+        '''
+            feed - Add data read from the stream, and parse every line it completes.
+
+            @param data <bytes> - Raw data read from the stream
+
+            @return list<object> - Records parsed from this data. If a #callback was given, records are passed to it instead, and this is empty.
+        '''
+        lastNewline = data.rfind(b'\n')
+        if lastNewline == -1:
+            if data:
+                self.pending.append(data)
+            return []
+
+        if self.pending:
+            self.pending.append(data[:lastNewline])
+            complete = b''.join(self.pending)
+            self.pending = []
+        else:
+            complete = data[:lastNewline]
+
+        if lastNewline + 1 < len(data):
+            self.pending.append(data[lastNewline + 1:])
+
+        return self._parseLines(complete.split(b'\n'))
+
+    def finish(self):
+        '''
+            finish - Parse any trailing data which did not end in a newline. Call once the stream has ended.
+
+            @return list<object> - Records parsed from the trailing data (@see #feed)
+        '''
+        if not self.pending:
+            return []
+        line = b''.join(self.pending)
+        self.pending = []
+        return self._parseLines([line])
+
+    def _parseLines(self, lines):
+        records = []
+        parseLine = self.parseLine
+        encoding = self.encoding
+        for line in lines:
+            if encoding:
+                line = line.decode(encoding)
+            if parseLine is not None:
+                try:
+                    record = parseLine(line)
+                except Exception as e:
+                    self.errors.append( (line, str(e)) )
+                    continue
+                if record is None and self.skipNone is True:
+                    continue
+            else:
+                record = line
+
+            if self.callback is not None:
+                try:
+                    self.callback(record)
+                except Exception as e:
+                    self.errors.append( (line, 'Error in callback: %s' %(str(e), )) )
+            else:
+                records.append(record)
+
+        return records
@@ -0,0 +1,363 @@
+'''
+  registry.py - Process-wide registry of the children run through subprocess2, with aggregate metrics
+
+  Copyright (c) 2016 Timothy Savannah LGPLv2 All rights reserved. See LICENSE file for more details.
+
+
+  TaskRegistry - Tracks live and recently finished tasks, and keeps counters and histograms about all of them
+
+  Histogram - A fixed-bucket histogram (cumulative buckets, as used by Prometheus)
+
+  getRegistry - Get the TaskRegistry for this process
+
+'''
+
+# vim: ts=4 sw=4 expandtab :
+
+import collections
+import itertools
+import os
+import threading
+import time
+
+__all__ = ('TaskRegistry', 'RegistryEntry', 'Histogram', 'getRegistry', 'DEFAULT_MAX_RECENT')
+
+# Default number of finished tasks kept in TaskRegistry.recentlyFinished
+DEFAULT_MAX_RECENT = 100
+
+# Seconds from calling Popen until it returns (fork/exec of the child)
+SPAWN_LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0)
+
+# Seconds from a task starting to be managed until it finished
+RUNTIME_BUCKETS = (.01, .05, .1, .5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0, 3600.0)
+
+# Bytes read from a task's stdout and stderr, 1KiB through 1GiB
+OUTPUT_BYTES_BUCKETS = tuple([ 1024 * (4 ** power) for power in range(11) ])
+
+
+class Histogram(object):
+    '''
+        Histogram - Counts of observed values within fixed buckets, plus their sum and count.
+
+        @param buckets <tuple<float>> - Upper bounds of each bucket, ascending. A final +Inf bucket is implied.
+    '''
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        # counts - Number of observations in each bucket (not cumulative), with the last entry being above every bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        '''
+            observe - Add a value. Not locked, callers (TaskRegistry) hold their own lock.
+
+            @param value <float> - The value
+        '''
+        idx = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            idx += 1
+        self.counts[idx] += 1
+        self.sum += value
+        self.count += 1
+
+    def asDict(self):
+        '''
+            asDict - Get a copy of the histogram
+
+            @return <dict> - 'buckets' (list of tuple( upper bound, cumulative count ), ending with float('inf')), 'sum', and 'count'
+        '''
+        cumulative = 0
+        buckets = []
+        for (bound, count) in zip(self.buckets + (float('inf'), ), self.counts):
+            cumulative += count
+            buckets.append( (bound, cumulative) )
+        return {
+            'buckets' : buckets,
+            'sum' : self.sum,
+            'count' : self.count,
+        }
+
+
+class RegistryEntry(object):
+    '''
+        RegistryEntry - A task in the registry
+
+        FIELDS:
+
+            entryId - Unique id within the registry
+            kind - What started the task: "background" (runInBackground / TaskQueue / Simple.runInBackground), "simple" (Simple.runGetResults / runGetOutput), or "worker" (a WorkerPool worker process)
+            pid - Process id of the child
+            startTime - time.time() when the task was registered
+            taskInfo - The BackgroundTaskInfo, for background tasks. Otherwise None.
+            endTime - time.time() when the task finished, or None while live
+            returnCode - Return code once finished
+            bytesRead - Bytes read from the child's stdout/stderr, once finished
+    '''
+
+    __slots__ = ('entryId', 'kind', 'pid', 'startTime', 'taskInfo', 'endTime', 'returnCode', 'bytesRead')
+
+    def __init__(self, entryId, kind, pid, taskInfo=None):
+        self.entryId = entryId
+        self.kind = kind
+        self.pid = pid
+        self.startTime = time.time()
+        self.taskInfo = taskInfo
+        self.endTime = None
+        self.returnCode = None
+        self.bytesRead = 0
+
+    @property
+    def runtime(self):
+        '''
+            runtime - Seconds the task has been running, or ran for if finished
+        '''
+        return (self.endTime or time.time()) - self.startTime
+
+    def asDict(self):
+        '''
+            asDict - Get the entry as a dict (without the taskInfo)
+        '''
+        return {
+            'entryId' : self.entryId,
+            'kind' : self.kind,
+            'pid' : self.pid,
+            'startTime' : self.startTime,
+            'endTime' : self.endTime,
+            'runtime' : self.runtime,
+            'returnCode' : self.returnCode,
+            'bytesRead' : self.bytesRead,
+        }
+
+    def __repr__(self):
+        return 'RegistryEntry(kind=%s, pid=%s, returnCode=%s, runtime=%.3f)' %(repr(self.kind), repr(self.pid), repr(self.returnCode), self.runtime)
+
+
+class TaskRegistry(object):
+    '''
+        TaskRegistry - Tracks every child run through subprocess2 (background tasks, TaskQueue, and the Simple methods),
+          and keeps cheap aggregate counters and histograms.
+
+            Use #getRegistry to get the registry used by subprocess2. Export with #asDict, or #toPrometheus for the Prometheus text format.
+
+        @param maxRecent <int> - Number of finished tasks kept in #recentlyFinished
+    '''
+
+    # Counters kept by the registry, and their descriptions (used as the HELP text in #toPrometheus)
+    COUNTERS = (
+        ('tasksStarted', 'Tasks started'),
+        ('tasksFinished', 'Tasks finished'),
+        ('tasksFailed', 'Tasks which finished with a non-zero return code'),
+        ('launchFailures', 'Commands which could not be started'),
+        ('terminateCount', 'Processes sent SIGTERM by subprocess2 (waitOrTerminate, or a Simple timeout)'),
+        ('killCount', 'Processes sent SIGKILL by subprocess2 (waitOrTerminate, or a Simple timeout)'),
+        ('bytesRead', 'Bytes read from the stdout and stderr of finished tasks'),
+    )
+
+    def __init__(self, maxRecent=DEFAULT_MAX_RECENT):
+        self._lock = threading.Lock()
+        self._entryIds = itertools.count(1)
+
+        # live - Map of entryId to RegistryEntry for tasks which have not finished
+        self.live = {}
+        # recentlyFinished - The last #maxRecent finished RegistryEntry objects, oldest first
+        self.recentlyFinished = collections.deque(maxlen=maxRecent)
+
+        self.counters = dict([ (name, 0) for (name, description) in self.COUNTERS ])
+
+        self.spawnLatency = Histogram(SPAWN_LATENCY_BUCKETS)
+        self.runtime = Histogram(RUNTIME_BUCKETS)
+        self.outputBytes = Histogram(OUTPUT_BYTES_BUCKETS)
+
+    def taskStarted(self, kind, pid, taskInfo=None):
+        '''
+            taskStarted - Add a live task
+
+            @param kind <str> - "background", "simple", or "worker"
+
+            @param pid <int> - Process id
+
+            @param taskInfo <None/BackgroundTaskInfo> - The task info, for background tasks
+
+            @return <RegistryEntry> - Pass to #taskFinished when the task completes
+        '''
+        entry = RegistryEntry(next(self._entryIds), kind, pid, taskInfo)
+        with self._lock:
+            self.live[entry.entryId] = entry
+            self.counters['tasksStarted'] += 1
+        return entry
+
+    def taskFinished(self, entry, returnCode, bytesRead=0):
+        '''
+            taskFinished - Move a task from live to finished, and record its runtime and output size
+
+            @param entry <RegistryEntry> - As returned by #taskStarted
+
+            @param returnCode <int/None> - Return code of the process
+
+            @param bytesRead <int> - Bytes read from its stdout and stderr
+        '''
+        entry.endTime = time.time()
+        entry.returnCode = returnCode
+        entry.bytesRead = bytesRead
+        # Finished entries are kept for inspection, but should not keep all of the task's output alive
+        entry.taskInfo = None
+
+        with self._lock:
+            self.live.pop(entry.entryId, None)
+            self.recentlyFinished.append(entry)
+
+            counters = self.counters
+            counters['tasksFinished'] += 1
+            if returnCode != 0:
+                counters['tasksFailed'] += 1
+            counters['bytesRead'] += bytesRead
+
+            self.runtime.observe(entry.endTime - entry.startTime)
+            self.outputBytes.observe(bytesRead)
+
+    def recordSpawn(self, seconds):
+        '''
+            recordSpawn - Record how long starting a child (the Popen call) took
+
+            @param seconds <float> - Seconds
+        '''
+        with self._lock:
+            self.spawnLatency.observe(seconds)
+
+    def recordLaunchFailure(self):
+        '''
+            recordLaunchFailure - Record that a command could not be started
+        '''
+        with self._lock:
+            self.counters['launchFailures'] += 1
+
+    def recordActionTaken(self, actionTaken):
+        '''
+            recordActionTaken - Record a terminate and/or kill sent by subprocess2
+
+            @param actionTaken <int> - Mask of SUBPROCESS2_PROCESS_* (as returned by waitOrTerminate)
+        '''
+        from . import SUBPROCESS2_PROCESS_TERMINATED, SUBPROCESS2_PROCESS_KILLED
+
+        if not actionTaken:
+            return
+        with self._lock:
+            if actionTaken & SUBPROCESS2_PROCESS_TERMINATED:
+                self.counters['terminateCount'] += 1
+            if actionTaken & SUBPROCESS2_PROCESS_KILLED:
+                self.counters['killCount'] += 1
+
+    @property
+    def numLive(self):
+        '''
+            numLive - Number of tasks currently running (or still being read)
+        '''
+        return len(self.live)
+
+    def getBufferedSize(self):
+        '''
+            getBufferedSize - Total size of output currently held in memory by live background tasks
+
+            @return <int>
+        '''
+        with self._lock:
+            taskInfos = [ entry.taskInfo for entry in self.live.values() if entry.taskInfo is not None ]
+        return sum([ taskInfo.bufferedSize for taskInfo in taskInfos ])
+
+    def asDict(self):
+        '''
+            asDict - Get a snapshot of the registry
+
+            @return <dict> - Keys:
+
+                'live' <list<dict>> - Each live task ( @see RegistryEntry.asDict )
+                'recentlyFinished' <list<dict>> - Each recently finished task, oldest first
+                'numLive' <int> - Number of live tasks
+                'bufferedSize' <int> - @see #getBufferedSize
+                'counters' <dict> - Each of COUNTERS
+                'spawnLatency', 'runtime', 'outputBytes' <dict> - Histograms ( @see Histogram.asDict )
+        '''
+        bufferedSize = self.getBufferedSize()
+        with self._lock:
+            return {
+                'live' : [ entry.asDict() for entry in self.live.values() ],
+                'recentlyFinished' : [ entry.asDict() for entry in self.recentlyFinished ],
+                'numLive' : len(self.live),
+                'bufferedSize' : bufferedSize,
+                'counters' : dict(self.counters),
+                'spawnLatency' : self.spawnLatency.asDict(),
+                'runtime' : self.runtime.asDict(),
+                'outputBytes' : self.outputBytes.asDict(),
+            }
+
+    def toPrometheus(self, prefix='subprocess2'):
+        '''
+            toPrometheus - Export the counters, gauges, and histograms in the Prometheus text exposition format
+
+            @param prefix <str> - Prefix for every metric name
+
+            @return <str>
+        '''
+        snapshot = self.asDict()
+        lines = []
+
+        def addMetric(name, metricType, description, samples):
+            lines.append('# HELP %s_%s %s' %(prefix, name, description))
+            lines.append('# TYPE %s_%s %s' %(prefix, name, metricType))
+            for (suffix, labels, value) in samples:
+                lines.append('%s_%s%s%s %s' %(prefix, name, suffix, labels, _formatValue(value)))
+
+        addMetric('tasks_live', 'gauge', 'Tasks currently running', [ ('', '', snapshot['numLive']) ])
+        addMetric('buffered_bytes', 'gauge', 'Output held in memory by live background tasks', [ ('', '', snapshot['bufferedSize']) ])
+
+        for (counterName, description) in self.COUNTERS:
+            addMetric(_toSnakeCase(counterName) + '_total', 'counter', description, [ ('', '', snapshot['counters'][counterName]) ])
+
+        for (histogramName, metricName, description) in (
+                ('spawnLatency', 'spawn_latency_seconds', 'Seconds taken to start a child'),
+                ('runtime', 'runtime_seconds', 'Seconds from a task starting until it finished'),
+                ('outputBytes', 'output_bytes', 'Bytes read from the stdout and stderr of each task'),
+        ):
+            histogram = snapshot[histogramName]
+            samples = [ ('_bucket', '{le="%s"}' %(_formatValue(bound), ), count) for (bound, count) in histogram['buckets'] ]
+            samples.append( ('_sum', '', histogram['sum']) )
+            samples.append( ('_count', '', histogram['count']) )
+            addMetric(metricName, 'histogram', description, samples)
+
+        return '\n'.join(lines) + '\n'
+
+
+def _formatValue(value):
+    if value == float('inf'):
+        return '+Inf'
+    if issubclass(value.__class__, float):
+        return repr(value)
+    return str(value)
+
+
+def _toSnakeCase(name):
+    return ''.join([ ('_' + char.lower()) if char.isupper() else char for char in name ])
+
+
+_registry = None
+_registryPid = None
+_registryLock = threading.Lock()
+
+
+def getRegistry():
+    '''
+        getRegistry - Get the TaskRegistry for this process, creating it on first use (and again in a forked child, which starts empty).
+
+        @return <TaskRegistry>
+    '''
+    global _registry, _registryPid
+
+    with _registryLock:
+        if _registry is None or _registryPid != os.getpid():
+            _registry = TaskRegistry()
+            _registryPid = os.getpid()
+        return _registry
@@ -0,0 +1,256 @@
+'''
+  sampler.py - Periodic sampling of CPU and memory usage of child processes from /proc
+
+  Copyright (c) 2016 Timothy Savannah LGPLv2 All rights reserved. See LICENSE file for more details.
+
+
+  ResourceTimeline - A compact, bounded time series of CPU time and RSS for one process
+
+  ResourceSampler - A single thread which samples every registered process on its own interval
+
+  getSampler - Get the ResourceSampler for this process
+
+'''
+
+# vim: ts=4 sw=4 expandtab :
+
+import array
+import os
+import threading
+import time
+
+__all__ = ('ResourceTimeline', 'ResourceSampler', 'getSampler', 'readProcUsage', 'DEFAULT_MAX_SAMPLES')
+
+# Default max number of samples kept per timeline. When full, every other sample is dropped and sampling slows by half.
+DEFAULT_MAX_SAMPLES = 1024
+
+try:
+    _CLOCK_TICKS = float(os.sysconf('SC_CLK_TCK'))
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _CLOCK_TICKS = 100.0
+    _PAGE_SIZE = 4096
+
+try:
+    array.array('q')
+    _INT_TYPECODE = 'q'
+except ValueError:
+    _INT_TYPECODE = 'l'
+
+
+def readProcUsage(pid):
+    '''
+        readProcUsage - Read the current CPU time and RSS of a process from /proc (linux only)
+
+        @param pid <int> - Process id
+
+        @return tuple( <float> cpuSeconds (user + system), <int> rssBytes ), or None if the process (or /proc) is not available
+    '''
+    try:
+        with open('/proc/%d/stat' %(pid, ), 'rb') as f:
+            statData = f.read()
+        with open('/proc/%d/statm' %(pid, ), 'rb') as f:
+            statmData = f.read()
+    except (IOError, OSError):
+        return None
+
+    # The command name (field 2) is in parens and may contain spaces, so split after the last ')'.
+    #   utime and stime are fields 14 and 15, which are 11 and 12 after the state field.
+    statFields = statData[statData.rfind(b')') + 2:].split()
+    try:
+        cpuSeconds = (int(statFields[11]) + int(statFields[12])) / _CLOCK_TICKS
+        rssBytes = int(statmData.split()[1]) * _PAGE_SIZE
+    except (IndexError, ValueError):
+        return None
+
+    return (cpuSeconds, rssBytes)
+
+
+class ResourceTimeline(object):
+    '''
+        ResourceTimeline - A compact time series of CPU time and RSS for one process, stored in arrays.
+
+            The number of samples is bounded by #maxSamples. When full, every other sample is dropped and only every other
+              future sample is kept, so the timeline always covers the whole life of the process at a decreasing resolution.
+
+        @param maxSamples <int> - Max number of samples to keep (at least 2)
+
+
+        FIELDS:
+
+            times - array of float seconds since the timeline was created
+            cpuSeconds - array of float total (user + system) cpu seconds used by the process at each time
+            rssBytes - array of int resident memory in bytes at each time
+    '''
+
+    def __init__(self, maxSamples=DEFAULT_MAX_SAMPLES):
+        self.maxSamples = max(2, maxSamples)
+        self.startTime = time.time()
+        self.times = array.array('d')
+        self.cpuSeconds = array.array('d')
+        self.rssBytes = array.array(_INT_TYPECODE)
+
+        # keepEvery - Only every Nth offered sample is stored. Doubles every time the timeline fills up.
+        self.keepEvery = 1
+        self._numOffered = 0
+        self._lock = threading.Lock()
+
+    def addSample(self, cpuSeconds, rssBytes, sampleTime=None):
+        '''
+            addSample - Offer a sample to the timeline.
+
+            @param cpuSeconds <float> - Total cpu seconds used
+
+            @param rssBytes <int> - Resident memory in bytes
+
+            @param sampleTime <None/float> - time.time() of the sample, default now
+        '''
+        if sampleTime is None:
+            sampleTime = time.time()
+
+        with self._lock:
+            self._numOffered += 1
+            if self._numOffered % self.keepEvery != 0:
+                return
+
+            if len(self.times) >= self.maxSamples:
+                for arr in (self.times, self.cpuSeconds, self.rssBytes):
+                    arr[:] = arr[::2]
+                self.keepEvery *= 2
+
+            self.times.append(sampleTime - self.startTime)
+            self.cpuSeconds.append(cpuSeconds)
+            self.rssBytes.append(rssBytes)
+
+    def __len__(self):
+        return len(self.times)
+
+    def samples(self):
+        '''
+            samples - Get a copy of all samples
+
+            @return list< tuple( <float> time, <float> cpuSeconds, <int> rssBytes ) >
+        '''
+        with self._lock:
+            return list(zip(self.times, self.cpuSeconds, self.rssBytes))
+
+    @property
+    def peakRssBytes(self):
+        '''
+            peakRssBytes - The highest sampled RSS, or 0 if no samples
+        '''
+        with self._lock:
+            return max(self.rssBytes) if self.rssBytes else 0
+
+    def __repr__(self):
+        return 'ResourceTimeline(numSamples=%d, keepEvery=%d)' %(len(self.times), self.keepEvery)
+
+
+class _SamplerEntry(object):
+    '''
+        _SamplerEntry - INTERNAL. A process registered with the ResourceSampler.
+    '''
+
+    __slots__ = ('pid', 'timeline', 'interval', 'nextSampleTime')
+
+    def __init__(self, pid, timeline, interval):
+        self.pid = pid
+        self.timeline = timeline
+        self.interval = interval
+        self.nextSampleTime = time.time()
+
+
+class ResourceSampler(object):
+    '''
+        ResourceSampler - A single thread which samples the CPU time and RSS of every registered process (from /proc), each on its own interval.
+
+            One thread serves every process, so the overhead stays low with many children.
+    '''
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        # _entries - Map of pid to _SamplerEntry
+        self._entries = {}
+        self._thread = None
+
+    def register(self, pid, timeline, interval):
+        '''
+            register - Start sampling a process
+
+            @param pid <int> - Process id
+
+            @param timeline <ResourceTimeline> - Where to record the samples
+
+            @param interval <float> - Seconds between samples
+        '''
+        with self._condition:
+            self._entries[pid] = _SamplerEntry(pid, timeline, interval)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify_all()
+
+    def unregister(self, pid):
+        '''
+            unregister - Stop sampling a process
+
+            @param pid <int> - Process id
+        '''
+        with self._condition:
+            self._entries.pop(pid, None)
+
+    @property
+    def numRegistered(self):
+        '''
+            numRegistered - Number of processes being sampled
+        '''
+        return len(self._entries)
+
+    def _run(self):
+        '''
+            _run - INTERNAL. Body of the sampler thread.
+        '''
+        while True:
+            with self._condition:
+                while not self._entries:
+                    self._condition.wait()
+
+                now = time.time()
+                due = [entry for entry in self._entries.values() if entry.nextSampleTime <= now]
+
+            for entry in due:
+                usage = readProcUsage(entry.pid)
+                if usage is None:
+                    # Process is gone (or /proc is unavailable)
+                    self.unregister(entry.pid)
+                    continue
+                entry.timeline.addSample(usage[0], usage[1], now)
+                entry.nextSampleTime = now + entry.interval
+
+            with self._condition:
+                if not self._entries:
+                    continue
+                sleepFor = min([entry.nextSampleTime for entry in self._entries.values()]) - time.time()
+                if sleepFor > 0:
+                    self._condition.wait(sleepFor)
+
+
+_sampler = None
+_samplerPid = None
+_samplerLock = threading.Lock()
+
+
+def getSampler():
+    '''
+        getSampler - Get the ResourceSampler for this process, creating it on first use (and again in a forked child)
+
+        @return <ResourceSampler>
+    '''
+    global _sampler, _samplerPid
+
+    with _samplerLock:
+        if _sampler is None or _samplerPid != os.getpid():
+            _sampler = ResourceSampler()
+            _samplerPid = os.getpid()
+        return _sampler
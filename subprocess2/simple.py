@@ -8,14 +8,33 @@
 
 # vim: ts=4 sw=4 expandtab :
 
+import codecs
+import os
 import select
 import sys
 import time
 
 import subprocess
 
+from . import DEFAULT_POLL_INTERVAL, SUBPROCESS2_DEFAULT_TERMINATE_TO_KILL_SECONDS, SUBPROCESS2_PROCESS_COMPLETED, SUBPROCESS2_PROCESS_TERMINATED, SUBPROCESS2_PROCESS_KILLED
+from .argbatch import getArgumentBatches
+from .BackgroundTask import BackgroundTaskInfo, CompressedStreamBuffer, startBackgroundTask
+from .limits import getResourceLimits
+from .pipeio import setPipeSize, AdaptiveReadSize, closePipeStreams, DEFAULT_MAX_READ_SIZE
+from .pathcache import resolveExecutable
+from .ptyio import openPty, ControlSequenceStripper, isPtyEndOfFile
+from .reaper import getReaper
+from .records import RecordParser
+from .registry import getRegistry
+from .tee import getTeeTargets
+from .TaskQueue import TaskQueue, getNumCores
+
 __all__ = ('Simple', 'SimpleCommandFailure')
 
+# With a timeout, once the command has exited (but something it started still holds its pipes), max seconds past the timeout to keep
+#   reading what the command wrote before it exited.
+_EXITED_DRAIN_SECONDS = .1
+
 class Simple(object):
     '''
         Simple - Simple and quick commands to run a subprocess and get the results.
@@ -25,10 +44,14 @@ class Simple(object):
             runGetOutput - Simply runs a command and returns the program's output. Optionally raises SimpleCommandFailure on failure. @see #runGetOutput for more details.
 
             runGetResults - Runs a command and based on paramaters returns a dict containing: returnCode, stdout, stderr. @see #runGetResults for more details.
+
+            runInBackground - Starts a command and gathers its output in the background, returning a BackgroundTaskInfo. @see #runInBackground for more details.
+
+            runChunked - Runs a command over a long list of arguments, split into batches which are run in parallel (like xargs -P). @see #runChunked for more details.
     '''
 
     @staticmethod
-    def runGetResults(cmd, stdout=True, stderr=True, encoding=sys.getdefaultencoding()):
+    def runGetResults(cmd, stdout=True, stderr=True, encoding=sys.getdefaultencoding(), teeTo=None, teeCapture=True, maxReadSize=DEFAULT_MAX_READ_SIZE, pipeSize=None, records=None, recordCallback=None, cacheExecutable=False, limits=None, timeout=None, terminateToKillSeconds=SUBPROCESS2_DEFAULT_TERMINATE_TO_KILL_SECONDS, usePty=False, stripControlSequences=False, compress=None):
         '''
             runGetResults - Simple method to run a command and return the results of the execution as a dict.
 
@@ -55,96 +78,308 @@ class Simple(object):
 
                 If unsure, leave this as it's default value, or provide "utf-8"
 
+            @param teeTo <None/int/file/str/dict> - Default None. If provided, captured stdout data will also be written to this target as it arrives.
+
+                May be an int (file descriptor), an open file object, or a str (path to a file which will be created/truncated, and closed when the command completes).
+                May also be a dict mapping "stdout" and/or "stderr" to a target, to tee either or both captured streams.
+
+            @param teeCapture <True/False> - Default True. If False, streams which are tee'd will not be gathered, and their key in the results will be empty.
+                The data is moved straight from the pipe to the target (using os.splice where available), so very large outputs never enter python memory.
+
+            @param maxReadSize <int> - Default 1MiB. Reads start at 4KiB, and double (up to this size) each time a read fills the whole buffer.
+
+            @param pipeSize <None/int> - Default None. If provided, the kernel buffers of the captured pipes are resized to this many bytes (linux only).
+
+            @param records <None/str/callable> - Default None. If provided, stdout is split into lines as it is read, and each line is converted into a record
+                while the command runs. The records are returned under the key "records", and the "stdout" key will be empty. Requires stdout=True.
+
+                "lines" - Each line (without the newline) is a record. Lines are decoded if #encoding is set.
+                "json"  - Each non-blank line is decoded as JSON. Lines which fail to decode are returned under the key "recordErrors".
+                callable - Called with each line, and returns the record.
+
+            @param recordCallback <None/callable> - Default None. If provided with #records, each record is passed to this function as it is parsed, instead of being collected.
+
+            @param cacheExecutable <True/False> - Default False. If True and #cmd is a list, the executable is resolved against PATH once and cached
+                (@see subprocess2.pathcache.resolveExecutable), rather than being searched for on every call. Use subprocess2.clearExecutableCache if PATH changes.
+
+            @param limits <None/dict/subprocess2.limits.ResourceLimits> - Default None. Resource limits applied in the child before it executes (POSIX only).
+                May be a ResourceLimits or a dict of its arguments: maxMemory (RLIMIT_AS bytes), maxCpuSeconds (RLIMIT_CPU), maxOpenFiles (RLIMIT_NOFILE),
+                nice, ioniceClass, ioniceLevel, cpuAffinity. @see subprocess2.limits.ResourceLimits
+
+            @param timeout <None/float> - Default None. If provided, max number of seconds (wall-clock) to let the command run. Once exceeded, the command
+                is terminated (and killed) as in Popen.waitOrTerminate, and whatever output was gathered up to that point is returned.
+                If the command itself has exited but something it started (like a background child of a shell) still holds the pipes open,
+                reading stops at the timeout, and the output gathered so far is returned with the command's returnCode (and "actionTaken" of 0).
+
+            @param terminateToKillSeconds <float/None> - Default 1.5. Used with #timeout, @see Popen.waitOrTerminate
+                * None - Only terminate is sent. If the command has not exited after a short grace period, results are returned with returnCode None.
+                * 0 - Kill is sent right away, without terminate
+                * > 0 - Max seconds between terminate and kill
+
+            @param usePty <True/False> - Default False. If True, stdout is a pseudo-terminal (POSIX only) rather than a pipe, so programs which
+                block-buffer their output when writing to a pipe will line-buffer it instead. If #stderr is "stdout", stderr goes to the same terminal,
+                otherwise it remains a pipe. Requires #stdout to be captured.
+
+            @param stripControlSequences <True/False> - Default False. With #usePty, remove terminal control sequences (colours, cursor movement, titles)
+                from the gathered stdout. Data sent to #teeTo is not stripped.
+
+            @param compress <None/str> - Default None. If "zlib" or "lzma", output is compressed as it is read, and 'stdout' / 'stderr' in the results
+                are subprocess2.BackgroundTask.CompressedStreamBuffer objects instead of strings. Use their getValue() method to get all of the
+                (decoded) output, or iterData() to stream it out a piece at a time. 'compressionRatio' is added to the results.
+
             @return <dict> - Dict of results. Has following keys:
 
                 'returnCode' - <int> - Always present, included the integer return-code from the command.
                 'stdout'       <unciode/str/bytes (depending on #encoding)> - Present if stdout=True, contains data output by program to stdout, or stdout+stderr if stderr param is "stdout"/subprocess.STDOUT
                 'stderr'       <unicode/str/bytes (depending on #encoding)> - Present if stderr=True, contains data output by program to stderr.
+                'records'      <list> - Present if #records is set, the records parsed from stdout.
+                'recordErrors' <list> - Present if #records is set, list of tuple( line, error message ) for lines which failed to parse.
+                'limitExceeded' <None/str> - Present if #limits is set. None, or the limit which appears to have stopped the command: "cpu", "memory", or "openFiles"
+                'actionTaken'  <int> - Present if #timeout is set. Mask of SUBPROCESS2_PROCESS_* (as in Popen.waitOrTerminate): SUBPROCESS2_PROCESS_COMPLETED if
+                                        the command finished in time, otherwise SUBPROCESS2_PROCESS_TERMINATED and/or SUBPROCESS2_PROCESS_KILLED.
+                                        When terminated or killed, 'returnCode' is the (negative signal) return code if the command has exited, otherwise None.
+                'compressionRatio' <float/None> - Present if #compress is set. Size of the output divided by its compressed size (None if there was no output).
 
 
             @raises - SimpleCommandFailure if it cannot launch the given command, for reasons such as: cannot find the executable, or no permission to execute, etc
         '''
    
-        if stderr in ('stdout', subprocess.STDOUT):
-            stderr = subprocess.STDOUT
-        elif stderr == True or stderr == subprocess.PIPE:
-            stderr = subprocess.PIPE
-        else:
-            stderr = None
+        (stdout, stderr) = _getStreamArgs(stdout, stderr)
 
-        if stdout == True or stdout == subprocess.STDOUT:
-            stdout = subprocess.PIPE
-        else:
-            stdout = None
-            if stderr == subprocess.PIPE:
-                raise ValueError('Cannot redirect stderr to stdout if stdout is not captured.')
+        limits = getResourceLimits(limits)
 
-        if issubclass(cmd.__class__, (list, tuple)):
-            shell = False
-        else:
-            shell = True
+        recordParser = None
+        if records is not None:
+            if stdout != subprocess.PIPE:
+                raise ValueError('Cannot parse records from stdout if stdout is not captured.')
+            recordParser = RecordParser(records, recordCallback, encoding)
+
+        teeTargets = getTeeTargets(teeTo)
 
         try:
-            pipe = subprocess.Popen(cmd, stdout=stdout, stderr=stderr, shell=shell)
-        except Exception as e:
-            try:
-                if shell is True:
-                    cmdStr = ' '.join(cmd)
-                else:
-                    cmdStr = cmd
-            except:
-                cmdStr = repr(cmd)
+            pipe = _startCommand(cmd, stdout, stderr, cacheExecutable, limits, usePty)
+        except:
+            for teeTarget in teeTargets.values():
+                teeTarget.close()
+            raise
 
-            raise SimpleCommandFailure('Failed to execute "%s": %s' %(cmdStr, str(e)), returnCode=255)
+        # If we are interrupted before the command completes, it will still be collected when it exits
+        getReaper().register(pipe)
 
+        registry = getRegistry()
+        registryEntry = registry.taskStarted('simple', pipe.pid)
+        bytesRead = 0
 
         streams = []
         fileNoToKey = {}
+        fileNoToTee = {}
+        fileNoToReadSize = {}
         ret = {}
         if stdout == subprocess.PIPE:
             streams.append(pipe.stdout)
             fileNoToKey[pipe.stdout.fileno()] = 'stdout'
-            ret['stdout'] = []
+            fileNoToTee[pipe.stdout.fileno()] = teeTargets.get(1, None)
+            fileNoToReadSize[pipe.stdout.fileno()] = AdaptiveReadSize(maxSize=maxReadSize)
+            ret['stdout'] = _newOutputBuffer(compress, encoding)
         if stderr == subprocess.PIPE:
             streams.append(pipe.stderr)
             fileNoToKey[pipe.stderr.fileno()] = 'stderr'
-            ret['stderr'] = []
+            fileNoToTee[pipe.stderr.fileno()] = teeTargets.get(2, None)
+            fileNoToReadSize[pipe.stderr.fileno()] = AdaptiveReadSize(maxSize=maxReadSize)
+            ret['stderr'] = _newOutputBuffer(compress, encoding)
 
-        returnCode = None
+        # decoders - When compressing decoded output, an incremental decoder for each stream, so a character split across two reads is decoded whole.
+        #   (Otherwise the output is only decoded once it has all been read.)
+        decoders = {}
+        if compress and encoding:
+            decoders = dict([ (key, codecs.getincrementaldecoder(encoding)()) for key in ret ])
 
+        stripper = None
+        if usePty is True and stripControlSequences is True:
+            stripper = ControlSequenceStripper()
 
-        time.sleep(.02)
-        while returnCode is None or streams:
-            returnCode = pipe.poll()
+        # cpuWatcher - If there is a CPU limit, tracks the CPU time of the command, so a SIGKILL can be attributed to that limit (or not)
+        cpuWatcher = None
+        if limits is not None:
+            cpuWatcher = limits.getCpuTimeWatcher(pipe.pid)
 
-            while True:
-                (readyToRead, junk1, junk2) = select.select(streams, [], [], .005)
-                if not readyToRead:
-                    # Don't strangle CPU
-                    time.sleep(.01)
-                    break
+        returnCode = None
+        recordsRead = []
 
-                for readyStream in readyToRead:
+        actionTaken = SUBPROCESS2_PROCESS_COMPLETED
+        if timeout is not None:
+            deadline = time.time() + timeout
+        # nextActionTime - When the deadline has passed, the time at which to escalate (or give up on the command exiting)
+        nextActionTime = None
 
-                    retKey = fileNoToKey[readyStream.fileno()]
-                    curRead = readyStream.read()
-                    if curRead in (b'', ''):
-                        streams.remove(readyStream)
+        try:
+            if pipeSize:
+                for stream in streams:
+                    if usePty is True and stream is pipe.stdout:
+                        # Not a pipe
                         continue
-                    ret[retKey].append(curRead)
+                    setPipeSize(stream, pipeSize)
+
+            time.sleep(.02)
+            while returnCode is None or streams:
+                if cpuWatcher is not None and returnCode is None:
+                    cpuWatcher.update()
+                returnCode = pipe.poll()
+
+                if timeout is not None and returnCode is None:
+                    now = time.time()
+                    if actionTaken == SUBPROCESS2_PROCESS_COMPLETED and now >= deadline:
+                        if terminateToKillSeconds == 0:
+                            pipe.kill()
+                            actionTaken |= SUBPROCESS2_PROCESS_KILLED
+                        else:
+                            pipe.terminate()
+                            actionTaken |= SUBPROCESS2_PROCESS_TERMINATED
+                            nextActionTime = now + (terminateToKillSeconds or DEFAULT_POLL_INTERVAL)
+                    elif nextActionTime is not None and now >= nextActionTime:
+                        nextActionTime = None
+                        if terminateToKillSeconds is None:
+                            # Only terminate was requested, and the command is ignoring it. Return what we have.
+                            break
+                        pipe.kill()
+                        actionTaken |= SUBPROCESS2_PROCESS_KILLED
+
+                # isDrained - Set if everything available on the streams has been read
+                isDrained = False
+                while True:
+                    (readyToRead, junk1, junk2) = select.select(streams, [], [], .005)
+                    if not readyToRead:
+                        isDrained = True
+                        # Don't strangle CPU
+                        time.sleep(.01)
+                        break
+
+                    if timeout is not None and time.time() >= deadline:
+                        # Still read this batch, but go back to check whether to escalate (or stop) rather than reading indefinitely
+                        breakAfterRead = True
+                    else:
+                        breakAfterRead = False
+
+                    for readyStream in readyToRead:
+
+                        readyFileNo = readyStream.fileno()
+                        retKey = fileNoToKey[readyFileNo]
+                        teeTarget = fileNoToTee[readyFileNo]
+                        readSize = fileNoToReadSize[readyFileNo]
+
+                        if teeTarget is not None and teeCapture is False:
+                            # Not gathering this stream, so move the data straight from the pipe to the target
+                            numMoved = teeTarget.copyFrom(readyFileNo, readSize.size)
+                            readSize.update(numMoved)
+                            bytesRead += numMoved
+                            if not numMoved:
+                                streams.remove(readyStream)
+                            continue
+
+                        try:
+                            curRead = os.read(readyFileNo, readSize.size)
+                        except OSError as e:
+                            if not isPtyEndOfFile(e):
+                                raise
+                            curRead = b''
+                        readSize.update(len(curRead))
+                        bytesRead += len(curRead)
+                        if curRead in (b'', ''):
+                            streams.remove(readyStream)
+                            continue
+                        if teeTarget is not None:
+                            teeTarget.write(curRead)
+                        if stripper is not None and retKey == 'stdout':
+                            curRead = stripper.feed(curRead)
+                        if recordParser is not None and retKey == 'stdout':
+                            recordsRead += recordParser.feed(curRead)
+                            continue
+                        if decoders:
+                            curRead = decoders[retKey].decode(curRead)
+                            if not curRead:
+                                continue
+                        ret[retKey].append(curRead)
+
+                    if breakAfterRead is True:
+                        break
+
+                if actionTaken != SUBPROCESS2_PROCESS_COMPLETED and returnCode is not None:
+                    # Command was stopped and all available output has been read. Anything still holding the pipes open
+                    #   (like a background child of a shell) should not hold up returning.
+                    break
 
+                if timeout is not None and returnCode is not None and streams:
+                    now = time.time()
+                    if (now >= deadline and isDrained) or now >= deadline + _EXITED_DRAIN_SECONDS:
+                        # The command exited on its own, but something it started still holds the pipes open. The timeout bounds
+                        #   the whole call, so return what has been read (after a short grace to collect what the command wrote before exiting).
+                        break
 
-        for key in list(ret.keys()):
-            ret[key] = b''.join(ret[key])
-            if encoding:
-                ret[key] = ret[key].decode(encoding)
+            if stripper is not None:
+                if recordParser is not None:
+                    recordsRead += recordParser.feed(stripper.finish())
+                else:
+                    leftOver = stripper.finish()
+                    if decoders:
+                        leftOver = decoders['stdout'].decode(leftOver)
+                    if leftOver:
+                        ret['stdout'].append(leftOver)
+
+            for (key, decoder) in decoders.items():
+                # Anything held back waiting for the rest of a character
+                leftOver = decoder.decode(b'', True)
+                if leftOver:
+                    ret[key].append(leftOver)
+
+            if recordParser is not None:
+                recordsRead += recordParser.finish()
+        finally:
+            for teeTarget in teeTargets.values():
+                teeTarget.close()
+
+            # Close our ends of the pipes even if reading was interrupted (the reaper still collects the child)
+            closePipeStreams(pipe)
+
+            registry.recordActionTaken(actionTaken)
+            registry.taskFinished(registryEntry, returnCode, bytesRead)
+
+        if compress:
+            outputs = [ ret[key] for key in ('stderr', 'stdout') if key in ret ]
+            for output in outputs:
+                # Finish off the compressor, so the ratio is final
+                output.flush()
+
+            if limits is not None:
+                nonEmpty = [ output for output in outputs if len(output) ]
+                ret['limitExceeded'] = limits.getLimitExceeded(returnCode, nonEmpty and nonEmpty[0].getValue() or None, actionTaken, cpuWatcher and cpuWatcher.cpuSeconds)
+
+            rawLength = sum([ output.rawLength for output in outputs ])
+            compressedLength = sum([ output.compressedLength for output in outputs ])
+            ret['compressionRatio'] = (float(rawLength) / compressedLength) if rawLength else None
+        else:
+            for key in list(ret.keys()):
+                ret[key] = b''.join(ret[key])
+
+            if limits is not None:
+                ret['limitExceeded'] = limits.getLimitExceeded(returnCode, ret.get('stderr', None) or ret.get('stdout', None), actionTaken, cpuWatcher and cpuWatcher.cpuSeconds)
+
+            for key in ('stdout', 'stderr'):
+                if encoding and key in ret:
+                    ret[key] = ret[key].decode(encoding)
+
+        if recordParser is not None:
+            ret['records'] = recordsRead
+            ret['recordErrors'] = recordParser.errors
+
+        if timeout is not None:
+            ret['actionTaken'] = actionTaken
 
         ret['returnCode'] = returnCode
-        
+
         return ret
 
     @staticmethod
-    def runGetOutput(cmd, raiseOnFailure=False, encoding=sys.getdefaultencoding()):
+    def runGetOutput(cmd, raiseOnFailure=False, encoding=sys.getdefaultencoding(), cacheExecutable=False, limits=None, timeout=None, terminateToKillSeconds=SUBPROCESS2_DEFAULT_TERMINATE_TO_KILL_SECONDS):
         '''
             runGetOutput - Simply runs a command and returns the output as a string. Use #runGetResults if you need something more complex.
 
@@ -164,6 +399,19 @@ class Simple(object):
                 If unsure, leave this as it's default value, or provide "utf-8"
 
 
+            @param cacheExecutable <True/False> - Default False. If True and #cmd is a list, the executable's location in PATH is cached. @see #runGetResults
+
+
+            @param limits <None/dict/subprocess2.limits.ResourceLimits> - Default None. Resource limits applied in the child. @see #runGetResults
+                If #raiseOnFailure is True and a limit was exceeded, the SimpleCommandFailure says so, and has it as "limitExceeded".
+
+
+            @param timeout <None/float> - Default None. Max number of seconds to let the command run before it is terminated. @see #runGetResults
+                The output gathered before the timeout is returned, or if #raiseOnFailure is True, included in the SimpleCommandFailure (which has "actionTaken" set).
+
+            @param terminateToKillSeconds <float/None> - Default 1.5. Used with #timeout. @see Popen.waitOrTerminate
+
+
             @return <str> - String of data output by the executed program. This combines stdout and stderr into one string. If you need them separate, use #runGetResults
 
             @raises SimpleCommandFailure - 
@@ -176,8 +424,9 @@ class Simple(object):
 
 
         
-        results = Simple.runGetResults(cmd, stdout=True, stderr=subprocess.STDOUT, encoding=encoding)
-        if raiseOnFailure is True and results['returnCode'] != 0:
+        results = Simple.runGetResults(cmd, stdout=True, stderr=subprocess.STDOUT, encoding=encoding, cacheExecutable=cacheExecutable, limits=limits, timeout=timeout, terminateToKillSeconds=terminateToKillSeconds)
+        actionTaken = results.get('actionTaken', SUBPROCESS2_PROCESS_COMPLETED)
+        if raiseOnFailure is True and (results['returnCode'] != 0 or actionTaken != SUBPROCESS2_PROCESS_COMPLETED):
             try:
                 if issubclass(cmd.__class__, (list, tuple)):
                     cmdStr = ' '.join(cmd)
@@ -186,12 +435,280 @@ class Simple(object):
             except:
                 cmdStr = repr(cmd)
                 
-            failMsg = "Command '%s' failed with returnCode=%d" %(cmdStr, results['returnCode'])
-            raise SimpleCommandFailure(failMsg, results['returnCode'], results.get('stdout', None), results.get('stderr', None))
+            failMsg = "Command '%s' failed with returnCode=%s" %(cmdStr, str(results['returnCode']))
+            if actionTaken != SUBPROCESS2_PROCESS_COMPLETED:
+                failMsg += ' (timed out after %s seconds)' %(str(timeout), )
+            limitExceeded = results.get('limitExceeded', None)
+            if limitExceeded:
+                failMsg += ' (exceeded %s limit)' %(limitExceeded, )
+            raise SimpleCommandFailure(failMsg, results['returnCode'], results.get('stdout', None), results.get('stderr', None), limitExceeded=limitExceeded, actionTaken=actionTaken)
             
 
         return results['stdout']
 
+    @staticmethod
+    def runInBackground(cmd, stdout=True, stderr=True, encoding=False, limits=None, cacheExecutable=False, usePty=False, stripControlSequences=False, **backgroundKwargs):
+        '''
+            runInBackground - Start a command and gather its output in a background thread. This is the same as creating a Popen and calling
+              its runInBackground method, but the command is started by subprocess2 so that it can have resource #limits applied, or use a pseudo-terminal.
+
+            @param cmd <str/list> - String of command and arguments (run in a shell), or list of command and arguments. @see #runGetResults
+
+            @param stdout <True/False> - Default True, whether to gather stdout
+
+            @param stderr <True/False/"stdout"> - Default True, whether to gather stderr. If "stdout" (or subprocess.STDOUT), it is gathered with stdout.
+
+            @param encoding <False/str> - Default False, if provided the output is decoded with this codec. @see subprocess2.BackgroundTask.BackgroundTaskInfo
+
+            @param limits <None/dict/subprocess2.limits.ResourceLimits> - Default None. Resource limits applied in the child. @see #runGetResults
+                Whether a limit appears to have stopped the command is set as "limitExceeded" on the returned BackgroundTaskInfo.
+
+            @param cacheExecutable <True/False> - Default False. @see #runGetResults
+
+            @param usePty <True/False> - Default False. If True, stdout is a pseudo-terminal, so the command line-buffers its output and
+                each line can be read as soon as it is written. @see #runGetResults
+
+            @param stripControlSequences <True/False> - Default False. With #usePty, remove terminal control sequences from the gathered stdout.
+
+            @param backgroundKwargs - Other arguments for Popen.runInBackground (pollInterval, teeTo, records, sampleInterval, etc.)
+
+            @return <subprocess2.BackgroundTask.BackgroundTaskInfo>
+
+            @raises SimpleCommandFailure - If the command cannot be started
+        '''
+        (stdout, stderr) = _getStreamArgs(stdout, stderr)
+
+        limits = getResourceLimits(limits)
+
+        pipe = _startCommand(cmd, stdout, stderr, cacheExecutable, limits, usePty)
+
+        if usePty is True:
+            # The pty is not a pipe, so it cannot be resized.
+            backgroundKwargs.pop('pipeSize', None)
+
+        taskInfo = BackgroundTaskInfo(encoding)
+        startBackgroundTask(pipe, taskInfo, encoding=encoding, limits=limits, stripControlSequences=(usePty is True and stripControlSequences is True), **backgroundKwargs)
+
+        return taskInfo
+
+    @staticmethod
+    def runChunked(baseCmd, args, maxConcurrent=None, maxArgs=None, stderr=True, encoding=sys.getdefaultencoding(), raiseOnFailure=False, batchCallback=None, cacheExecutable=False):
+        '''
+            runChunked - Run a command over a long list of arguments, like xargs. The arguments are split into batches which each fit within
+              the system's command line limit (ARG_MAX), and the batches are run in parallel. Output is gathered in argument order.
+
+            @param baseCmd <list> - The command and any leading arguments, e.x. ['sha256sum'] or ['grep', '-l', 'pattern']
+
+            @param args <list> - Arguments to append to #baseCmd, e.x. a list of file paths
+
+            @param maxConcurrent <None/int/"cores"> - Default None. Max number of batches to run at once. None or "cores" uses the number of cores available.
+
+            @param maxArgs <None/int> - Default None. Max number of arguments per batch (like xargs -n). If None, arguments are spread
+                evenly so that every concurrent slot gets a batch, within the command line limit.
+
+            @param stderr <True/False/"stdout"> - Default True. Whether to gather stderr. If "stdout", it is gathered with stdout.
+
+            @param encoding <None/str> - Default sys.getdefaultencoding(). Output is decoded with this codec. If None or False-ish, output is bytes.
+
+            @param raiseOnFailure <True/False> - Default False. If True, a SimpleCommandFailure is raised (after all batches have run)
+                if any batch returned non-zero. It contains the gathered output and the first non-zero return code.
+
+            @param batchCallback <None/callable> - Default None. If provided, called with the result dict of each batch (@see return "batches")
+                in argument order, as soon as that batch and every batch before it have completed. Use this to stream output while later batches run.
+
+            @param cacheExecutable <True/False> - Default False. If True, the executable's location in PATH is cached. @see #runGetResults
+
+
+            @return <dict> - Dict of results. Has following keys:
+
+                'returnCode' <int> - 0 if every batch returned 0, otherwise the return code of the first batch which failed
+                'stdout'     <str/bytes> - Output of all batches, in argument order
+                'stderr'     <str/bytes> - Present if #stderr is True. Errors of all batches, in argument order
+                'batches'    <list<dict>> - For each batch, in order: 'args' (the arguments given to it), 'returnCode', 'stdout', and 'stderr' if gathered
+
+            @raises SimpleCommandFailure - If a batch cannot be launched (e.x. the command is not found), or if #raiseOnFailure is True and a batch failed
+
+            @raises ValueError - If a single argument is too large to be executed
+        '''
+        if not issubclass(baseCmd.__class__, (list, tuple)):
+            raise ValueError('baseCmd must be a list of the command and any leading arguments. Got: %s' %(repr(baseCmd), ))
+
+        baseCmd = list(baseCmd)
+        popenKwargs = {}
+        if cacheExecutable is True:
+            _setCachedExecutable(baseCmd, popenKwargs)
+
+        (stdout, stderr) = _getStreamArgs(True, stderr)
+
+        if maxConcurrent is None or maxConcurrent == 'cores':
+            maxConcurrent = getNumCores()
+
+        if maxArgs is None and maxConcurrent > 1:
+            # Limit batch size so the work is split across all the concurrent slots, rather than a few huge batches
+            maxArgs = max(1, (len(args) + maxConcurrent - 1) // maxConcurrent)
+
+        batches = getArgumentBatches(baseCmd, args, maxArgs)
+
+        # Batches usually produce output steadily, so read often to keep their pipes from filling up and stalling them
+        queue = TaskQueue(maxRunning=maxConcurrent, pollInterval=.01, encoding=False)
+        tasks = []
+        for batch in batches:
+            tasks.append(queue.submit(baseCmd + batch, stdout=stdout, stderr=stderr, shell=False, **popenKwargs))
+        queue.shutdown()
+
+        empty = b''
+        if encoding:
+            empty = empty.decode(encoding)
+
+        ret = {
+            'returnCode' : 0,
+            'batches' : [],
+        }
+
+        for (batch, task) in zip(batches, tasks):
+            task.waitToFinish()
+
+            if task.launchError is not None:
+                queue.shutdown(cancelPending=True)
+                raise SimpleCommandFailure('Failed to execute "%s": %s' %(' '.join(baseCmd), task.launchError), returnCode=255)
+
+            batchResult = {
+                'args' : batch,
+                'returnCode' : task.returnCode,
+                'stdout' : task.stdoutData,
+            }
+            if stderr == subprocess.PIPE:
+                batchResult['stderr'] = task.stderrData
+
+            for key in ('stdout', 'stderr'):
+                if encoding and key in batchResult:
+                    batchResult[key] = batchResult[key].decode(encoding)
+
+            if ret['returnCode'] == 0 and task.returnCode != 0:
+                ret['returnCode'] = task.returnCode
+
+            ret['batches'].append(batchResult)
+            if batchCallback is not None:
+                batchCallback(batchResult)
+
+        ret['stdout'] = empty.join([ batchResult['stdout'] for batchResult in ret['batches'] ])
+        if stderr == subprocess.PIPE:
+            ret['stderr'] = empty.join([ batchResult['stderr'] for batchResult in ret['batches'] ])
+
+        if raiseOnFailure is True and ret['returnCode'] != 0:
+            failMsg = "Command '%s' failed with returnCode=%d (over %d batches)" %(' '.join(baseCmd), ret['returnCode'], len(batches))
+            raise SimpleCommandFailure(failMsg, ret['returnCode'], ret['stdout'], ret.get('stderr', None))
+
+        return ret
+
+
+def _newOutputBuffer(compress, encoding):
+    '''
+        _newOutputBuffer - Create the object output is gathered into by runGetResults: a list of chunks, or a CompressedStreamBuffer if compressing
+    '''
+    if not compress:
+        return []
+    empty = b''
+    if encoding:
+        empty = empty.decode(encoding)
+    return CompressedStreamBuffer(empty, compress, encoding)
+
+
+def _setCachedExecutable(cmd, popenKwargs):
+    '''
+        _setCachedExecutable - Resolve the executable of list-form #cmd through the executable cache, and pass it to Popen as "executable".
+
+            #cmd itself is left unchanged, so the child still sees the argv[0] it was given.
+    '''
+    if not cmd or popenKwargs.get('executable', None) is not None:
+        return
+    resolvedPath = resolveExecutable(cmd[0])
+    if resolvedPath is not None:
+        popenKwargs['executable'] = resolvedPath
+
+
+def _getStreamArgs(stdout, stderr):
+    '''
+        _getStreamArgs - Convert the "stdout" and "stderr" arguments of the Simple methods into arguments for subprocess.Popen
+
+        @return tuple( stdout, stderr ) - subprocess.PIPE / subprocess.STDOUT / None for each
+    '''
+    if stderr in ('stdout', subprocess.STDOUT):
+        stderr = subprocess.STDOUT
+    elif stderr == True or stderr == subprocess.PIPE:
+        stderr = subprocess.PIPE
+    else:
+        stderr = None
+
+    if stdout == True or stdout == subprocess.STDOUT:
+        stdout = subprocess.PIPE
+    else:
+        stdout = None
+        if stderr == subprocess.PIPE:
+            raise ValueError('Cannot redirect stderr to stdout if stdout is not captured.')
+
+    return (stdout, stderr)
+
+
+def _startCommand(cmd, stdout, stderr, cacheExecutable=False, limits=None, usePty=False, **popenKwargs):
+    '''
+        _startCommand - Start a command for the Simple methods. Strings are run through the shell, lists are executed directly.
+
+        @param limits <None/subprocess2.limits.ResourceLimits> - Limits to apply in the child
+
+        @param usePty <bool> - If True, stdout is connected to a pseudo-terminal, and pipe.stdout is the (buffered) master side of it.
+
+        @return <subprocess.Popen>
+
+        @raises SimpleCommandFailure - If the command cannot be started
+    '''
+    if issubclass(cmd.__class__, (list, tuple)):
+        shell = False
+        if cacheExecutable is True:
+            _setCachedExecutable(cmd, popenKwargs)
+    else:
+        shell = True
+
+    if limits is not None:
+        popenKwargs['preexec_fn'] = limits.getPreexecFn(popenKwargs.get('preexec_fn', None))
+
+    masterFd = None
+    if usePty is True:
+        if stdout != subprocess.PIPE:
+            raise ValueError('usePty requires stdout to be captured.')
+        (masterFd, stdout) = openPty()
+
+    spawnStart = time.time()
+    try:
+        pipe = subprocess.Popen(cmd, stdout=stdout, stderr=stderr, shell=shell, **popenKwargs)
+    except Exception as e:
+        getRegistry().recordLaunchFailure()
+        if masterFd is not None:
+            os.close(masterFd)
+            os.close(stdout)
+
+        try:
+            if shell is True:
+                cmdStr = ' '.join(cmd)
+            else:
+                cmdStr = cmd
+        except:
+            cmdStr = repr(cmd)
+
+        raise SimpleCommandFailure('Failed to execute "%s": %s' %(cmdStr, str(e)), returnCode=255)
+
+    getRegistry().recordSpawn(time.time() - spawnStart)
+
+    if masterFd is not None:
+        # Only the child should hold the terminal side open, so reading the master ends when the child does
+        os.close(stdout)
+        # Unbuffered on python 2, like the pipes Popen opens there. The background thread reads those a byte at a time while select
+        #   says there is more, and a buffered file would take data into its buffer where select cannot see it. python 3 needs the
+        #   buffered reader, for read1.
+        pipe.stdout = os.fdopen(masterFd, 'rb', 0 if bytes == str else -1)
+
+    return pipe
+
 
 class SimpleCommandFailure(Exception):
     '''
@@ -207,11 +724,17 @@ class SimpleCommandFailure(Exception):
 
             * stderr <None/str> - Any collected stderr data, or "None" if none was collected.
 
+            * limitExceeded <None/str> - If resource limits were applied, the limit which appears to have stopped the command ("cpu", "memory", "openFiles"), otherwise None.
+
+            * actionTaken <int> - Mask of SUBPROCESS2_PROCESS_* actions taken because of a timeout. SUBPROCESS2_PROCESS_COMPLETED (0) if the command was not timed out.
+
     '''
 
 
-    def __init__(self, msg, returnCode, stdout=None, stderr=None):
+    def __init__(self, msg, returnCode, stdout=None, stderr=None, limitExceeded=None, actionTaken=SUBPROCESS2_PROCESS_COMPLETED):
         self.returnCode = returnCode
+        self.limitExceeded = limitExceeded
+        self.actionTaken = actionTaken
         self.stdout = stdout
         self.stderr = stderr
         Exception.__init__(self, msg)
@@ -0,0 +1,136 @@
+'''
+  tee.py - Copying of child output streams directly to file descriptors
+
+  Copyright (c) 2016 Timothy Savannah LGPLv2 All rights reserved. See LICENSE file for more details.
+
+
+  TeeTarget - A destination (fd, file object, or path) which data read from a child's stream is copied to.
+
+  getTeeTargets - Converts the "teeTo" argument of runInBackground / Simple.runGetResults into a map of stream number to TeeTarget
+
+'''
+
+# vim: ts=4 sw=4 expandtab :
+
+import errno
+import os
+
+from .pipeio import getStreamNum
+from .ptyio import isPtyEndOfFile
+
+__all__ = ('TeeTarget', 'getTeeTargets', 'SPLICE_CHUNK_SIZE')
+
+# Max number of bytes to move per splice call. This is the default size of a linux pipe buffer, so
+#   one call will generally move everything the child has written so far.
+SPLICE_CHUNK_SIZE = 65536
+
+
+class TeeTarget(object):
+    '''
+        TeeTarget - A destination which data from a child's stream is copied to.
+
+        @param target <int/file/str> - Where to write the data.
+
+            If an int, it is used as a file descriptor. It will not be closed.
+            If an object with a "fileno" method (like an open file), its descriptor is used. It will not be closed.
+            If a str, it is treated as a path and opened for writing (truncated). It will be closed when the task completes.
+    '''
+
+    def __init__(self, target):
+        self.ownsFd = False
+        if issubclass(target.__class__, int):
+            self.fd = target
+        elif hasattr(target, 'fileno'):
+            # Make sure anything already buffered by python on this object ends up before our data.
+            if hasattr(target, 'flush'):
+                target.flush()
+            self.fd = target.fileno()
+        else:
+            self.fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+            self.ownsFd = True
+
+        # Will be set to False the first time splice fails on this target (unsupported kernel, fd type, etc)
+        self.canSplice = hasattr(os, 'splice')
+
+    def write(self, data):
+        '''
+            write - Write all of #data to the target
+
+            @param data <bytes> - Data to write
+        '''
+        view = memoryview(data)
+        while view:
+            written = os.write(self.fd, view)
+            view = view[written:]
+
+    def copyFrom(self, fromFd, maxBytes=SPLICE_CHUNK_SIZE):
+        '''
+            copyFrom - Move up to #maxBytes available on #fromFd to this target, without returning the data.
+
+                Uses os.splice where available, so the data never enters python memory. Otherwise, falls back to a buffered copy.
+
+                This should only be called when #fromFd is ready to read, as it may otherwise block.
+
+            @param fromFd <int> - Descriptor of the pipe to read from
+
+            @param maxBytes <int> - Max number of bytes to move
+
+            @return <int> - Number of bytes moved. 0 means end of stream.
+        '''
+        if self.canSplice:
+            try:
+                return os.splice(fromFd, self.fd, maxBytes, flags=os.SPLICE_F_MOVE)
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EBADF):
+                    raise
+                # Target (or kernel) does not support splice, use buffered copy from now on.
+                self.canSplice = False
+
+        try:
+            data = os.read(fromFd, maxBytes)
+        except OSError as e:
+            # Reading a pseudo-terminal after the child side has closed
+            if not isPtyEndOfFile(e):
+                raise
+            data = b''
+        if data:
+            self.write(data)
+        return len(data)
+
+    def close(self):
+        '''
+            close - Close the target, if we opened it.
+        '''
+        if self.ownsFd is True:
+            self.ownsFd = False
+            os.close(self.fd)
+
+
+def getTeeTargets(teeTo):
+    '''
+        getTeeTargets - Convert a "teeTo" argument into TeeTarget objects
+
+        @param teeTo <None/int/file/str/dict> - If None, no tee. If a dict, maps "stdout"/"stderr" to a target. Otherwise, a single target for stdout.
+
+            @see TeeTarget for valid target types.
+
+        @return <dict> - Map of stream number (1 = stdout, 2 = stderr) to TeeTarget
+    '''
+    if teeTo is None:
+        return {}
+
+    if not issubclass(teeTo.__class__, dict):
+        teeTo = { 'stdout' : teeTo }
+
+    ret = {}
+    try:
+        for streamName, target in teeTo.items():
+            streamNum = getStreamNum(streamName)
+            if target is not None:
+                ret[streamNum] = TeeTarget(target)
+    except:
+        for teeTarget in ret.values():
+            teeTarget.close()
+        raise
+
+    return ret
@@ -0,0 +1,615 @@
+'''
+  workerpool.py - A pool of long-lived python child processes which run python functions as jobs, avoiding interpreter startup per job.
+
+  Copyright (c) 2016 Timothy Savannah LGPLv2 All rights reserved. See LICENSE file for more details.
+
+
+  WorkerPool - Keeps N python workers running, and hands each submitted job ( "module:function" plus arguments ) to an idle one
+
+  WorkerJob - Returned for each submitted job. Holds the result (or error) and the captured stdout/stderr once finished
+
+  WorkerJobError - Raised by WorkerJob.getResult if the job raised an exception, or its worker died
+
+'''
+
+# vim: ts=4 sw=4 expandtab :
+
+import collections
+import errno
+import itertools
+import os
+import pickle
+import select
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+from .pipeio import AdaptiveReadSize, closePipeStreams
+from .reaper import getReaper, _setNonBlocking
+from .registry import getRegistry
+from .TaskQueue import getNumCores
+
+__all__ = ('WorkerPool', 'WorkerJob', 'WorkerJobError', 'DEFAULT_MAX_JOBS_PER_WORKER')
+
+# Number of jobs a worker runs before it is replaced by a fresh one
+DEFAULT_MAX_JOBS_PER_WORKER = 100
+
+WORKER_MAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '_workermain.py')
+
+# Each message is a 4-byte big-endian length followed by a pickle ( @see subprocess2._workermain )
+_HEADER = struct.Struct('!I')
+
+
+class WorkerJobError(Exception):
+    '''
+        WorkerJobError - Raised by WorkerJob.getResult when a job did not complete successfully.
+
+        Contains the following properties:
+
+            * msg <str> - The exception message itself
+
+            * excType <None/str> - Name of the exception class raised by the job, or None if the job never ran to completion (worker died, cancelled)
+
+            * excMessage <None/str> - str() of the exception raised by the job
+
+            * traceback <None/str> - The formatted traceback from the worker
+    '''
+
+    def __init__(self, msg, excType=None, excMessage=None, traceback=None):
+        self.excType = excType
+        self.excMessage = excMessage
+        self.traceback = traceback
+        Exception.__init__(self, msg)
+        self.msg = msg
+
+
+class WorkerJob(object):
+    '''
+        WorkerJob - A job submitted to a WorkerPool. It is returned immediately on submit, and populated once a worker completes it.
+
+        FIELDS:
+
+            target - The "module:function" which is called
+            args - Positional arguments
+            kwargs - Keyword arguments
+            isStarted - True once the job has been sent to a worker
+            isFinished - True once the job has completed (or failed)
+            isCancelled - True if the pool was shutdown with cancelPending before this job started
+            result - The return value of the function, once finished successfully
+            error - None, or a WorkerJobError if the function raised, its worker died, or it was cancelled
+            stdout - Everything the job wrote to stdout (decoded with the pool's encoding, if set)
+            stderr - Everything the job wrote to stderr (decoded with the pool's encoding, if set)
+            workerPid - The pid of the worker which ran the job
+            timeElapsed - Seconds from the job being sent to a worker until its result was received
+    '''
+
+    FIELDS = ('target', 'args', 'kwargs', 'isStarted', 'isFinished', 'isCancelled', 'result', 'error', 'stdout', 'stderr', 'workerPid', 'timeElapsed')
+
+    def __init__(self, jobId, target, args, kwargs):
+        self.jobId = jobId
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs
+
+        self.isStarted = False
+        self.isFinished = False
+        self.isCancelled = False
+        self.result = None
+        self.error = None
+        self.stdout = None
+        self.stderr = None
+        self.workerPid = None
+        self.timeElapsed = None
+
+        self._startTime = None
+        # _numSendFailures - Number of times the job was assigned to a worker which had already exited
+        self._numSendFailures = 0
+        self._finishedEvent = threading.Event()
+
+    def waitToFinish(self, timeout=None):
+        '''
+            waitToFinish - Wait (Block current thread), optionally with a timeout, until the job completes.
+
+            @param timeout <None/float> - None to wait forever, otherwise max number of seconds to wait
+
+            @return <bool> - True if the job finished, False if the timeout expired first
+        '''
+        self._finishedEvent.wait(timeout)
+        return self.isFinished
+
+    def getResult(self, timeout=None):
+        '''
+            getResult - Wait for the job to finish, and return what the function returned.
+
+            @param timeout <None/float> - None to wait forever, otherwise max number of seconds to wait
+
+            @return - The return value of the function
+
+            @raises WorkerJobError - If the function raised an exception, the worker died, or the job was cancelled
+
+            @raises ValueError - If #timeout expired before the job finished
+        '''
+        if not self.waitToFinish(timeout):
+            raise ValueError('Job %s did not finish within %s seconds.' %(self.target, str(timeout)))
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def asDict(self):
+        '''
+            asDict - Returns a copy of the current state as a dictionary.
+
+            @return <dict> - Dictionary with all fields in FIELDS
+        '''
+        ret = {}
+        for field in self.FIELDS:
+            ret[field] = getattr(self, field)
+        return ret
+
+    def __repr__(self):
+        return str(self.asDict())
+
+    def _markFinished(self, error=None):
+        '''
+            _markFinished - INTERNAL. Called by the pool when the job has completed (or failed with #error)
+        '''
+        if self._startTime is not None:
+            self.timeElapsed = time.time() - self._startTime
+        self.error = error
+        self.isFinished = True
+        self._finishedEvent.set()
+
+
+class _Worker(object):
+    '''
+        _Worker - INTERNAL. State of one worker process, owned by the pool's dispatcher thread.
+    '''
+
+    def __init__(self, pipe, registryEntry):
+        self.pipe = pipe
+        self.pid = pipe.pid
+        self.resultFd = pipe.stdout.fileno()
+        self.registryEntry = registryEntry
+        # job - The WorkerJob currently running, or None if idle
+        self.job = None
+        # jobReceived - True once the worker has acknowledged reading #job. If it exits before then, the job never ran.
+        self.jobReceived = False
+        self.numJobs = 0
+        self.bytesRead = 0
+        self.readBuffer = bytearray()
+        self.readSize = AdaptiveReadSize()
+
+    def takeMessage(self):
+        '''
+            takeMessage - Remove and return the payload of the first complete message in #readBuffer, if there is one
+
+            @return <bytes/None>
+        '''
+        readBuffer = self.readBuffer
+        if len(readBuffer) < _HEADER.size:
+            return None
+        size = _HEADER.unpack(bytes(readBuffer[:_HEADER.size]))[0]
+        end = _HEADER.size + size
+        if len(readBuffer) < end:
+            return None
+        payload = bytes(readBuffer[_HEADER.size:end])
+        del readBuffer[:end]
+        return payload
+
+
+class WorkerPool(object):
+    '''
+        WorkerPool - Keep #numWorkers python child processes running, and run python functions in them as jobs.
+
+            Starting a python interpreter (plus imports) for every small piece of work takes tens of milliseconds. The workers here
+              are started once, and each job is sent to an idle worker over a pipe, so a job costs only pickling its arguments and result.
+
+            Jobs are named as "module:function" (function may be a dotted path, e.x. "mymodule:MyClass.staticMethod"). The module is imported
+              in the worker the first time it is used there, using the sys.path of this process when the pool was created.
+              Functions defined in __main__ cannot be used, since the worker's __main__ is its own.
+
+            Arguments and results must be picklable. Anything the job writes to stdout/stderr (including from C code, or children it starts)
+              is captured and returned on the WorkerJob.
+
+            After #maxJobsPerWorker jobs, a worker is replaced by a fresh one, so anything leaked by the jobs (memory, descriptors, state in
+              imported modules) does not build up. A worker which dies fails the job it was running, and is replaced.
+
+        @param numWorkers <None/int/"cores"> - Default None. Number of workers. None or "cores" uses the number of cores available.
+
+        @param maxJobsPerWorker <None/int> - Default 100. Number of jobs each worker runs before it is replaced. None to never replace.
+
+        @param encoding <False/str> - Default sys.getdefaultencoding(). If set, the stdout and stderr of jobs are decoded with this codec
+            (undecodable bytes are replaced, rather than failing the job). If False, they are bytes.
+
+        @param pythonExecutable <None/str> - Default None. The python to run workers with. Default is the same as this process (sys.executable).
+            Another python must be able to unpickle what this one sends (pickle protocol 2 is used for it).
+
+        @param env <None/dict> - Default None. The environment for the workers. Default is the environment of this process.
+
+
+        Example:
+
+            pool = WorkerPool(numWorkers=4)
+            jobs = [ pool.submit('hashlib_helpers:hashFile', fileName) for fileName in fileNames ]
+            checksums = [ job.getResult() for job in jobs ]
+            pool.shutdown()
+    '''
+
+    def __init__(self, numWorkers=None, maxJobsPerWorker=DEFAULT_MAX_JOBS_PER_WORKER, encoding=sys.getdefaultencoding(), pythonExecutable=None, env=None):
+        if numWorkers is None or numWorkers == 'cores':
+            numWorkers = getNumCores()
+        if not issubclass(numWorkers.__class__, int) or numWorkers < 1:
+            raise ValueError('numWorkers must be an int >= 1, "cores", or None. Got: %s' %(repr(numWorkers), ))
+        if maxJobsPerWorker is not None and (not issubclass(maxJobsPerWorker.__class__, int) or maxJobsPerWorker < 1):
+            raise ValueError('maxJobsPerWorker must be an int >= 1, or None. Got: %s' %(repr(maxJobsPerWorker), ))
+
+        self.numWorkers = numWorkers
+        self.maxJobsPerWorker = maxJobsPerWorker
+        self.encoding = encoding
+        self.env = env
+        if pythonExecutable is None:
+            self.pythonExecutable = sys.executable
+            self.pickleProtocol = pickle.HIGHEST_PROTOCOL
+        else:
+            self.pythonExecutable = pythonExecutable
+            self.pickleProtocol = 2
+
+        # Sent to each worker on startup
+        self._workerConfig = pickle.dumps({ 'sysPath' : [ os.path.abspath(path) for path in sys.path ], 'protocol' : self.pickleProtocol }, self.pickleProtocol)
+
+        # _condition - Guards all state below, and is notified whenever a job finishes
+        self._condition = threading.Condition()
+        self._pending = collections.deque()
+        self._workers = []
+        self._numRunning = 0
+        self._jobIds = itertools.count(1)
+        self._isShutdown = False
+
+        # The dispatcher waits in select on the busy workers, plus this pipe, which is written to wake it when jobs are submitted
+        (self._wakeReadFd, self._wakeWriteFd) = os.pipe()
+        for fd in (self._wakeReadFd, self._wakeWriteFd):
+            _setNonBlocking(fd)
+
+        try:
+            for i in range(numWorkers):
+                self._workers.append(self._startWorker())
+        except:
+            for worker in self._workers:
+                self._stopWorker(worker)
+            os.close(self._wakeReadFd)
+            os.close(self._wakeWriteFd)
+            raise
+
+        self._dispatcher = threading.Thread(target=self._dispatch)
+        self._dispatcher.daemon = True
+        self._dispatcher.start()
+
+    def submit(self, target, *args, **kwargs):
+        '''
+            submit - Add a job. It will be run by the next idle worker, in the order submitted.
+
+            @param target <str> - "module:function" to call
+
+            @param args - Positional arguments to the function
+
+            @param kwargs - Keyword arguments to the function
+
+            @return <WorkerJob> - Represents the job. Use WorkerJob.getResult to wait for its return value.
+        '''
+        if not issubclass(target.__class__, str) or ':' not in target:
+            raise ValueError('target must be a "module:function" string. Got: %s' %(repr(target), ))
+
+        job = WorkerJob(next(self._jobIds), target, args, kwargs)
+
+        with self._condition:
+            if self._isShutdown is True:
+                raise ValueError('Cannot submit to a WorkerPool which has been shutdown.')
+            self._pending.append(job)
+
+        self._wake()
+        return job
+
+    @property
+    def numPending(self):
+        '''
+            numPending - Number of jobs waiting for a worker
+        '''
+        return len(self._pending)
+
+    @property
+    def numRunning(self):
+        '''
+            numRunning - Number of jobs currently running in a worker
+        '''
+        return self._numRunning
+
+    def waitAll(self, timeout=None):
+        '''
+            waitAll - Wait (Block current thread) until every submitted job has finished.
+
+            @param timeout <None/float> - None to wait forever, otherwise max number of seconds to wait
+
+            @return <bool> - True if all jobs finished, False if the timeout expired first.
+        '''
+        if timeout is not None:
+            endTime = time.time() + timeout
+
+        with self._condition:
+            while self._pending or self._numRunning:
+                if timeout is None:
+                    self._condition.wait()
+                else:
+                    remaining = endTime - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+        return True
+
+    def shutdown(self, cancelPending=False):
+        '''
+            shutdown - Stop accepting new jobs. Once all jobs have finished, the workers exit.
+
+            @param cancelPending <bool> - Default False. If True, jobs which have not yet started are cancelled (their error is a WorkerJobError).
+              Otherwise, they will still be run.
+        '''
+        toCancel = []
+        with self._condition:
+            self._isShutdown = True
+            if cancelPending is True:
+                toCancel = list(self._pending)
+                self._pending.clear()
+            self._condition.notify_all()
+
+        for job in toCancel:
+            job.isCancelled = True
+            job._markFinished(WorkerJobError('Job %s was cancelled.' %(job.target, )))
+
+        self._wake()
+
+    def _wake(self):
+        try:
+            os.write(self._wakeWriteFd, b'x')
+        except OSError as e:
+            # Full (already waking) or closed (dispatcher has exited)
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EBADF):
+                raise
+
+    def _startWorker(self):
+        '''
+            _startWorker - INTERNAL. Start a worker process, and send it the config
+
+            @return <_Worker>
+        '''
+        registry = getRegistry()
+
+        spawnStart = time.time()
+        try:
+            pipe = subprocess.Popen([self.pythonExecutable, WORKER_MAIN_PATH], stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=self.env, close_fds=True)
+        except Exception:
+            registry.recordLaunchFailure()
+            raise
+        registry.recordSpawn(time.time() - spawnStart)
+
+        worker = _Worker(pipe, registry.taskStarted('worker', pipe.pid))
+        getReaper().register(pipe, lambda exitedPipe, exitCode : registry.taskFinished(worker.registryEntry, exitCode, worker.bytesRead))
+
+        self._sendMessage(worker, self._workerConfig)
+        return worker
+
+    def _stopWorker(self, worker):
+        '''
+            _stopWorker - INTERNAL. Close the pipes to a worker, which makes it exit once it is idle. The reaper collects it.
+        '''
+        if worker.pipe.stdin is not None:
+            try:
+                worker.pipe.stdin.close()
+            except:
+                pass
+        closePipeStreams(worker.pipe)
+
+    def _sendMessage(self, worker, payload):
+        '''
+            _sendMessage - INTERNAL. Send a pickled message to a worker.
+
+            @raises OSError/IOError - If the worker has exited
+        '''
+        stdin = worker.pipe.stdin
+        stdin.write(_HEADER.pack(len(payload)) + payload)
+        stdin.flush()
+
+    def _dispatch(self):
+        '''
+            _dispatch - INTERNAL. Body of the dispatcher thread, which sends jobs to idle workers and collects their results.
+        '''
+        while True:
+            toSend = []
+            with self._condition:
+                if self._isShutdown is True and not self._pending and not self._numRunning:
+                    workers = self._workers
+                    self._workers = []
+                    break
+
+                for (idx, worker) in enumerate(self._workers):
+                    if worker.job is not None:
+                        continue
+                    if self.maxJobsPerWorker is not None and worker.numJobs >= self.maxJobsPerWorker:
+                        self._workers[idx] = worker = self._replaceWorker(worker)
+                        if worker is None:
+                            continue
+                    if not self._pending:
+                        continue
+
+                    job = self._pending.popleft()
+                    job.isStarted = True
+                    job.workerPid = worker.pid
+                    worker.job = job
+                    worker.numJobs += 1
+                    self._numRunning += 1
+                    toSend.append(worker)
+
+                # Workers which could not be replaced
+                self._workers = [ worker for worker in self._workers if worker is not None ]
+                if not self._workers and self._pending:
+                    # Every worker failed to start, so nothing can run these
+                    failedJobs = list(self._pending)
+                    self._pending.clear()
+                else:
+                    failedJobs = []
+
+            for job in failedJobs:
+                job._markFinished(WorkerJobError('No worker could be started to run job %s.' %(job.target, )))
+
+            for worker in toSend:
+                self._sendJob(worker)
+
+            # Idle workers are watched too, so one which dies is replaced right away rather than when it is next given a job
+            with self._condition:
+                workers = list(self._workers)
+            (readyToRead, junk1, junk2) = select.select([ worker.resultFd for worker in workers ] + [ self._wakeReadFd ], [], [])
+
+            if self._wakeReadFd in readyToRead:
+                try:
+                    while os.read(self._wakeReadFd, 4096):
+                        pass
+                except OSError as e:
+                    if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        raise
+
+            for worker in workers:
+                if worker.resultFd in readyToRead:
+                    self._readWorker(worker)
+
+        for worker in workers:
+            self._stopWorker(worker)
+        os.close(self._wakeReadFd)
+        os.close(self._wakeWriteFd)
+
+    def _sendJob(self, worker):
+        '''
+            _sendJob - INTERNAL. Send the job assigned to #worker. If the worker has already exited, the job is put back
+              at the front of the queue (it never ran), and the worker is replaced.
+        '''
+        job = worker.job
+        try:
+            payload = pickle.dumps( (job.jobId, job.target, job.args, job.kwargs), self.pickleProtocol )
+        except Exception as e:
+            self._finishJob(worker, WorkerJobError('Arguments to job %s could not be pickled: %s' %(job.target, str(e)), e.__class__.__name__, str(e)))
+            return
+
+        job._startTime = time.time()
+        worker.jobReceived = False
+        try:
+            self._sendMessage(worker, payload)
+        except (IOError, OSError):
+            self._requeueJob(worker)
+            self._removeWorker(worker)
+
+    def _requeueJob(self, worker):
+        '''
+            _requeueJob - INTERNAL. Put the job assigned to #worker back at the front of the queue, because the worker exited before receiving it.
+        '''
+        job = worker.job
+        worker.job = None
+        job._startTime = None
+        job._numSendFailures += 1
+        if job._numSendFailures > self.numWorkers:
+            # Workers keep dying before they can take a job, so don't retry forever
+            self._finishJob(worker, WorkerJobError('Workers exited before job %s could be sent to one.' %(job.target, )), job)
+            return
+
+        job.isStarted = False
+        job.workerPid = None
+        with self._condition:
+            self._numRunning -= 1
+            self._pending.appendleft(job)
+
+    def _removeWorker(self, worker):
+        '''
+            _removeWorker - INTERNAL. Stop #worker (which has exited or is being discarded) and replace it, if it can be.
+        '''
+        with self._condition:
+            self._workers = [ otherWorker for otherWorker in self._workers if otherWorker is not worker ]
+            newWorker = self._replaceWorker(worker)
+            if newWorker is not None:
+                self._workers.append(newWorker)
+
+    def _replaceWorker(self, worker):
+        '''
+            _replaceWorker - INTERNAL. Stop #worker and start a new one in its place. Called with #_condition held.
+
+            @return <_Worker/None> - The new worker, or None if it could not be started (or is not needed, after shutdown)
+        '''
+        self._stopWorker(worker)
+        if self._isShutdown is True and not self._pending:
+            return None
+        try:
+            return self._startWorker()
+        except Exception:
+            return None
+
+    def _readWorker(self, worker):
+        '''
+            _readWorker - INTERNAL. Read what is available from a worker, and finish its job if the result is complete.
+              If the worker has exited, its job (if any) fails, and it is replaced.
+        '''
+        readSize = worker.readSize
+        try:
+            data = os.read(worker.resultFd, readSize.size)
+        except OSError:
+            data = b''
+        readSize.update(len(data))
+
+        if not data:
+            job = worker.job
+            if job is not None:
+                if worker.jobReceived is False:
+                    self._requeueJob(worker)
+                else:
+                    self._finishJob(worker, WorkerJobError('Worker (pid %d) exited while running job %s.' %(worker.pid, job.target)))
+            self._removeWorker(worker)
+            return
+
+        worker.bytesRead += len(data)
+        worker.readBuffer += data
+
+        payload = worker.takeMessage()
+        if payload == b'':
+            # Acknowledgement that the job was received. The result may have arrived with it.
+            worker.jobReceived = True
+            payload = worker.takeMessage()
+        if payload is None or worker.job is None:
+            return
+
+        job = worker.job
+        try:
+            (jobId, (isSuccess, result), jobStdout, jobStderr) = pickle.loads(payload)
+        except Exception as e:
+            self._finishJob(worker, WorkerJobError('Result of job %s could not be unpickled: %s' %(job.target, str(e)), e.__class__.__name__, str(e)))
+            return
+
+        if self.encoding:
+            jobStdout = jobStdout.decode(self.encoding, 'replace')
+            jobStderr = jobStderr.decode(self.encoding, 'replace')
+        job.stdout = jobStdout
+        job.stderr = jobStderr
+
+        if isSuccess:
+            job.result = result
+            self._finishJob(worker, None)
+        else:
+            (excType, excMessage, excTraceback) = result
+            self._finishJob(worker, WorkerJobError('Job %s raised %s: %s' %(job.target, excType, excMessage), excType, excMessage, excTraceback))
+
+    def _finishJob(self, worker, error, job=None):
+        '''
+            _finishJob - INTERNAL. Mark the job running on #worker (or #job, if given) finished, and the worker idle.
+        '''
+        if job is None:
+            job = worker.job
+        worker.job = None
+        job._markFinished(error)
+        with self._condition:
+            self._numRunning -= 1
+            self._condition.notify_all()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+'''
+    benchmarkThroughput.py - Measure how quickly subprocess2 collects output from a child which writes as fast as it can.
+
+      Usage: ./benchmarkThroughput.py [numMegabytes]
+
+      Prints the achieved throughput (MiB/s) for several configurations of runInBackground and Simple.runGetResults
+'''
+
+# vim: set ts=4 sw=4 expandtab :
+
+import os
+import sys
+import subprocess
+import time
+
+try:
+    import subprocess2
+except ImportError:
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    import subprocess2
+
+from subprocess2 import Simple
+
+
+WRITER_CODE = '''
+import os, sys
+chunk = b"x" * 65536
+remaining = int(sys.argv[1])
+while remaining > 0:
+    remaining -= os.write(1, chunk[:remaining])
+'''
+
+def getWriterCmd(numBytes):
+    return [sys.executable, '-c', WRITER_CODE, str(numBytes)]
+
+
+def benchBackground(numBytes, **kwargs):
+    start = time.time()
+    pipe = subprocess.Popen(getWriterCmd(numBytes), stdout=subprocess.PIPE)
+    taskInfo = pipe.runInBackground(**kwargs)
+    taskInfo.waitToFinish(pollInterval=.01)
+    elapsed = time.time() - start
+    if len(taskInfo.stdoutData) != numBytes:
+        raise AssertionError('Expected %d bytes, got %d' %(numBytes, len(taskInfo.stdoutData)))
+    return elapsed
+
+
+def benchSimple(numBytes, **kwargs):
+    start = time.time()
+    results = Simple.runGetResults(getWriterCmd(numBytes), stderr=False, encoding=None, **kwargs)
+    elapsed = time.time() - start
+    if len(results['stdout']) != numBytes:
+        raise AssertionError('Expected %d bytes, got %d' %(numBytes, len(results['stdout'])))
+    return elapsed
+
+
+if __name__ == '__main__':
+    numMegabytes = 256
+    if len(sys.argv) > 1:
+        numMegabytes = int(sys.argv[1])
+    numBytes = numMegabytes * 1024 * 1024
+
+    cases = [
+        ('runInBackground (4KiB fixed reads)', benchBackground, { 'maxReadSize' : 4096 }),
+        ('runInBackground (adaptive reads)', benchBackground, {}),
+        ('runInBackground (adaptive reads, 1MiB pipe)', benchBackground, { 'pipeSize' : 1024 * 1024 }),
+        ('Simple.runGetResults (4KiB fixed reads)', benchSimple, { 'maxReadSize' : 4096 }),
+        ('Simple.runGetResults (adaptive reads)', benchSimple, {}),
+        ('Simple.runGetResults (adaptive reads, 1MiB pipe)', benchSimple, { 'pipeSize' : 1024 * 1024 }),
+    ]
+
+    sys.stdout.write('Collecting %d MiB from a child writing as fast as it can:\n\n' %(numMegabytes, ))
+    for (name, func, kwargs) in cases:
+        try:
+            elapsed = func(numBytes, **kwargs)
+        except Exception as e:
+            sys.stdout.write('  %-50s  FAILED: %s\n' %(name, str(e)))
+            continue
+        sys.stdout.write('  %-50s  %8.1f MiB/s  (%.2fs)\n' %(name, numMegabytes / elapsed, elapsed))
+        sys.stdout.flush()
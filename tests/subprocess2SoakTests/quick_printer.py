@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+
+# A child which exits quickly, for running many times in the soak tests.
+#
+#  quick_printer.py numLines [returnCode]
+#
+#   stdout => numLines of "stdout line N\n"
+#   stderr => numLines of "stderr line N\n"
+#   exit returnCode (default 0)
+
+import sys
+
+if __name__ == '__main__':
+	numLines = int(sys.argv[1])
+	try:
+		returnCode = int(sys.argv[2])
+	except IndexError:
+		returnCode = 0
+
+	for i in range(numLines):
+		sys.stdout.write('stdout line %d\n' %(i, ))
+		sys.stderr.write('stderr line %d\n' %(i, ))
+	sys.stdout.flush()
+	sys.stderr.flush()
+
+	sys.exit(returnCode)
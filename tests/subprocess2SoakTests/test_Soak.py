@@ -0,0 +1,229 @@
+#!/usr/bin/env GoodTests.py
+
+'''
+    Soak tests - Run many commands through each subprocess2 path, and check that nothing
+      (file descriptors, threads, zombie children, memory) accumulates.
+
+    The default number of iterations is small, so these run with the regular tests.
+      For a real soak, set SUBPROCESS2_SOAK_ITERATIONS (e.x. 20000).
+
+    Linux only (reads /proc), other platforms skip the checks.
+'''
+
+import gc
+import os
+import sys
+import subprocess
+import time
+
+import subprocess2
+from subprocess2 import Simple, TaskQueue, SimpleCommandFailure, WorkerPool
+
+DEFAULT_SOAK_ITERATIONS = 50
+
+# Memory may grow a bit as allocators settle, but should not scale with the number of iterations
+MAX_RSS_GROWTH_BYTES = 16 * 1024 * 1024
+
+
+def getNumOpenFds():
+    return len(os.listdir('/proc/self/fd'))
+
+
+def getRss():
+    with open('/proc/self/statm', 'rt') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def getZombieChildren():
+    myPid = os.getpid()
+    zombies = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' %(name, ), 'rt') as f:
+                stat = f.read()
+        except (IOError, OSError):
+            continue
+        # Fields after the command (which is in parens, and may contain spaces)
+        fields = stat[stat.rfind(')') + 2:].split()
+        if fields[0] == 'Z' and int(fields[1]) == myPid:
+            zombies.append(int(name))
+    return zombies
+
+
+class TestSoak(object):
+    '''
+        Runs each path many times, checking for leaks
+    '''
+
+    def setup_class(self):
+        self.dirName = os.path.dirname(os.path.abspath(__file__))
+        self.printerPath = "%s/quick_printer.py" %(self.dirName, )
+        self.sleeperPath = "%s/../subprocess2Tests/sleeper.py" %(self.dirName, )
+        for path in (self.printerPath, self.sleeperPath):
+            if not os.path.exists(path):
+                sys.stderr.write('ERROR! CANNOT FIND %s. Test will fail.\n' %(path, ))
+
+        # Job functions for the WorkerPool test
+        self.jobsDir = os.path.abspath("%s/../subprocess2Tests" %(self.dirName, ))
+        if self.jobsDir not in sys.path:
+            sys.path.insert(0, self.jobsDir)
+
+        self.iterations = int(os.environ.get('SUBPROCESS2_SOAK_ITERATIONS', DEFAULT_SOAK_ITERATIONS))
+        self.canCheck = os.path.isdir('/proc/self/fd')
+
+    def _getPrinterCommand(self, numLines, returnCode=0):
+        return [sys.executable, self.printerPath, str(numLines), str(returnCode)]
+
+    def _getSleeperCommand(self, sleepTime, returnCode=0):
+        return [sys.executable, self.sleeperPath, str(sleepTime), str(returnCode)]
+
+    def _soak(self, runOnce, keepResults=False):
+        '''
+            _soak - Call #runOnce a few times to warm up (start any singleton threads, fill caches), then many more times,
+              and assert that fds, threads, zombies, and RSS are no higher than after the warm up.
+
+            @param runOnce <function> - Called with the iteration number. Returns a result.
+
+            @param keepResults <bool> - If True, every result is held until the end, like a service keeping
+              finished tasks around. Finished results should not hold any descriptors.
+        '''
+        if not self.canCheck:
+            return
+
+        results = []
+        for i in range(5):
+            results.append(runOnce(i))
+        self._settle()
+
+        startFds = getNumOpenFds()
+        startThreads = subprocess2.threading.active_count()
+        startRss = getRss()
+
+        for i in range(self.iterations):
+            result = runOnce(i)
+            if keepResults:
+                results.append(result)
+        self._settle()
+
+        endFds = getNumOpenFds()
+        endThreads = subprocess2.threading.active_count()
+        endRss = getRss()
+        zombies = getZombieChildren()
+
+        assert endFds <= startFds , 'Expected open fds to stay flat, went from %d to %d after %d iterations' %(startFds, endFds, self.iterations)
+        assert endThreads <= startThreads , 'Expected thread count to stay flat, went from %d to %d after %d iterations' %(startThreads, endThreads, self.iterations)
+        assert not zombies , 'Expected no zombie children, found %d: %s' %(len(zombies), repr(zombies[:10]))
+        assert endRss - startRss < MAX_RSS_GROWTH_BYTES , 'Expected RSS to stay flat, grew by %d bytes after %d iterations' %(endRss - startRss, self.iterations)
+
+    def _settle(self):
+        '''
+            _settle - Give the reaper and any finishing background threads a moment, and collect garbage
+        '''
+        deadline = time.time() + 2
+        while time.time() < deadline:
+            if not getZombieChildren():
+                break
+            time.sleep(.02)
+        time.sleep(.05)
+        gc.collect()
+
+    def test_runGetResults(self):
+        def runOnce(i):
+            results = Simple.runGetResults(self._getPrinterCommand(3, i % 2))
+            assert results['returnCode'] == i % 2 , 'Expected returnCode %d, got %s' %(i % 2, repr(results['returnCode']))
+            assert results['stdout'].count('\n') == 3 , 'Expected 3 lines of stdout, got %s' %(repr(results['stdout']), )
+            return results
+
+        self._soak(runOnce)
+
+    def test_runGetOutputFailures(self):
+        def runOnce(i):
+            try:
+                Simple.runGetOutput(self._getPrinterCommand(1, 3), raiseOnFailure=True)
+            except SimpleCommandFailure as e:
+                assert e.returnCode == 3 , 'Expected returnCode 3, got %s' %(repr(e.returnCode), )
+            else:
+                raise AssertionError('Expected SimpleCommandFailure')
+
+            try:
+                Simple.runGetOutput(['/no/such/command/%d' %(i, )])
+            except SimpleCommandFailure:
+                pass
+            else:
+                raise AssertionError('Expected SimpleCommandFailure for a missing command')
+
+        self._soak(runOnce)
+
+    def test_runGetResultsException(self):
+        # Errors in the callback are collected in recordErrors, so raise something like a KeyboardInterrupt arriving mid-read
+        class CallbackError(BaseException):
+            pass
+
+        def failingCallback(record):
+            raise CallbackError('Stop')
+
+        def runOnce(i):
+            try:
+                Simple.runGetResults(self._getPrinterCommand(3), records='lines', recordCallback=failingCallback)
+            except CallbackError:
+                pass
+            else:
+                raise AssertionError('Expected the exception from recordCallback to propagate')
+
+        self._soak(runOnce)
+
+    def test_runGetResultsTimeout(self):
+        def runOnce(i):
+            results = Simple.runGetResults(self._getSleeperCommand(10), timeout=.05, terminateToKillSeconds=.5)
+            assert results['actionTaken'] != subprocess2.SUBPROCESS2_PROCESS_COMPLETED , 'Expected sleeper to be stopped'
+
+        self._soak(runOnce)
+
+    def test_runInBackground(self):
+        def runOnce(i):
+            pipe = subprocess2.Popen(self._getPrinterCommand(3), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            taskInfo = pipe.runInBackground(pollInterval=.01)
+            taskInfo.waitToFinish()
+            assert taskInfo.stdoutData.count(b'\n') == 3 , 'Expected 3 lines of stdout, got %s' %(repr(taskInfo.stdoutData), )
+            return (pipe, taskInfo)
+
+        self._soak(runOnce, keepResults=True)
+
+    def test_simpleRunInBackgroundPty(self):
+        def runOnce(i):
+            taskInfo = Simple.runInBackground(self._getPrinterCommand(3), usePty=True, pollInterval=.01)
+            taskInfo.waitToFinish()
+            assert taskInfo.stdoutData.count(b'\n') == 3 , 'Expected 3 lines of stdout, got %s' %(repr(taskInfo.stdoutData), )
+            return taskInfo
+
+        self._soak(runOnce, keepResults=True)
+
+    def test_taskQueue(self):
+        queue = TaskQueue(maxRunning=4, pollInterval=.01)
+
+        def runOnce(i):
+            tasks = [ queue.submit(self._getPrinterCommand(2), stdout=subprocess.PIPE, stderr=subprocess.PIPE) for j in range(4) ]
+            assert queue.waitAll(timeout=30) is True , 'Expected all tasks to finish'
+            return tasks
+
+        try:
+            self._soak(runOnce, keepResults=True)
+        finally:
+            queue.shutdown()
+
+    def test_workerPool(self):
+        def runOnce(i):
+            pool = WorkerPool(numWorkers=1, maxJobsPerWorker=2)
+            jobs = [ pool.submit('worker_jobs:printAndReturn', j) for j in range(3) ]
+            pool.shutdown()
+            assert pool.waitAll(timeout=30) is True , 'Expected all jobs to finish'
+            assert [ job.result for job in jobs ] == [0, 1, 2] , 'Expected results [0, 1, 2], got %s' %(repr([ job.result for job in jobs ]), )
+            return jobs
+
+        self._soak(runOnce, keepResults=True)
+
+
+if __name__ == '__main__':
+    subprocess.Popen('GoodTests.py "%s"' %(sys.argv[0],), shell=True).wait()
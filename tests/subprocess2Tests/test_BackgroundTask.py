@@ -1,8 +1,10 @@
 #!/usr/bin/env GoodTests.py
 
 import os
+import re
 import sys
 import subprocess
+import tempfile
 import time
 
 import subprocess2
@@ -106,6 +108,231 @@ class TestBackgroundTask(object):
             pass
         pipe.wait()
 
+    def test_largeOutput(self):
+        numBytes = 8 * 1024 * 1024
+        pipe = subprocess.Popen([sys.executable, '-c', 'import os; os.write(1, b"z" * %d)' %(numBytes, )], shell=False, stdout=subprocess.PIPE)
+        bgData = pipe.runInBackground(.1, pipeSize=256 * 1024)
+        bgData.waitToFinish(timeout=10, pollInterval=.01)
+
+        assert bgData.isFinished is True , 'Expected app to be finished'
+        assert len(bgData.stdoutData) == numBytes , 'Expected all %d bytes to be read, got %d' %(numBytes, len(bgData.stdoutData))
+
+    def test_readNew(self):
+        printCode = 'import sys, time\nfor i in range(3):\n    sys.stdout.write("line%d\\n" %(i,))\n    sys.stdout.flush()\n    time.sleep(.3)\n'
+        pipe = subprocess.Popen([sys.executable, '-c', printCode], shell=False, stdout=subprocess.PIPE)
+        bgData = pipe.runInBackground(.01)
+
+        (data, cursor) = bgData.waitForNew('stdout', 0, timeout=5)
+        assert data == b'line0\n' , 'Expected first read to be just the first line, got %s' %(repr(data),)
+        assert cursor == 6 , 'Expected cursor to be 6 after first read, got %d' %(cursor, )
+
+        (data, cursor2) = bgData.readNew('stdout', cursor)
+        assert data == b'' and cursor2 == cursor , 'Expected no new data immediately after first line, got %s' %(repr(data),)
+
+        collected = []
+        while True:
+            (data, cursor) = bgData.waitForNew('stdout', cursor, timeout=5)
+            if not data:
+                break
+            collected.append(data)
+
+        assert bgData.isFinished is True , 'Expected waitForNew to return empty only after task finished'
+        assert b''.join(collected) == b'line1\nline2\n' , 'Expected remaining lines from cursor reads, got %s' %(repr(b''.join(collected)),)
+        assert bgData.readNew('stdout', 6)[0] == b'line1\nline2\n' , 'Expected readNew from an older cursor to return all data since'
+
+    def test_waitForOutput(self):
+        serverCode = 'import sys, time\nsys.stdout.write("starting\\n")\nsys.stdout.flush()\ntime.sleep(.5)\nsys.stdout.write("listen")\nsys.stdout.flush()\ntime.sleep(.2)\nsys.stdout.write("ing on port 8123\\n")\nsys.stdout.flush()\ntime.sleep(1)\n'
+        pipe = subprocess.Popen([sys.executable, '-c', serverCode], shell=False, stdout=subprocess.PIPE)
+        bgData = pipe.runInBackground(.01, encoding='utf-8')
+
+        start = time.time()
+        match = bgData.waitForOutput('listening on', timeout=5)
+        assert match is not None , 'Expected to find "listening on" split across two writes'
+        assert time.time() - start < 1.2 , 'Expected waitForOutput to return as soon as the output arrived'
+        assert bgData.isFinished is False , 'Expected to return before the process completed'
+
+        match = bgData.waitForOutput(re.compile(r'port (\d+)'), timeout=5)
+        assert match is not None and match.group(1) == '8123' , 'Expected regex to match port number'
+
+        match = bgData.waitForOutput('never printed', timeout=.2)
+        assert match is None , 'Expected None on timeout'
+
+        match = bgData.waitForOutput('never printed', timeout=10)
+        assert match is None , 'Expected None when process exits without a match'
+        assert bgData.isFinished is True , 'Expected process to have finished'
+
+    def test_records(self):
+        printCode = 'import sys, time\nsys.stdout.write("one\\ntw")\nsys.stdout.flush()\ntime.sleep(.3)\nsys.stdout.write("o\\nthree\\n")\nsys.stdout.flush()\n'
+        pipe = subprocess.Popen([sys.executable, '-c', printCode], shell=False, stdout=subprocess.PIPE)
+        bgData = pipe.runInBackground(.01, encoding='utf-8', records='lines')
+
+        time.sleep(.2)
+        assert bgData.records == ['one'] , 'Expected only the complete first line to be parsed, got %s' %(repr(bgData.records),)
+
+        bgData.waitToFinish(timeout=5, pollInterval=.01)
+        assert bgData.records == ['one', 'two', 'three'] , 'Expected line split across writes to be joined, got %s' %(repr(bgData.records),)
+        assert not bgData.stdoutData , 'Expected raw stdout to not be kept when parsing records'
+
+        seen = []
+        pipe = subprocess.Popen([sys.executable, '-c', printCode], shell=False, stdout=subprocess.PIPE)
+        bgData = pipe.runInBackground(.01, records=lambda line : len(line), recordCallback=seen.append)
+        bgData.waitToFinish(timeout=5, pollInterval=.01)
+
+        assert seen == [3, 3, 5] , 'Expected callback to receive parsed records, got %s' %(repr(seen),)
+        assert bgData.records == [] , 'Expected records to not be collected when a callback is given'
+
+    def test_resourceTimeline(self):
+        if not os.path.exists('/proc/self/statm'):
+            return # /proc is required for sampling
+
+        burnCode = 'import time\ndata = b"m" * (64 * 1024 * 1024)\nend = time.time() + .6\nwhile time.time() < end:\n    pass\n'
+        pipe = subprocess.Popen([sys.executable, '-c', burnCode], shell=False)
+        bgData = pipe.runInBackground(.05, sampleInterval=.02, maxSamples=8)
+        bgData.waitToFinish(timeout=10, pollInterval=.01)
+
+        timeline = bgData.resourceTimeline
+        assert timeline is not None , 'Expected a resourceTimeline when sampleInterval is given'
+        assert 2 <= len(timeline) <= 8 , 'Expected timeline to be bounded by maxSamples=8, got %d samples' %(len(timeline), )
+        assert timeline.keepEvery > 1 , 'Expected timeline to have been decimated after filling up'
+        assert timeline.peakRssBytes >= 64 * 1024 * 1024 , 'Expected peak RSS to include the 64MiB allocation, got %d' %(timeline.peakRssBytes, )
+
+        samples = timeline.samples()
+        assert samples[-1][1] > samples[0][1] , 'Expected cpu time to increase over the run'
+        assert list(timeline.times) == sorted(timeline.times) , 'Expected sample times to be in order'
+
+    def test_teeTo(self):
+        (fd, tmpPath) = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            pipe = subprocess.Popen([sys.executable, '-c', 'import sys; sys.stdout.write("y" * 300000); sys.stderr.write("err")'], shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            bgData = pipe.runInBackground(.01, teeTo={'stdout' : tmpPath}, teeCapture=False)
+            bgData.waitToFinish(timeout=10)
+
+            assert bgData.isFinished is True , 'Expected app to be finished'
+            assert not bgData.stdoutData , 'Expected stdout to not be stored with teeCapture=False'
+            assert bgData.stderrData == b'err' , 'Expected non-tee\'d stderr to still be stored, got %s' %(repr(bgData.stderrData),)
+            assert os.path.getsize(tmpPath) == 300000 , 'Expected all 300000 bytes in tee file, got %d' %(os.path.getsize(tmpPath),)
+        finally:
+            os.remove(tmpPath)
+
+    def test_chunkLog(self):
+        interleaveCode = 'import sys, time\nfor i in range(3):\n    sys.stdout.write("out%d\\n" %(i,)); sys.stdout.flush(); time.sleep(.15)\n    sys.stderr.write("err%d\\n" %(i,)); sys.stderr.flush(); time.sleep(.15)\n'
+        pipe = subprocess.Popen([sys.executable, '-c', interleaveCode], shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        bgData = pipe.runInBackground(.01, encoding='utf-8', chunkLog=True)
+        bgData.waitToFinish(timeout=10)
+
+        assert bgData.stdoutData == 'out0\nout1\nout2\n' , 'Expected stdout to still be stored separately, got %s' %(repr(bgData.stdoutData),)
+        assert bgData.stderrData == 'err0\nerr1\nerr2\n' , 'Expected stderr to still be stored separately, got %s' %(repr(bgData.stderrData),)
+
+        timeline = list(bgData.iterTimeline())
+        replayed = [ (streamName, data) for (chunkTime, streamName, data) in timeline ]
+        expected = [ ('stdout', 'out0\n'), ('stderr', 'err0\n'), ('stdout', 'out1\n'), ('stderr', 'err1\n'), ('stdout', 'out2\n'), ('stderr', 'err2\n') ]
+        assert replayed == expected , 'Expected streams to be replayed in the order written, got %s' %(repr(replayed),)
+
+        times = [ chunkTime for (chunkTime, streamName, data) in timeline ]
+        assert times == sorted(times) , 'Expected chunk times to be in order'
+
+        rest = list(bgData.iterTimeline(start=4))
+        assert [ data for (chunkTime, streamName, data) in rest ] == ['out2\n', 'err2\n'] , 'Expected iterTimeline(start) to skip chunks already seen, got %s' %(repr(rest),)
+
+        pipe = subprocess.Popen(['echo', 'hi'], shell=False, stdout=subprocess.PIPE)
+        bgData = pipe.runInBackground(.01)
+        bgData.waitToFinish(timeout=10)
+        assert bgData.chunkLog is None , 'Expected no chunk log unless requested'
+
+    def test_chunkQueue(self):
+        floodCode = 'import sys\nfor i in range(64):\n    sys.stdout.write("z" * 65536)\nsys.stderr.write("done")\n'
+
+        pipe = subprocess.Popen([sys.executable, '-c', floodCode], shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        bgData = pipe.runInBackground(.01, maxReadSize=65536, chunkQueueSize=2)
+
+        # Nothing is consuming, so the child should be held up on its pipe rather than its output being buffered
+        time.sleep(.5)
+        assert bgData.isFinished is False , 'Expected child to be blocked while the chunk queue is full'
+        assert pipe.poll() is None , 'Expected child to still be running while the chunk queue is full'
+
+        received = { 'stdout' : 0, 'stderr' : b'' }
+        for (streamName, data) in bgData.iterChunks():
+            if streamName == 'stdout':
+                received['stdout'] += len(data)
+            else:
+                received['stderr'] += data
+
+        assert received['stdout'] == 64 * 65536 , 'Expected all stdout through iterChunks, got %d bytes' %(received['stdout'],)
+        assert received['stderr'] == b'done' , 'Expected stderr through iterChunks, got %s' %(repr(received['stderr']),)
+        assert bgData.waitToFinish(timeout=10) == 0 , 'Expected task to finish with return code 0'
+        assert not bgData.stdoutData , 'Expected output to not also be stored in stdoutData'
+        assert list(bgData.iterChunks()) == [] , 'Expected iterChunks to end immediately once all output is consumed'
+
+        pipe = subprocess.Popen([sys.executable, '-c', floodCode], shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        bgData = pipe.runInBackground(.01, maxReadSize=65536, chunkQueueSize=2)
+        chunks = bgData.iterChunks()
+        next(chunks)
+        chunks.close()
+
+        assert bgData.waitToFinish(timeout=10) == 0 , 'Expected task to run to completion after the consumer stopped early'
+
+    def test_compress(self):
+        verboseCode = 'import sys\nfor i in range(20000):\n    sys.stdout.write("compiling module %d of the build ... ok\\n" %(i,))\nsys.stderr.write("warning: done")\n'
+        expectedStdout = ''.join([ 'compiling module %d of the build ... ok\n' %(i,) for i in range(20000) ])
+
+        for compress in ('zlib', 'lzma'):
+            pipe = subprocess.Popen([sys.executable, '-c', verboseCode], shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            bgData = pipe.runInBackground(.01, encoding='utf-8', compress=compress)
+
+            (firstData, cursor) = bgData.waitForNew('stdout', 0, timeout=10)
+            bgData.waitToFinish(timeout=10)
+
+            assert firstData and expectedStdout.startswith(firstData) , 'Expected cursor reads to work on compressed output (%s)' %(compress,)
+            assert bgData.stdoutData == expectedStdout , 'Expected compressed stdout to decompress to the full output (%s)' %(compress,)
+            assert bgData.stderrData == 'warning: done' , 'Expected compressed stderr to decompress (%s), got %s' %(compress, repr(bgData.stderrData))
+            assert bgData.readNew('stdout', cursor)[0] == expectedStdout[cursor:] , 'Expected readNew past a cursor on compressed output (%s)' %(compress,)
+            assert ''.join(bgData.iterData('stdout')) == expectedStdout , 'Expected iterData to stream out the full output (%s)' %(compress,)
+            assert bgData.compressionRatio > 5 , 'Expected repetitive output to compress well (%s), got ratio %s' %(compress, repr(bgData.compressionRatio))
+
+        pipe = subprocess.Popen(['echo', 'hi'], shell=False, stdout=subprocess.PIPE)
+        bgData = pipe.runInBackground(.01)
+        bgData.waitToFinish(timeout=10)
+        assert bgData.compressionRatio is None , 'Expected no compressionRatio without compress'
+
+    def test_compressTimeline(self):
+        chattyCode = 'import sys, time\nfor i in range(400):\n    sys.stdout.write("step %d ok\\n" %(i,)); sys.stdout.flush()\n    if i % 50 == 0:\n        sys.stderr.write("at %d\\n" %(i,)); sys.stderr.flush()\n    time.sleep(.001)\n'
+
+        pipe = subprocess.Popen([sys.executable, '-c', chattyCode], shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        bgData = pipe.runInBackground(.001, encoding='utf-8', chunkLog=True, compress='zlib')
+
+        # Reading while the task runs ends the current frame, so the output is stored in several frames
+        cursor = 0
+        while not bgData.isFinished:
+            (data, cursor) = bgData.readNew('stdout', cursor)
+            time.sleep(.02)
+        bgData.waitToFinish(timeout=10)
+
+        stdoutData = bgData.stdoutData
+        stdoutBuffer = bgData._streamBuffers[1]
+        assert len(stdoutBuffer.frames) > 1 , 'Expected output to be stored in several frames, got %d' %(len(stdoutBuffer.frames), )
+
+        # Count decompressions, replaying should decompress each frame once rather than once per chunk
+        numDecompressed = [0]
+        origDecompress = stdoutBuffer._decompress
+        def countingDecompress(frame):
+            numDecompressed[0] += 1
+            return origDecompress(frame)
+        stdoutBuffer._decompress = countingDecompress
+
+        timeline = list(bgData.iterTimeline())
+        stdoutChunks = [ data for (chunkTime, streamName, data) in timeline if streamName == 'stdout' ]
+
+        # The same ranges read straight from the decompressed output, like an uncompressed task
+        expectedChunks = [ stdoutData[offset:offset + length] for (chunkTime, streamName, offset, length) in bgData.chunkLog.entries() if streamName == 'stdout' ]
+
+        assert stdoutChunks == expectedChunks , 'Expected compressed timeline to match the uncompressed ranges'
+        assert ''.join(stdoutChunks) == stdoutData , 'Expected timeline to replay all of stdout'
+        assert ''.join([ data for (chunkTime, streamName, data) in timeline if streamName == 'stderr' ]) == bgData.stderrData , 'Expected timeline to replay all of stderr'
+        assert len(stdoutChunks) > len(stdoutBuffer.frames) , 'Expected more chunks than frames, got %d chunks in %d frames' %(len(stdoutChunks), len(stdoutBuffer.frames))
+        assert numDecompressed[0] <= len(stdoutBuffer.frames) , 'Expected each frame to be decompressed at most once in a replay, got %d decompressions of %d frames' %(numDecompressed[0], len(stdoutBuffer.frames))
+        assert stdoutBuffer.rangeCursor is None , 'Expected the decompressed frame to be released after replay'
+
 
 if __name__ == '__main__':
     subprocess.Popen('GoodTests.py "%s"' %(sys.argv[0],), shell=True).wait()
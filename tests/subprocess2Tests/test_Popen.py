@@ -120,6 +120,32 @@ class TestPopen(object):
         assert end - start < 2.5, 'waitOrTerminate took longer than max time.'
         assert end - start > 2, 'waitOrTerminate killed to quickly.'
 
+    def test_reaperCollectsAfterKill(self):
+        pipe = subprocess.Popen(self._getSleeperCommand(7, 1, 250), shell=False) # 250 is special command to sleeper.py to continue running after sigterm
+        ret = pipe.waitOrTerminate(.25, terminateToKillSeconds=0)
+
+        assert ret['returnCode'] is None , 'SIGKILL should have returned None. Got: %s' %(ret['returnCode'],)
+
+        start = time.time()
+        while pipe.returncode is None and time.time() - start < 2:
+            time.sleep(.01)
+
+        assert pipe.returncode is not None , 'Expected reaper to collect the exit status after the kill'
+        assert not os.path.exists('/proc/%d' %(pipe.pid, )) or sys.platform != 'linux' , 'Expected killed child to be reaped, not left as a zombie'
+
+    def test_reaperCallback(self):
+        reaped = []
+        pipe = subprocess.Popen(self._getSleeperCommand(.2, 7), shell=False)
+
+        start = time.time()
+        subprocess2.getReaper().register(pipe, lambda exitedPipe, returnCode : reaped.append( (returnCode, time.time()) ))
+        while not reaped and time.time() - start < 3:
+            time.sleep(.01)
+
+        assert reaped and reaped[0][0] == 7 , 'Expected reaper callback with return code 7, got %s' %(repr(reaped),)
+        assert pipe.returncode == 7 , 'Expected reaper to set returncode on the Popen'
+        assert reaped[0][1] - start < 1 , 'Expected reaper to collect the child shortly after it exited'
+
 
 if __name__ == '__main__':
     subprocess.Popen('GoodTests.py "%s"' %(sys.argv[0],), shell=True).wait()
@@ -0,0 +1,107 @@
+#!/usr/bin/env GoodTests.py
+
+import os
+import sys
+import subprocess
+import time
+
+import subprocess2
+from subprocess2 import Simple, getRegistry
+from subprocess2.registry import TaskRegistry
+
+
+class TestRegistry(object):
+    '''
+        Tests the process-wide task registry
+    '''
+
+    def setup_class(self):
+        self.dirName = os.path.dirname(__file__)
+        self.sleeperPath = "%s/sleeper.py" %(self.dirName, )
+        if not os.path.exists(self.sleeperPath):
+            sys.stderr.write('ERROR! CANNOT FIND sleeper.py in test directory. Test will fail.\n')
+
+    def test_counters(self):
+        registry = getRegistry()
+        before = registry.asDict()['counters']
+
+        Simple.runGetOutput('echo hello')
+        Simple.runGetResults('exit 3')
+        try:
+            Simple.runGetOutput(['/no/such/command'])
+        except subprocess2.SimpleCommandFailure:
+            pass
+
+        after = registry.asDict()['counters']
+        assert after['tasksStarted'] - before['tasksStarted'] == 2 , 'Expected 2 tasks started, got %d' %(after['tasksStarted'] - before['tasksStarted'], )
+        assert after['tasksFinished'] - before['tasksFinished'] == 2 , 'Expected 2 tasks finished, got %d' %(after['tasksFinished'] - before['tasksFinished'], )
+        assert after['tasksFailed'] - before['tasksFailed'] == 1 , 'Expected 1 task failed, got %d' %(after['tasksFailed'] - before['tasksFailed'], )
+        assert after['launchFailures'] - before['launchFailures'] == 1 , 'Expected 1 launch failure, got %d' %(after['launchFailures'] - before['launchFailures'], )
+        assert after['bytesRead'] - before['bytesRead'] == len(b'hello\n') , 'Expected 6 bytes read, got %d' %(after['bytesRead'] - before['bytesRead'], )
+
+        finished = registry.asDict()['recentlyFinished'][-1]
+        assert finished['kind'] == 'simple' , 'Expected last finished task to be "simple", got %s' %(repr(finished['kind']), )
+        assert finished['returnCode'] == 3 , 'Expected last finished task to have returnCode 3, got %s' %(repr(finished['returnCode']), )
+
+    def test_liveBackground(self):
+        registry = getRegistry()
+        numLiveBefore = registry.numLive
+
+        pipe = subprocess2.Popen([self.sleeperPath, '.5', '0'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        taskInfo = pipe.runInBackground(pollInterval=.01)
+
+        time.sleep(.1)
+        assert registry.numLive == numLiveBefore + 1 , 'Expected background task to be live, got %d live (was %d)' %(registry.numLive, numLiveBefore)
+        liveKinds = [ entry['kind'] for entry in registry.asDict()['live'] ]
+        assert 'background' in liveKinds , 'Expected a live "background" entry, got %s' %(repr(liveKinds), )
+
+        taskInfo.waitToFinish()
+        assert registry.numLive == numLiveBefore , 'Expected task to no longer be live, got %d live (was %d)' %(registry.numLive, numLiveBefore)
+
+    def test_terminateAndKill(self):
+        registry = getRegistry()
+        before = registry.asDict()['counters']
+
+        pipe = subprocess2.Popen([self.sleeperPath, '10', '0'])
+        pipe.waitOrTerminate(.05, terminateToKillSeconds=0)
+
+        pipe = subprocess2.Popen([self.sleeperPath, '10', '0'])
+        pipe.waitOrTerminate(.05, terminateToKillSeconds=None)
+
+        after = registry.asDict()['counters']
+        assert after['killCount'] - before['killCount'] == 1 , 'Expected 1 kill, got %d' %(after['killCount'] - before['killCount'], )
+        assert after['terminateCount'] - before['terminateCount'] == 1 , 'Expected 1 terminate, got %d' %(after['terminateCount'] - before['terminateCount'], )
+
+    def test_histograms(self):
+        registry = TaskRegistry(maxRecent=2)
+
+        for i in range(3):
+            entry = registry.taskStarted('simple', 1000 + i)
+            registry.taskFinished(entry, 0, 2048)
+        registry.recordSpawn(.002)
+
+        assert len(registry.recentlyFinished) == 2 , 'Expected only 2 recently finished to be kept, got %d' %(len(registry.recentlyFinished), )
+
+        outputBytes = registry.outputBytes.asDict()
+        assert outputBytes['count'] == 3 , 'Expected 3 observations, got %d' %(outputBytes['count'], )
+        assert outputBytes['sum'] == 3 * 2048 , 'Expected sum of 6144, got %s' %(repr(outputBytes['sum']), )
+        assert registry.spawnLatency.asDict()['count'] == 1 , 'Expected 1 spawn latency observation'
+
+    def test_prometheus(self):
+        registry = TaskRegistry()
+        entry = registry.taskStarted('simple', 1000)
+        registry.taskFinished(entry, 1, 10)
+
+        text = registry.toPrometheus()
+        lines = text.split('\n')
+
+        assert 'subprocess2_tasks_started_total 1' in lines , 'Expected tasks_started counter in output:\n%s' %(text, )
+        assert 'subprocess2_tasks_failed_total 1' in lines , 'Expected tasks_failed counter in output:\n%s' %(text, )
+        assert 'subprocess2_tasks_live 0' in lines , 'Expected tasks_live gauge in output:\n%s' %(text, )
+        assert '# TYPE subprocess2_runtime_seconds histogram' in lines , 'Expected runtime histogram in output:\n%s' %(text, )
+        assert 'subprocess2_output_bytes_bucket{le="+Inf"} 1' in lines , 'Expected +Inf bucket of output_bytes in output:\n%s' %(text, )
+        assert 'subprocess2_output_bytes_count 1' in lines , 'Expected output_bytes count in output:\n%s' %(text, )
+
+
+if __name__ == '__main__':
+    subprocess.Popen('GoodTests.py "%s"' %(sys.argv[0],), shell=True).wait()
@@ -0,0 +1,309 @@
+#!/usr/bin/env GoodTests.py
+
+import os
+import signal
+import struct
+import sys
+import subprocess
+import tempfile
+import time
+
+import subprocess2
+from subprocess2 import Simple
+from subprocess2.argbatch import getArgumentBatches
+from subprocess2.BackgroundTask import startBackgroundTask
+from subprocess2.ptyio import ControlSequenceStripper
+
+
+class TestSimple(object):
+    '''
+        Tests the "Simple" interfaces
+    '''
+
+    def setup_method(self, meth):
+        (fd, self.tmpPath) = tempfile.mkstemp()
+        os.close(fd)
+
+    def teardown_method(self, meth):
+        try:
+            os.remove(self.tmpPath)
+        except:
+            pass
+
+    def test_runGetResults(self):
+        results = Simple.runGetResults([sys.executable, '-c', 'import sys; sys.stdout.write("hello"); sys.stderr.write("world"); sys.exit(3)'])
+
+        assert results['returnCode'] == 3 , 'Expected return code 3, got %s' %(repr(results['returnCode']),)
+        assert results['stdout'] == 'hello' , 'Expected stdout to be "hello", got %s' %(repr(results['stdout']),)
+        assert results['stderr'] == 'world' , 'Expected stderr to be "world", got %s' %(repr(results['stderr']),)
+
+    def test_teeTo(self):
+        results = Simple.runGetResults(['echo', 'hello tee'], teeTo=self.tmpPath)
+
+        assert results['stdout'] == 'hello tee\n' , 'Expected stdout to still be captured with teeTo, got %s' %(repr(results['stdout']),)
+        with open(self.tmpPath, 'rt') as f:
+            teeData = f.read()
+        assert teeData == 'hello tee\n' , 'Expected tee file to contain output, got %s' %(repr(teeData),)
+
+    def test_teeToNoCapture(self):
+        bigCmd = [sys.executable, '-c', 'import sys; sys.stdout.write("x" * 500000)']
+        results = Simple.runGetResults(bigCmd, teeTo=self.tmpPath, teeCapture=False)
+
+        assert results['returnCode'] == 0 , 'Expected return code 0, got %s' %(repr(results['returnCode']),)
+        assert not results['stdout'] , 'Expected stdout to not be captured with teeCapture=False'
+        assert os.path.getsize(self.tmpPath) == 500000 , 'Expected all 500000 bytes in tee file, got %d' %(os.path.getsize(self.tmpPath),)
+
+    def test_records(self):
+        jsonCode = 'import sys\nsys.stdout.write(\'{"a": 1}\\n{"a": 2}\\nnot json\\n\\n{"a": \')\nsys.stdout.flush()\nsys.stdout.write(\'3}\')\n'
+        results = Simple.runGetResults([sys.executable, '-c', jsonCode], records='json')
+
+        assert results['records'] == [ {'a' : 1}, {'a' : 2}, {'a' : 3} ] , 'Expected 3 JSON records (including unterminated last line), got %s' %(repr(results['records']),)
+        assert len(results['recordErrors']) == 1 , 'Expected one record error for "not json", got %s' %(repr(results['recordErrors']),)
+        assert not results['stdout'] , 'Expected raw stdout to not be kept when parsing records'
+
+    def test_executableCache(self):
+        binDir = tempfile.mkdtemp()
+        try:
+            exePath = os.path.join(binDir, 'subprocess2_test_exe')
+            with open(exePath, 'wt') as f:
+                f.write('#!/bin/sh\necho cached\n')
+            os.chmod(exePath, 0o755)
+
+            searchPath = binDir + os.pathsep + os.environ.get('PATH', '')
+            assert subprocess2.resolveExecutable('subprocess2_test_exe', searchPath) == exePath , 'Expected executable to be found in PATH'
+            assert subprocess2.resolveExecutable('subprocess2_test_exe', os.environ.get('PATH', '')) is None , 'Expected executable to not be found without its directory in PATH'
+
+            os.remove(exePath)
+            assert subprocess2.resolveExecutable('subprocess2_test_exe', searchPath) is None , 'Expected removed executable to be revalidated and not returned'
+
+            with open(exePath, 'wt') as f:
+                f.write('#!/bin/sh\necho cached\n')
+            os.chmod(exePath, 0o755)
+
+            oldPath = os.environ.get('PATH', '')
+            os.environ['PATH'] = searchPath
+            try:
+                output = Simple.runGetOutput(['subprocess2_test_exe'], cacheExecutable=True)
+            finally:
+                os.environ['PATH'] = oldPath
+            assert output == 'cached\n' , 'Expected command resolved through cache to run, got %s' %(repr(output),)
+
+            if os.path.exists('/proc/self/cmdline'):
+                # The cached path is only used to find the executable. The child should see the argv[0] it was given.
+                os.symlink(sys.executable, os.path.join(binDir, 'subprocess2_test_python'))
+                getArgv0 = 'import sys; sys.stdout.write(open("/proc/self/cmdline", "rb").read().split(b"\\0")[0].decode("utf-8"))'
+                os.environ['PATH'] = searchPath
+                try:
+                    argv0 = Simple.runGetOutput(['subprocess2_test_python', '-c', getArgv0], cacheExecutable=True)
+                finally:
+                    os.environ['PATH'] = oldPath
+                assert argv0 == 'subprocess2_test_python' , 'Expected argv[0] to be unchanged by cacheExecutable, got %s' %(repr(argv0),)
+
+            subprocess2.clearExecutableCache()
+        finally:
+            for fileName in os.listdir(binDir):
+                os.remove(os.path.join(binDir, fileName))
+            os.rmdir(binDir)
+
+    def test_limits(self):
+        busyCmd = [sys.executable, '-c', 'while True: pass']
+        results = Simple.runGetResults(busyCmd, limits={'maxCpuSeconds' : 1})
+
+        assert results['returnCode'] != 0 , 'Expected busy loop to be stopped by cpu limit'
+        assert results['limitExceeded'] == 'cpu' , 'Expected limitExceeded to be "cpu", got %s' %(repr(results['limitExceeded']),)
+
+        allocCmd = [sys.executable, '-c', 'x = b"x" * (1024 * 1024 * 1024)']
+        results = Simple.runGetResults(allocCmd, limits=subprocess2.ResourceLimits(maxMemory=256 * 1024 * 1024))
+
+        assert results['returnCode'] != 0 , 'Expected large allocation to fail under memory limit'
+        assert results['limitExceeded'] == 'memory' , 'Expected limitExceeded to be "memory", got %s' %(repr(results['limitExceeded']),)
+
+        # SIGXCPU ignored, so the hard limit (a second later) kills it with SIGKILL
+        ignoringCmd = [sys.executable, '-c', 'import signal; signal.signal(signal.SIGXCPU, signal.SIG_IGN)\nwhile True: pass']
+        results = Simple.runGetResults(ignoringCmd, limits={'maxCpuSeconds' : 1})
+        assert results['returnCode'] == -signal.SIGKILL , 'Expected busy loop ignoring SIGXCPU to be killed, got %s' %(repr(results['returnCode']),)
+        assert results['limitExceeded'] == 'cpu' , 'Expected SIGKILL after reaching the cpu limit to be "cpu", got %s' %(repr(results['limitExceeded']),)
+
+        # Killed by something else (like the OOM killer) before using much CPU
+        selfKillCmd = [sys.executable, '-c', 'import os, signal; os.kill(os.getpid(), signal.SIGKILL)']
+        results = Simple.runGetResults(selfKillCmd, limits={'maxCpuSeconds' : 5})
+        assert results['returnCode'] == -signal.SIGKILL , 'Expected command to be killed, got %s' %(repr(results['returnCode']),)
+        assert results['limitExceeded'] is None , 'Expected a SIGKILL without reaching the cpu limit to not be blamed on it, got %s' %(repr(results['limitExceeded']),)
+
+        results = Simple.runGetResults(['echo', 'fine'], limits={'maxCpuSeconds' : 5, 'nice' : 5})
+        assert results['returnCode'] == 0 and results['limitExceeded'] is None , 'Expected no limit exceeded for a quick command, got %s' %(repr(results),)
+
+        try:
+            Simple.runGetOutput(allocCmd, raiseOnFailure=True, limits={'maxMemory' : 256 * 1024 * 1024})
+        except subprocess2.SimpleCommandFailure as e:
+            assert e.limitExceeded == 'memory' , 'Expected SimpleCommandFailure.limitExceeded to be "memory", got %s' %(repr(e.limitExceeded),)
+        else:
+            raise AssertionError('Expected SimpleCommandFailure from runGetOutput with raiseOnFailure')
+
+    def test_runInBackgroundLimits(self):
+        taskInfo = Simple.runInBackground([sys.executable, '-c', 'import sys; sys.stdout.write("started"); sys.stdout.flush()\nwhile True: pass'], limits={'maxCpuSeconds' : 1})
+
+        assert taskInfo.waitToFinish(timeout=10) is not None , 'Expected background task to be stopped by cpu limit'
+        assert taskInfo.stdoutData == b'started' , 'Expected background output to be gathered, got %s' %(repr(taskInfo.stdoutData),)
+        assert taskInfo.limitExceeded == 'cpu' , 'Expected limitExceeded to be "cpu", got %s' %(repr(taskInfo.limitExceeded),)
+
+        # Killed by subprocess2 itself after passing the cpu limit (SIGXCPU is ignored, so the hard limit has not killed it yet)
+        limits = subprocess2.ResourceLimits(maxCpuSeconds=1)
+        ignoringCmd = [sys.executable, '-c', 'import signal; signal.signal(signal.SIGXCPU, signal.SIG_IGN)\nwhile True: pass']
+        pipe = subprocess2.Popen(ignoringCmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, preexec_fn=limits.getPreexecFn())
+        taskInfo = subprocess2.BackgroundTaskInfo()
+        startBackgroundTask(pipe, taskInfo, pollInterval=.05, limits=limits)
+        waitResult = pipe.waitOrTerminate(1.5, terminateToKillSeconds=0)
+
+        assert waitResult['actionTaken'] == subprocess2.SUBPROCESS2_PROCESS_KILLED , 'Expected waitOrTerminate to kill the busy loop, got %s' %(repr(waitResult),)
+        assert taskInfo.waitToFinish(timeout=10) == -signal.SIGKILL , 'Expected background task to be killed, got %s' %(repr(taskInfo.returnCode),)
+        assert taskInfo.limitExceeded is None , 'Expected our own SIGKILL to not be blamed on the cpu limit, got %s' %(repr(taskInfo.limitExceeded),)
+
+    def test_timeout(self):
+        partialCmd = [sys.executable, '-c', 'import sys, time; sys.stdout.write("partial"); sys.stdout.flush(); time.sleep(30)']
+
+        before = time.time()
+        results = Simple.runGetResults(partialCmd, timeout=1)
+        after = time.time()
+
+        assert after - before < 10 , 'Expected runGetResults to return soon after the timeout, took %f seconds' %(after - before,)
+        assert results['stdout'] == 'partial' , 'Expected partial output to be returned, got %s' %(repr(results['stdout']),)
+        assert results['actionTaken'] == subprocess2.SUBPROCESS2_PROCESS_TERMINATED , 'Expected actionTaken to be TERMINATED, got %s' %(repr(results['actionTaken']),)
+        assert results['returnCode'] == -signal.SIGTERM , 'Expected return code to be -SIGTERM, got %s' %(repr(results['returnCode']),)
+
+        ignoreTermCmd = [sys.executable, '-c', 'import signal, sys, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); sys.stdout.write("ignoring"); sys.stdout.flush(); time.sleep(30)']
+        results = Simple.runGetResults(ignoreTermCmd, timeout=1, terminateToKillSeconds=.5)
+
+        expectedAction = subprocess2.SUBPROCESS2_PROCESS_TERMINATED | subprocess2.SUBPROCESS2_PROCESS_KILLED
+        assert results['actionTaken'] == expectedAction , 'Expected actionTaken to be TERMINATED|KILLED, got %s' %(repr(results['actionTaken']),)
+        assert results['stdout'] == 'ignoring' , 'Expected partial output to be returned, got %s' %(repr(results['stdout']),)
+
+        # The command exits right away, but leaves a background child holding its pipes. The timeout still bounds the call.
+        before = time.time()
+        results = Simple.runGetResults('echo hi; sleep 8 &', timeout=1)
+        after = time.time()
+        assert after - before < 3 , 'Expected runGetResults to return soon after the timeout when a background child holds the pipes, took %f seconds' %(after - before,)
+        assert results['stdout'] == 'hi\n' , 'Expected output written before exiting, got %s' %(repr(results['stdout']),)
+        assert results['returnCode'] == 0 , 'Expected return code of the command, got %s' %(repr(results['returnCode']),)
+
+        results = Simple.runGetResults(['echo', 'quick'], timeout=10)
+        assert results['actionTaken'] == subprocess2.SUBPROCESS2_PROCESS_COMPLETED , 'Expected actionTaken to be COMPLETED when finishing in time'
+        assert results['returnCode'] == 0 , 'Expected return code 0, got %s' %(repr(results['returnCode']),)
+
+        try:
+            Simple.runGetOutput(partialCmd, raiseOnFailure=True, timeout=1, terminateToKillSeconds=0)
+        except subprocess2.SimpleCommandFailure as e:
+            assert e.stdout == 'partial' , 'Expected partial output in SimpleCommandFailure, got %s' %(repr(e.stdout),)
+            assert e.actionTaken == subprocess2.SUBPROCESS2_PROCESS_KILLED , 'Expected actionTaken to be KILLED, got %s' %(repr(e.actionTaken),)
+        else:
+            raise AssertionError('Expected SimpleCommandFailure from runGetOutput with a timeout and raiseOnFailure')
+
+    def test_usePty(self):
+        ttyCmd = [sys.executable, '-c', 'import sys; sys.stdout.write("tty=%s\\n" %(sys.stdout.isatty(), )); sys.stdout.write("\\x1b[1;31mred\\x1b[0m\\n")']
+
+        results = Simple.runGetResults(ttyCmd, usePty=True)
+        assert results['returnCode'] == 0 , 'Expected return code 0, got %s' %(repr(results['returnCode']),)
+        assert results['stdout'] == 'tty=True\n\x1b[1;31mred\x1b[0m\n' , 'Expected stdout to be a terminal, with newlines not translated and control sequences kept. Got %s' %(repr(results['stdout']),)
+
+        results = Simple.runGetResults(ttyCmd, usePty=True, stripControlSequences=True)
+        assert results['stdout'] == 'tty=True\nred\n' , 'Expected control sequences to be stripped, got %s' %(repr(results['stdout']),)
+
+        results = Simple.runGetResults(ttyCmd)
+        assert results['stdout'].startswith('tty=False\n') , 'Expected stdout to be a pipe without usePty, got %s' %(repr(results['stdout']),)
+
+        stripper = ControlSequenceStripper()
+        stripped = stripper.feed(b'abc\x1b[3') + stripper.feed(b'1mdef\x1b]0;title\x07ghi\x1b') + stripper.finish()
+        assert stripped == b'abcdefghi\x1b' , 'Expected sequences split across reads to be stripped, got %s' %(repr(stripped),)
+
+        # OSC (window title) sequences split part way through their text, and part way through their terminator
+        for pieces in ( (b'abc\x1b]0;my ti', b'tle\x07def'), (b'abc\x1b]0;title\x1b', b'\\def'), (b'abc\x1b', b']0;title\x07def') ):
+            stripper = ControlSequenceStripper()
+            stripped = b''.join([ stripper.feed(piece) for piece in pieces ]) + stripper.finish()
+            assert stripped == b'abcdef' , 'Expected OSC sequence split as %s to be stripped, got %s' %(repr(pieces), repr(stripped))
+
+    def test_runInBackgroundPty(self):
+        # Without a terminal, python would block-buffer this line until exit
+        lineCmd = [sys.executable, '-c', 'import sys, time; print("first line"); time.sleep(2)']
+
+        taskInfo = Simple.runInBackground(lineCmd, usePty=True)
+        try:
+            data = taskInfo.waitForOutput('first line', timeout=1.5)
+            assert data is not None , 'Expected line to be read while the command is still running, got %s' %(repr(taskInfo.stdoutData),)
+            assert taskInfo.isFinished is False , 'Expected command to still be running'
+        finally:
+            taskInfo.waitToFinish()
+
+        assert taskInfo.returnCode == 0 , 'Expected return code 0, got %s' %(repr(taskInfo.returnCode),)
+        assert taskInfo.stdoutData == b'first line\n' , 'Expected all output after finishing, got %s' %(repr(taskInfo.stdoutData),)
+
+        taskInfo = Simple.runInBackground(['sh', '-c', 'echo line1; sleep .3; echo line2'], usePty=True)
+        taskInfo.waitToFinish()
+        assert taskInfo.stdoutData == b'line1\nline2\n' , 'Expected every line written to the terminal, got %s' %(repr(taskInfo.stdoutData),)
+
+    def test_runChunked(self):
+        args = [ str(i) for i in range(200) ]
+        # Later batches finish first, so output must be put back in argument order
+        sleepCmd = [sys.executable, '-c', 'import sys, time; time.sleep(.2 / (1 + int(sys.argv[1]) // 20)); sys.stdout.write(" ".join(sys.argv[1:]) + "\\n")']
+
+        seenBatches = []
+        results = Simple.runChunked(sleepCmd, args, maxConcurrent=4, maxArgs=20, batchCallback=lambda batchResult : seenBatches.append(batchResult['args'][0]))
+
+        assert results['returnCode'] == 0 , 'Expected return code 0, got %s' %(repr(results['returnCode']),)
+        assert len(results['batches']) == 10 , 'Expected 10 batches of 20 args, got %d' %(len(results['batches']),)
+        assert results['stdout'].split() == args , 'Expected output of all batches in argument order'
+        assert seenBatches == [ str(i) for i in range(0, 200, 20) ] , 'Expected batchCallback to be called in argument order, got %s' %(repr(seenBatches),)
+        for batchResult in results['batches']:
+            assert batchResult['stdout'].split() == batchResult['args'] , 'Expected each batch to have its own output'
+
+        failCmd = [sys.executable, '-c', 'import sys; sys.exit(3 if "7" in sys.argv[1:] else 0)']
+        results = Simple.runChunked(failCmd, args[:10], maxConcurrent=2, maxArgs=5)
+        assert [ batchResult['returnCode'] for batchResult in results['batches'] ] == [0, 3] , 'Expected per-batch return codes, got %s' %(repr(results['batches']),)
+        assert results['returnCode'] == 3 , 'Expected overall return code of the failed batch, got %s' %(repr(results['returnCode']),)
+
+        try:
+            Simple.runChunked(['subprocess2_no_such_command'], args)
+        except subprocess2.SimpleCommandFailure as e:
+            assert e.returnCode == 255 , 'Expected launch failure return code 255, got %s' %(repr(e.returnCode),)
+        else:
+            raise AssertionError('Expected SimpleCommandFailure when the command cannot be started')
+
+    def test_argumentBatches(self):
+        args = [ 'x' * 10 ] * 100
+        argBytes = 10 + 1 + struct.calcsize('P')
+
+        baseBytes = 3 + 1 + struct.calcsize('P')
+
+        batches = getArgumentBatches(['cmd'], args, maxBytes=baseBytes + (argBytes * 30) + 5)
+        assert [ len(batch) for batch in batches ] == [30, 30, 30, 10] , 'Expected batches limited by bytes, got %s' %(repr([ len(batch) for batch in batches ]),)
+        assert sum(batches, []) == args , 'Expected all arguments, in order'
+
+        batches = getArgumentBatches(['cmd'], args, maxArgs=40)
+        assert [ len(batch) for batch in batches ] == [40, 40, 20] , 'Expected batches limited by maxArgs, got %s' %(repr([ len(batch) for batch in batches ]),)
+
+        try:
+            getArgumentBatches(['cmd'], ['y' * 500], maxBytes=200)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('Expected ValueError for an argument which can never fit')
+
+    def test_compress(self):
+        verboseCmd = [sys.executable, '-c', 'import sys\nfor i in range(5000):\n    sys.stdout.write("test %d passed\\n" %(i,))\nsys.stderr.write("summary")']
+        expected = ''.join([ 'test %d passed\n' %(i,) for i in range(5000) ])
+
+        results = Simple.runGetResults(verboseCmd, compress='zlib')
+
+        assert results['returnCode'] == 0 , 'Expected return code 0, got %s' %(repr(results['returnCode']),)
+        assert results['stdout'].getValue() == expected , 'Expected compressed stdout to decompress to the full output'
+        assert results['stderr'].getValue() == 'summary' , 'Expected compressed stderr to decompress, got %s' %(repr(results['stderr'].getValue()),)
+        assert ''.join(results['stdout'].iterData()) == expected , 'Expected iterData to stream out the full output'
+        assert results['compressionRatio'] > 3 , 'Expected repetitive output to compress well, got ratio %s' %(repr(results['compressionRatio']),)
+
+        # 3-byte characters, written a byte at a time so reads end part way through characters
+        splitWriter = 'import os, time\nfor c in b"\\xe2\\x82\\xac" * 3000:\n    os.write(1, bytes([c]))\n'
+        results = Simple.runGetResults([sys.executable, '-c', splitWriter], compress='zlib', encoding='utf-8')
+        assert results['stdout'].getValue() == u'\u20ac' * 3000 , 'Expected characters split across reads to be decoded whole when compressing'
+
+
+if __name__ == '__main__':
+    subprocess.Popen('GoodTests.py "%s"' %(sys.argv[0],), shell=True).wait()
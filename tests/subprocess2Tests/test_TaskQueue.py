@@ -0,0 +1,118 @@
+#!/usr/bin/env GoodTests.py
+
+import os
+import sys
+import subprocess
+import time
+
+import subprocess2
+from subprocess2 import TaskQueue
+
+
+class TestTaskQueue(object):
+    '''
+        Tests the TaskQueue
+    '''
+
+    def setup_class(self):
+        self.dirName = os.path.dirname(__file__)
+        self.sleeperPath = "%s/sleeper.py" %(self.dirName, )
+        if not os.path.exists(self.sleeperPath):
+            sys.stderr.write('ERROR! CANNOT FIND sleeper.py in test directory. Test will fail.\n')
+
+    def _getSleeperCommand(self, sleepTime, returnCode=0):
+        return [self.sleeperPath, str(sleepTime), str(returnCode)]
+
+    def test_maxRunning(self):
+        queue = TaskQueue(maxRunning=2, pollInterval=.01)
+
+        start = time.time()
+        tasks = [ queue.submit(self._getSleeperCommand(.5, i)) for i in range(4) ]
+
+        time.sleep(.25)
+        assert queue.numRunning == 2 , 'Expected 2 tasks running, got %d' %(queue.numRunning, )
+        assert queue.numPending == 2 , 'Expected 2 tasks pending, got %d' %(queue.numPending, )
+        assert [task.isStarted for task in tasks] == [True, True, False, False] , 'Expected first two tasks to be started'
+
+        assert queue.waitAll(timeout=5) is True , 'Expected all tasks to finish'
+        end = time.time()
+
+        assert end - start >= 1 , 'Expected two rounds of .5 seconds, but finished in %f' %(end - start, )
+        assert [task.returnCode for task in tasks] == [0, 1, 2, 3] , 'Expected return codes to match each task, got %s' %(repr([task.returnCode for task in tasks]), )
+
+    def test_priority(self):
+        queue = TaskQueue(maxRunning=1, pollInterval=.01)
+
+        start = time.time()
+        first = queue.submit(self._getSleeperCommand(.3))
+        time.sleep(.1)
+        low = queue.submit(self._getSleeperCommand(.01), priority=0)
+        high = queue.submit(self._getSleeperCommand(.01), priority=10)
+
+        while high.isStarted is False and time.time() - start < 5:
+            time.sleep(.001)
+        assert high.isStarted is True , 'Expected high priority task to start'
+        assert low.isStarted is False , 'Expected low priority task to wait for high priority task'
+
+        assert queue.waitAll(timeout=5) is True , 'Expected all tasks to finish'
+
+    def test_cancelAndLaunchError(self):
+        queue = TaskQueue(maxRunning=1, pollInterval=.01)
+
+        first = queue.submit(self._getSleeperCommand(.3))
+        second = queue.submit(self._getSleeperCommand(.3))
+        missing = queue.submit(['/no/such/executable'])
+
+        assert second.cancel() is True , 'Expected to be able to cancel a pending task'
+        assert second.isFinished is True and second.isCancelled is True , 'Expected cancelled task to be marked finished and cancelled'
+
+        assert queue.waitAll(timeout=5) is True , 'Expected all tasks to finish'
+        assert first.cancel() is False , 'Expected to not be able to cancel a started task'
+        assert second.isStarted is False , 'Expected cancelled task to never start'
+        assert missing.returnCode == 255 and missing.launchError , 'Expected launch failure to set returnCode 255 and launchError'
+
+    def test_decodeSplitCharacters(self):
+        queue = TaskQueue(maxRunning=1, pollInterval=.01, encoding='utf-8')
+
+        # Each 3-byte character is written a byte at a time, so reads will end part way through characters
+        splitWriter = 'import os, sys, time\nfor c in b"\\xe2\\x82\\xac" * 20:\n    os.write(1, bytes([c]))\n    time.sleep(.001)\n'
+        split = queue.submit([sys.executable, '-c', splitWriter])
+        invalid = queue.submit([sys.executable, '-c', 'import os; os.write(1, b"ok\\xff\\xfe")'])
+        after = queue.submit(self._getSleeperCommand(0))
+
+        assert queue.waitAll(timeout=10) is True , 'Expected all tasks to finish (a failed decode must still free the slot)'
+
+        assert split.error is None , 'Expected no error decoding split characters, got %s' %(repr(split.error), )
+        assert split.stdoutData == u'\u20ac' * 20 , 'Expected 20 euro signs, got %s' %(repr(split.stdoutData), )
+
+        assert invalid.isFinished is True , 'Expected task with undecodable output to be marked finished'
+        assert invalid.error and 'UnicodeDecodeError' in invalid.error , 'Expected a UnicodeDecodeError on the task, got %s' %(repr(invalid.error), )
+
+        assert after.returnCode == 0 , 'Expected the next task to run after the failed one, got returnCode %s' %(repr(after.returnCode), )
+
+    def test_badBackgroundKwargs(self):
+        queue = TaskQueue(maxRunning=1, pollInterval=.01)
+
+        for backgroundKwargs in ( { 'compress' : 'bogus' }, { 'records' : 'bogus' }, { 'pipeSize' : -1 }, { 'noSuchArgument' : True } ):
+            try:
+                queue.submit(self._getSleeperCommand(0), backgroundKwargs=backgroundKwargs)
+            except (ValueError, TypeError):
+                pass
+            else:
+                raise AssertionError('Expected submit to reject backgroundKwargs=%s' %(repr(backgroundKwargs), ))
+        assert queue.numPending == 0 , 'Expected rejected tasks to not be queued, got %d pending' %(queue.numPending, )
+
+        # Cannot be checked until the task starts
+        bad = queue.submit(self._getSleeperCommand(5), backgroundKwargs={ 'teeTo' : '/no/such/directory/tee.log' })
+        after = queue.submit(self._getSleeperCommand(0))
+
+        assert queue.waitAll(timeout=10) is True , 'Expected all tasks to finish (a failed background start must still free the slot)'
+        assert bad.isFinished is True and bad.returnCode == 255 , 'Expected failed task to finish with returnCode 255, got %s' %(repr(bad.returnCode), )
+        assert bad.launchError and bad.error , 'Expected failed task to have launchError and error set, got %s' %(repr(bad.launchError), )
+        assert bad.pipe.poll() is not None , 'Expected the process of the failed task to be stopped'
+        assert after.returnCode == 0 , 'Expected the next task to run after the failed one, got returnCode %s' %(repr(after.returnCode), )
+        assert queue.numRunning == 0 , 'Expected no tasks running, got %d' %(queue.numRunning, )
+
+
+if __name__ == '__main__':
+    subprocess.Popen('GoodTests.py "%s"' %(sys.argv[0],), shell=True).wait()
@@ -0,0 +1,191 @@
+#!/usr/bin/env GoodTests.py
+
+import os
+import signal
+import sys
+import subprocess
+import time
+
+import subprocess2
+from subprocess2 import WorkerPool, WorkerJobError
+
+
+class TestWorkerPool(object):
+    '''
+        Tests the WorkerPool
+    '''
+
+    def setup_class(self):
+        self.dirName = os.path.dirname(os.path.abspath(__file__))
+        # Workers import job functions using this process's sys.path
+        if self.dirName not in sys.path:
+            sys.path.insert(0, self.dirName)
+        if not os.path.exists(os.path.join(self.dirName, 'worker_jobs.py')):
+            sys.stderr.write('ERROR! CANNOT FIND worker_jobs.py in test directory. Test will fail.\n')
+
+    def test_results(self):
+        pool = WorkerPool(numWorkers=2)
+        try:
+            jobs = [ pool.submit('worker_jobs:add', i, 10) for i in range(20) ]
+            results = [ job.getResult(timeout=30) for job in jobs ]
+            assert results == [ i + 10 for i in range(20) ] , 'Expected results in order, got %s' %(repr(results), )
+
+            job = pool.submit('worker_jobs:Holder.double', value='ab')
+            assert job.getResult(timeout=30) == 'abab' , 'Expected dotted target with kwargs to work, got %s' %(repr(job.result), )
+
+            pids = set([ job.workerPid for job in jobs ])
+            assert len(pids) <= 2 , 'Expected jobs to be run by at most 2 workers, got %d' %(len(pids), )
+            assert pool.waitAll(timeout=5) is True , 'Expected all jobs to be finished'
+        finally:
+            pool.shutdown()
+
+    def test_captureOutput(self):
+        pool = WorkerPool(numWorkers=1)
+        try:
+            first = pool.submit('worker_jobs:printAndReturn', 'one')
+            second = pool.submit('worker_jobs:printAndReturn', 'two')
+
+            assert second.getResult(timeout=30) == 'two' , 'Expected result "two", got %s' %(repr(second.result), )
+
+            assert first.stdout == 'out one\nraw\n' , 'Expected only the first job\'s stdout, got %s' %(repr(first.stdout), )
+            assert first.stderr == 'err one\n' , 'Expected only the first job\'s stderr, got %s' %(repr(first.stderr), )
+            assert second.stdout == 'out two\nraw\n' , 'Expected only the second job\'s stdout, got %s' %(repr(second.stdout), )
+        finally:
+            pool.shutdown()
+
+    def test_errors(self):
+        pool = WorkerPool(numWorkers=1)
+        try:
+            job = pool.submit('worker_jobs:fail', 'oops')
+            try:
+                job.getResult(timeout=30)
+            except WorkerJobError as e:
+                assert e.excType == 'KeyError' , 'Expected excType of KeyError, got %s' %(repr(e.excType), )
+                assert 'oops' in e.excMessage , 'Expected message to contain "oops", got %s' %(repr(e.excMessage), )
+                assert 'Traceback' in e.traceback , 'Expected traceback from the worker, got %s' %(repr(e.traceback), )
+            else:
+                raise AssertionError('Expected WorkerJobError')
+
+            job = pool.submit('no_such_module_here:func')
+            assert job.waitToFinish(timeout=30) is True , 'Expected job with a missing module to finish'
+            assert job.error is not None and job.error.excType in ('ImportError', 'ModuleNotFoundError') , 'Expected an import error, got %s' %(repr(job.error), )
+
+            oldPid = pool.submit('worker_jobs:getPid').getResult(timeout=30)
+
+            job = pool.submit('worker_jobs:exitWorker')
+            assert job.waitToFinish(timeout=30) is True , 'Expected job whose worker exited to finish'
+            assert job.error is not None and job.error.excType is None , 'Expected a worker exit error, got %s' %(repr(job.error), )
+
+            newPid = pool.submit('worker_jobs:getPid').getResult(timeout=30)
+            assert newPid != oldPid , 'Expected the dead worker to be replaced'
+        finally:
+            pool.shutdown()
+
+    def test_workerExitsAfterShutdown(self):
+        pool = WorkerPool(numWorkers=1)
+        wakeInodes = [ (fd, os.fstat(fd).st_ino) for fd in (pool._wakeReadFd, pool._wakeWriteFd) ]
+        job = pool.submit('worker_jobs:exitWorker')
+        pool.shutdown()
+
+        assert job.waitToFinish(timeout=30) is True , 'Expected job whose worker exited to finish'
+        assert job.error is not None , 'Expected job whose worker exited to have an error'
+        assert pool.waitAll(timeout=10) is True , 'Expected all jobs to be finished'
+
+        pool._dispatcher.join(10)
+        assert not pool._dispatcher.is_alive() , 'Expected dispatcher to exit cleanly after the last worker died'
+        assert not pool._workers , 'Expected no workers left after shutdown, got %s' %(repr(pool._workers), )
+        for (fd, wakeInode) in wakeInodes:
+            try:
+                isClosed = os.fstat(fd).st_ino != wakeInode # (the number may have been reused by another descriptor)
+            except OSError:
+                isClosed = True
+            assert isClosed , 'Expected the dispatcher to close its wake pipe on exit'
+
+    def test_idleWorkerKilled(self):
+        pool = WorkerPool(numWorkers=1)
+        try:
+            # Killed while idle, and given a job right away (before the pool may have noticed)
+            os.kill(pool.submit('worker_jobs:getPid').getResult(timeout=30), signal.SIGKILL)
+            job = pool.submit('worker_jobs:add', 1, 2)
+            assert job.getResult(timeout=30) == 3 , 'Expected job to be run by a replacement worker, got %s' %(repr(job.error), )
+
+            # Killed while idle, and noticed before the next job
+            workerPid = pool.submit('worker_jobs:getPid').getResult(timeout=30)
+            os.kill(workerPid, signal.SIGKILL)
+            time.sleep(.5)
+            assert [ worker.pid for worker in pool._workers ] != [workerPid] , 'Expected the killed idle worker to be replaced'
+
+            job = pool.submit('worker_jobs:add', 2, 2)
+            assert job.getResult(timeout=30) == 4 , 'Expected job to be run by a replacement worker, got %s' %(repr(job.error), )
+        finally:
+            pool.shutdown()
+
+    def test_importWithoutFcntl(self):
+        # fcntl is POSIX only, importing the package must not require it
+        packageParent = os.path.dirname(os.path.dirname(os.path.abspath(subprocess2.__file__)))
+        code = 'import sys; sys.modules["fcntl"] = None; sys.path.insert(0, %s); import subprocess2; print(subprocess2.WorkerPool.__name__)' %(repr(packageParent), )
+        pipe = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (stdoutData, stderrData) = pipe.communicate()
+        assert pipe.returncode == 0 , 'Expected subprocess2 to import without fcntl, got: %s' %(repr(stderrData), )
+        assert stdoutData.strip() == b'WorkerPool' , 'Expected WorkerPool to be importable without fcntl, got %s' %(repr(stdoutData), )
+
+    def test_recycle(self):
+        pool = WorkerPool(numWorkers=1, maxJobsPerWorker=3)
+        try:
+            pids = [ pool.submit('worker_jobs:getPid').getResult(timeout=30) for i in range(7) ]
+        finally:
+            pool.shutdown()
+
+        assert len(set(pids[0:3])) == 1 , 'Expected first 3 jobs on one worker, got %s' %(repr(pids), )
+        assert len(set(pids)) == 3 , 'Expected 3 workers over 7 jobs with maxJobsPerWorker=3, got %s' %(repr(pids), )
+
+    def test_shutdown(self):
+        pool = WorkerPool(numWorkers=1)
+        pool.submit('worker_jobs:add', 1, 2).getResult(timeout=30)
+        workerPid = pool._workers[0].pid
+
+        jobs = [ pool.submit('worker_jobs:add', i, 1) for i in range(50) ]
+        pool.shutdown(cancelPending=True)
+
+        assert pool.waitAll(timeout=30) is True , 'Expected all jobs to be finished or cancelled'
+        assert any([ job.isCancelled for job in jobs ]) , 'Expected some pending jobs to be cancelled'
+        for job in jobs:
+            if job.isCancelled:
+                assert isinstance(job.error, WorkerJobError) , 'Expected cancelled job to have a WorkerJobError'
+
+        try:
+            pool.submit('worker_jobs:add', 1, 2)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('Expected submit after shutdown to raise ValueError')
+
+        # The worker exits once its pipe is closed
+        deadline = time.time() + 10
+        while time.time() < deadline and os.path.exists('/proc/%d/status' %(workerPid, )):
+            time.sleep(.05)
+        if os.path.isdir('/proc/self'):
+            assert not os.path.exists('/proc/%d/status' %(workerPid, )) , 'Expected worker to exit after shutdown'
+
+    def test_faster(self):
+        pool = WorkerPool(numWorkers=1)
+        try:
+            pool.submit('worker_jobs:add', 0, 0).getResult(timeout=30)
+
+            start = time.time()
+            for i in range(20):
+                pool.submit('worker_jobs:add', i, i).getResult(timeout=30)
+            poolTime = time.time() - start
+        finally:
+            pool.shutdown()
+
+        start = time.time()
+        for i in range(5):
+            subprocess2.Simple.runGetOutput([sys.executable, '-c', 'pass'])
+        perStartup = (time.time() - start) / 5
+
+        assert poolTime / 20 < perStartup , 'Expected a pool job (%f s) to be faster than starting python (%f s)' %(poolTime / 20, perStartup)
+
+
+if __name__ == '__main__':
+    subprocess.Popen('GoodTests.py "%s"' %(sys.argv[0],), shell=True).wait()
@@ -0,0 +1,35 @@
+# Functions run as jobs by test_WorkerPool.py. Imported by the workers, so must be importable (not defined in the test itself).
+
+import os
+import sys
+
+
+def add(a, b):
+    return a + b
+
+
+def getPid():
+    return os.getpid()
+
+
+def printAndReturn(value):
+    sys.stdout.write('out %s\n' %(value, ))
+    sys.stderr.write('err %s\n' %(value, ))
+    # Written straight to the descriptor, as C code or a child process would
+    os.write(1, b'raw\n')
+    return value
+
+
+def fail(message):
+    raise KeyError(message)
+
+
+def exitWorker():
+    os._exit(3)
+
+
+class Holder(object):
+
+    @staticmethod
+    def double(value):
+        return value * 2